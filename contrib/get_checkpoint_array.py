@@ -1,11 +1,11 @@
 #!/usr/bin/env python3
 from json import loads, dumps
 from sys import exit, argv
-import base64, requests, json
+import base64, requests, json, sys
 
 
 if len(argv) < 5:
-    print('Arguments: <rpc_username> <rpc_password> <rpc domain name> <rpc_port>')
+    print('Arguments: <rpc_username> <rpc_password> <rpc domain name> <rpc_port> [<headers snapshot file> [<signing address>]]')
     sys.exit(1)
 
 # From electrum-cat.
@@ -81,3 +81,29 @@ while True:
 
 with open('checkpoints_output.json', 'w+') as f:
     f.write(dumps(checkpoints, indent=4, separators=(',', ':')))
+
+if len(argv) > 5:
+    # Also write a headers snapshot, from the start of the last checkpointed chunk up to the tip.
+    # To sign it, the node's wallet needs the key of the signing address.
+    from electrum_cat.blockchain import HeadersSnapshot, chainwork_of_target
+
+    max_checkpoint = len(checkpoints) * 2016 - 1
+    first_height = (len(checkpoints) - 1) * 2016
+    chainwork = sum(2016 * chainwork_of_target(target) for _, target, _ in checkpoints)
+    data = []
+    for height in range(first_height, block_count + 1):
+        h = rpc('getblockhash', [height])['result']
+        raw_header = bytes.fromhex(rpc('getblockheader', [h, False])['result'])
+        if height > max_checkpoint:
+            chainwork += chainwork_of_target(bits_to_target(int.from_bytes(raw_header[72:76], byteorder='little')))
+        data.append(raw_header)
+        if height % 2016 == 0:
+            print(f"At header {height}")
+    snapshot = HeadersSnapshot(first_height=first_height, data=b''.join(data), chainwork=chainwork,
+                               max_checkpoint=max_checkpoint)
+    if len(argv) > 6:
+        signature = rpc('signmessage', [argv[6], snapshot.message_to_sign()])['result']
+        snapshot = snapshot._replace(signer=argv[6], signature=base64.b64decode(signature))
+    with open(argv[5], 'wb') as f:
+        f.write(snapshot.serialize())
+    print(f"Wrote headers snapshot up to height {snapshot.tip()}")
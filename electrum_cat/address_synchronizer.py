@@ -22,16 +22,18 @@
 # SOFTWARE.
 
 import asyncio
+import bisect
 import threading
 import itertools
 from collections import defaultdict
-from typing import TYPE_CHECKING, Dict, Optional, Set, Tuple, NamedTuple, Sequence, List
+from typing import TYPE_CHECKING, Dict, Optional, Set, Tuple, NamedTuple, Sequence, List, Iterable
 
 from .crypto import sha256
-from . import bitcoin, util
+from . import util
 from .bitcoin import COINBASE_MATURITY
-from .util import profiler, bfh, TxMinedInfo, UnrelatedTransactionException, with_lock, OldTaskGroup
+from .util import profiler, bfh, TxMinedInfo, UnrelatedTransactionException, with_lock, OldTaskGroup, LRUCache
 from .transaction import Transaction, TxOutput, TxInput, PartialTxInput, TxOutpoint, PartialTransaction, tx_from_any
+from .transaction import get_address_from_output_script
 from .synchronizer import Synchronizer
 from .verifier import SPV
 from .blockchain import hash_header, Blockchain
@@ -60,6 +62,80 @@ class HistoryItem(NamedTuple):
     delta: int
     fee: Optional[int]
     balance: int
+    monotonic_timestamp: int  # max timestamp of the txs up to this one
+
+
+class _HistoryIndex:
+    """History of a domain of addresses: the txs sorted by
+    (sort height, txpos, txid), with their delta, the running balance
+    and the running max of their timestamps.
+
+    Txs are re-indexed one by one, when they are marked dirty.
+    The running balances are recomputed lazily from the first position
+    that changed: new txs are unconfirmed or local, so they sort last,
+    and that is usually only the tail of the history.
+    """
+
+    def __init__(self, domain: Set[str]):
+        self.domain = domain
+        self.keys = []  # type: List[Tuple[int, int, str]]  # sorted
+        self.deltas = []  # type: List[int]
+        self.timestamps = []  # type: List[int]
+        self.balances = []  # type: List[int]  # only valid up to self._first_changed_pos
+        self.monotonic_timestamps = []  # type: List[int]  # only valid up to self._first_changed_pos
+        self._tx_keys = {}  # type: Dict[str, Tuple[int, int, str]]  # txid -> key
+        self._first_changed_pos = 0
+        self.dirty_txids = set()  # type: Set[str]
+        self.local_height = None  # type: Optional[int]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, txid: str) -> bool:
+        return txid in self._tx_keys
+
+    def remove(self, txid: str) -> None:
+        key = self._tx_keys.pop(txid, None)
+        if key is None:
+            return
+        pos = bisect.bisect_left(self.keys, key)
+        del self.keys[pos]
+        del self.deltas[pos]
+        del self.timestamps[pos]
+        self._first_changed_pos = min(self._first_changed_pos, pos)
+
+    def insert(self, key: Tuple[int, int, str], delta: int, timestamp: int) -> None:
+        txid = key[2]
+        assert txid not in self._tx_keys, txid
+        pos = bisect.bisect_left(self.keys, key)
+        self.keys.insert(pos, key)
+        self.deltas.insert(pos, delta)
+        self.timestamps.insert(pos, timestamp)
+        self._tx_keys[txid] = key
+        self._first_changed_pos = min(self._first_changed_pos, pos)
+
+    def update_balances(self) -> None:
+        pos = self._first_changed_pos
+        del self.balances[pos:]
+        del self.monotonic_timestamps[pos:]
+        balance = self.balances[-1] if self.balances else 0
+        monotonic_timestamp = self.monotonic_timestamps[-1] if self.monotonic_timestamps else 0
+        for delta, timestamp in zip(self.deltas[pos:], self.timestamps[pos:]):
+            balance += delta
+            monotonic_timestamp = max(monotonic_timestamp, timestamp)
+            self.balances.append(balance)
+            self.monotonic_timestamps.append(monotonic_timestamp)
+        self._first_changed_pos = len(self.keys)
+
+    def get_pos(self, txid: str) -> Optional[int]:
+        key = self._tx_keys.get(txid)
+        if key is None:
+            return None
+        return bisect.bisect_left(self.keys, key)
+
+    def bisect_sort_height(self, sort_height: int) -> int:
+        """Returns the position of the first tx with a sort height >= sort_height."""
+        return bisect.bisect_left(self.keys, (sort_height,))
 
 
 class AddressSynchronizer(Logger, EventListener):
@@ -91,6 +167,7 @@ class AddressSynchronizer(Logger, EventListener):
         self.threadlocal_cache = threading.local()
 
         self._get_balance_cache = {}
+        self._history_indexes = LRUCache(maxsize=4)  # type: LRUCache[frozenset, _HistoryIndex]  # domain -> index
 
         self.load_and_cleanup()
 
@@ -105,6 +182,7 @@ class AddressSynchronizer(Logger, EventListener):
 
     def load_and_cleanup(self):
         self.load_local_history()
+        self.load_utxo_index()
         self.check_history()
         self.load_unverified_transactions()
         self.remove_local_transactions_we_dont_have()
@@ -155,9 +233,9 @@ class AddressSynchronizer(Logger, EventListener):
             d = self.db.get_txo_addr(prevout_hash, addr)
             if prevout_n in d:
                 return addr
-        tx = self.db.get_transaction(prevout_hash)
-        if tx:
-            return tx.outputs()[prevout_n].address
+        outputs = self.db.get_tx_outputs(prevout_hash)
+        if outputs:
+            return get_address_from_output_script(outputs[prevout_n][0])
         return None
 
     def get_txin_value(self, txin: TxInput, *, address: str = None) -> Optional[int]:
@@ -174,9 +252,9 @@ class AddressSynchronizer(Logger, EventListener):
                 return v
             except KeyError:
                 pass
-        tx = self.db.get_transaction(prevout_hash)
-        if tx:
-            return tx.outputs()[prevout_n].value
+        outputs = self.db.get_tx_outputs(prevout_hash)
+        if outputs:
+            return outputs[prevout_n][1]
         return None
 
     def load_unverified_transactions(self):
@@ -200,6 +278,8 @@ class AddressSynchronizer(Logger, EventListener):
     def on_event_blockchain_updated(self, *args):
         self._get_balance_cache = {}  # invalidate cache
         self.db.put('stored_height', self.get_local_height())
+        if self.verifier:
+            self.verifier.wakeup()  # proofs might be requestable now, or the chain was switched
 
     async def stop(self):
         if self.network:
@@ -215,10 +295,14 @@ class AddressSynchronizer(Logger, EventListener):
                 self.unregister_callbacks()
 
     def add_address(self, address):
-        if address not in self.db.history:
-            self.db.history[address] = []
-        if self.synchronizer:
-            self.synchronizer.add(address)
+        self.add_addresses([address])
+
+    def add_addresses(self, addresses: Iterable[str]) -> None:
+        for address in addresses:
+            if address not in self.db.history:
+                self.db.history[address] = []
+            if self.synchronizer:
+                self.synchronizer.add(address)
         self.up_to_date_changed()
 
     def get_conflicting_transactions(self, tx: Transaction, *, include_self: bool = False) -> Set[str]:
@@ -241,7 +325,7 @@ class AddressSynchronizer(Logger, EventListener):
                     continue
                 # this outpoint has already been spent, by spending_tx
                 # annoying assert that has revealed several bugs over time:
-                assert self.db.get_transaction(spending_tx_hash), "spending tx not in wallet db"
+                assert self.db.has_transaction(spending_tx_hash), "spending tx not in wallet db"
                 conflicting_txns |= {spending_tx_hash}
             if tx_hash := tx.txid():
                 if tx_hash in conflicting_txns:
@@ -280,89 +364,158 @@ class AddressSynchronizer(Logger, EventListener):
         # we need self.transaction_lock but get_tx_height will take self.lock
         # so we need to take that too here, to enforce order of locks
         with self.lock, self.transaction_lock:
-            # NOTE: returning if tx in self.transactions might seem like a good idea
-            # BUT we track is_mine inputs in a txn, and during subsequent calls
-            # of add_transaction tx, we might learn of more-and-more inputs of
-            # being is_mine, as we roll the gap_limit forward
-            is_coinbase = tx.inputs()[0].is_coinbase_input()
-            tx_height = self.get_tx_height(tx_hash).height
-            if not allow_unrelated:
-                # note that during sync, if the transactions are not properly sorted,
-                # it could happen that we think tx is unrelated but actually one of the inputs is is_mine.
-                # this is the main motivation for allow_unrelated
-                is_mine = any([self.is_mine(self.get_txin_address(txin)) for txin in tx.inputs()])
-                is_for_me = any([self.is_mine(txo.address) for txo in tx.outputs()])
-                if not is_mine and not is_for_me:
-                    raise UnrelatedTransactionException()
-            # Find all conflicting transactions.
-            # In case of a conflict,
-            #     1. confirmed > mempool > local
-            #     2. this new txn has priority over existing ones
-            # When this method exits, there must NOT be any conflict, so
-            # either keep this txn and remove all conflicting (along with dependencies)
-            #     or drop this txn
-            conflicting_txns = self.get_conflicting_transactions(tx)
-            if conflicting_txns:
-                existing_mempool_txn = any(
-                    self.get_tx_height(tx_hash2).height in (TX_HEIGHT_UNCONFIRMED, TX_HEIGHT_UNCONF_PARENT)
-                    for tx_hash2 in conflicting_txns)
-                existing_confirmed_txn = any(
-                    self.get_tx_height(tx_hash2).height > 0
-                    for tx_hash2 in conflicting_txns)
-                if existing_confirmed_txn and tx_height <= 0:
-                    # this is a non-confirmed tx that conflicts with confirmed txns; drop.
-                    return False
-                if existing_mempool_txn and tx_height == TX_HEIGHT_LOCAL:
-                    # this is a local tx that conflicts with non-local txns; drop.
-                    return False
-                # keep this txn and remove all conflicting
-                for tx_hash2 in conflicting_txns:
-                    self.remove_transaction(tx_hash2)
-            # add inputs
-            def add_value_from_prev_output():
-                # note: this takes linear time in num is_mine outputs of prev_tx
-                addr = self.get_txin_address(txi)
-                if addr and self.is_mine(addr):
-                    outputs = self.db.get_txo_addr(prevout_hash, addr)
-                    try:
-                        v, is_cb = outputs[prevout_n]
-                    except KeyError:
-                        pass
-                    else:
-                        self.db.add_txi_addr(tx_hash, addr, ser, v)
-                        self._get_balance_cache.clear()  # invalidate cache
-            for txi in tx.inputs():
-                if txi.is_coinbase_input():
-                    continue
-                prevout_hash = txi.prevout.txid.hex()
-                prevout_n = txi.prevout.out_idx
-                ser = txi.prevout.to_str()
-                self.db.set_spent_outpoint(prevout_hash, prevout_n, tx_hash)
-                add_value_from_prev_output()
-            # add outputs
-            for n, txo in enumerate(tx.outputs()):
-                v = txo.value
-                ser = tx_hash + ':%d'%n
-                scripthash = bitcoin.script_to_scripthash(txo.scriptpubkey)
-                self.db.add_prevout_by_scripthash(scripthash, prevout=TxOutpoint.from_str(ser), value=v)
-                addr = txo.address
-                if addr and self.is_mine(addr):
-                    self.db.add_txo_addr(tx_hash, addr, n, v, is_coinbase)
-                    self._get_balance_cache.clear()  # invalidate cache
-                    # give v to txi that spends me
-                    next_tx = self.db.get_spent_outpoint(tx_hash, n)
-                    if next_tx is not None:
-                        self.db.add_txi_addr(next_tx, addr, ser, v)
-                        self._add_tx_to_local_history(next_tx)
-            # add to local history
-            self._add_tx_to_local_history(tx_hash)
-            # save
-            self.db.add_transaction(tx_hash, tx)
-            self.db.add_num_inputs_to_tx(tx_hash, len(tx.inputs()))
+            if not self._add_transaction(tx, tx_hash, allow_unrelated=allow_unrelated):
+                return False
+            self._get_balance_cache.clear()  # invalidate cache
             if is_new:
                 util.trigger_callback('adb_added_tx', self, tx_hash, tx)
             return True
 
+    def add_transactions(self, txs: Sequence[Transaction], *, allow_unrelated=False) -> Set[str]:
+        """Adds a batch of transactions, e.g. received during the initial sync.
+
+        Transactions are added parents first. The balance cache is invalidated
+        and a single 'adb_added_txs' event is triggered at the end of the batch,
+        with the transactions that were not stored yet.
+        Unrelated transactions are skipped, unless allow_unrelated.
+        Returns the txids of the transactions that were added.
+        """
+        added = []
+        num_updated = 0  # already stored, added again
+        with self.lock, self.transaction_lock:
+            for tx in self._sort_txs_topologically(txs):
+                tx_hash = tx.txid()
+                if tx_hash is None:
+                    raise Exception("cannot add tx without txid to wallet history")
+                if isinstance(tx, PartialTransaction):
+                    tx_from_any(str(tx))  # see if raises (no-side-effects)
+                is_new = not self.db.has_transaction(tx_hash)
+                try:
+                    if not self._add_transaction(tx, tx_hash, allow_unrelated=allow_unrelated):
+                        continue
+                except UnrelatedTransactionException:
+                    continue
+                if is_new:
+                    added.append((tx_hash, tx))
+                else:
+                    num_updated += 1
+            if added or num_updated:
+                self._get_balance_cache.clear()  # invalidate cache
+            if added:
+                util.trigger_callback('adb_added_txs', self, added)
+        return {tx_hash for tx_hash, tx in added}
+
+    @staticmethod
+    def _sort_txs_topologically(txs: Sequence[Transaction]) -> List[Transaction]:
+        """Returns txs (without duplicates), parents before their children."""
+        txs_by_txid = {tx.txid(): tx for tx in txs}
+        children = defaultdict(list)  # type: Dict[str, List[str]]
+        num_parents = {}  # type: Dict[str, int]
+        for txid, tx in txs_by_txid.items():
+            parents = {txin.prevout.txid.hex() for txin in tx.inputs()}
+            parents.intersection_update(txs_by_txid)
+            num_parents[txid] = len(parents)
+            for parent in parents:
+                children[parent].append(txid)
+        todo = [txid for txid, n in num_parents.items() if n == 0]
+        result = []
+        while todo:
+            txid = todo.pop()
+            result.append(txs_by_txid[txid])
+            for child in children[txid]:
+                num_parents[child] -= 1
+                if num_parents[child] == 0:
+                    todo.append(child)
+        return result
+
+    def _add_transaction(self, tx: Transaction, tx_hash: str, *, allow_unrelated: bool) -> bool:
+        """Adds tx to the history, without invalidating the balance cache
+        nor triggering callbacks. Caller must hold the locks.
+        """
+        # NOTE: returning if tx in self.transactions might seem like a good idea
+        # BUT we track is_mine inputs in a txn, and during subsequent calls
+        # of add_transaction tx, we might learn of more-and-more inputs of
+        # being is_mine, as we roll the gap_limit forward
+        is_coinbase = tx.inputs()[0].is_coinbase_input()
+        tx_height = self.get_tx_height(tx_hash).height
+        if not allow_unrelated:
+            # note that during sync, if the transactions are not properly sorted,
+            # it could happen that we think tx is unrelated but actually one of the inputs is is_mine.
+            # this is the main motivation for allow_unrelated
+            is_mine = any([self.is_mine(self.get_txin_address(txin)) for txin in tx.inputs()])
+            is_for_me = any([self.is_mine(txo.address) for txo in tx.outputs()])
+            if not is_mine and not is_for_me:
+                raise UnrelatedTransactionException()
+        # Find all conflicting transactions.
+        # In case of a conflict,
+        #     1. confirmed > mempool > local
+        #     2. this new txn has priority over existing ones
+        # When this method exits, there must NOT be any conflict, so
+        # either keep this txn and remove all conflicting (along with dependencies)
+        #     or drop this txn
+        conflicting_txns = self.get_conflicting_transactions(tx)
+        if conflicting_txns:
+            existing_mempool_txn = any(
+                self.get_tx_height(tx_hash2).height in (TX_HEIGHT_UNCONFIRMED, TX_HEIGHT_UNCONF_PARENT)
+                for tx_hash2 in conflicting_txns)
+            existing_confirmed_txn = any(
+                self.get_tx_height(tx_hash2).height > 0
+                for tx_hash2 in conflicting_txns)
+            if existing_confirmed_txn and tx_height <= 0:
+                # this is a non-confirmed tx that conflicts with confirmed txns; drop.
+                return False
+            if existing_mempool_txn and tx_height == TX_HEIGHT_LOCAL:
+                # this is a local tx that conflicts with non-local txns; drop.
+                return False
+            # keep this txn and remove all conflicting
+            for tx_hash2 in conflicting_txns:
+                self.remove_transaction(tx_hash2)
+        # add inputs
+        def add_value_from_prev_output():
+            # note: this takes linear time in num is_mine outputs of prev_tx
+            addr = self.get_txin_address(txi)
+            if addr and self.is_mine(addr):
+                outputs = self.db.get_txo_addr(prevout_hash, addr)
+                try:
+                    v, is_cb = outputs[prevout_n]
+                except KeyError:
+                    pass
+                else:
+                    self.db.add_txi_addr(tx_hash, addr, ser, v)
+                    self._add_spent_coin_to_index(txi.prevout, tx_hash)
+        for txi in tx.inputs():
+            if txi.is_coinbase_input():
+                continue
+            prevout_hash = txi.prevout.txid.hex()
+            prevout_n = txi.prevout.out_idx
+            ser = txi.prevout.to_str()
+            self.db.set_spent_outpoint(prevout_hash, prevout_n, tx_hash)
+            add_value_from_prev_output()
+        # add outputs
+        tx_hash_bytes = bytes.fromhex(tx_hash)  # shared by the outpoints of the tx
+        scripthashes = self.db.get_scripthashes_for_scripts([txo.scriptpubkey for txo in tx.outputs()])
+        for n, (txo, scripthash) in enumerate(zip(tx.outputs(), scripthashes)):
+            v = txo.value
+            ser = tx_hash + ':%d'%n
+            prevout = TxOutpoint(txid=tx_hash_bytes, out_idx=n)
+            self.db.add_prevout_by_scripthash(scripthash, prevout=prevout, value=v)
+            addr = txo.address
+            if addr and self.is_mine(addr):
+                self.db.add_txo_addr(tx_hash, addr, n, v, is_coinbase)
+                self._add_coin_to_index(prevout, addr, v, is_coinbase)
+                # give v to txi that spends me
+                next_tx = self.db.get_spent_outpoint(tx_hash, n)
+                if next_tx is not None:
+                    self.db.add_txi_addr(next_tx, addr, ser, v)
+                    self._add_spent_coin_to_index(prevout, next_tx)
+                    self._add_tx_to_local_history(next_tx)
+        # add to local history
+        self._add_tx_to_local_history(tx_hash)
+        # save
+        self.db.add_transaction(tx_hash, tx)
+        self.db.add_num_inputs_to_tx(tx_hash, len(tx.inputs()))
+        return True
+
     def remove_transaction(self, tx_hash: str) -> None:
         """Removes a transaction AND all its dependents/children
         from the wallet history.
@@ -401,6 +554,7 @@ class AddressSynchronizer(Logger, EventListener):
             self._remove_tx_from_local_history(tx_hash)
             for addr in itertools.chain(self.db.get_txi_addresses(tx_hash), self.db.get_txo_addresses(tx_hash)):
                 self._get_balance_cache.clear()  # invalidate cache
+            self._remove_tx_from_utxo_index(tx_hash)
             self.db.remove_txi(tx_hash)
             self.db.remove_txo(tx_hash)
             self.db.remove_tx_fee(tx_hash)
@@ -408,8 +562,8 @@ class AddressSynchronizer(Logger, EventListener):
             self.unverified_tx.pop(tx_hash, None)
             self.unconfirmed_tx.pop(tx_hash, None)
             if tx:
-                for idx, txo in enumerate(tx.outputs()):
-                    scripthash = bitcoin.script_to_scripthash(txo.scriptpubkey)
+                scripthashes = self.db.get_scripthashes_for_scripts([txo.scriptpubkey for txo in tx.outputs()])
+                for idx, (txo, scripthash) in enumerate(zip(tx.outputs(), scripthashes)):
                     prevout = TxOutpoint(bfh(tx_hash), idx)
                     self.db.remove_prevout_by_scripthash(scripthash, prevout=prevout, value=txo.value)
         util.trigger_callback('adb_removed_tx', self, tx_hash, tx)
@@ -430,12 +584,21 @@ class AddressSynchronizer(Logger, EventListener):
         self.add_unverified_or_unconfirmed_tx(txid, tx_height)
         self.add_transaction(tx, allow_unrelated=True)
 
+    def receive_txs_callback(self, txs: Sequence[Tuple[Transaction, int]]) -> None:
+        """Batch version of receive_tx_callback."""
+        for tx, tx_height in txs:
+            txid = tx.txid()
+            assert txid is not None
+            self.add_unverified_or_unconfirmed_tx(txid, tx_height)
+        self.add_transactions([tx for tx, tx_height in txs], allow_unrelated=True)
+
     def receive_history_callback(self, addr: str, hist, tx_fees: Dict[str, int]):
         with self.lock:
             old_hist = self.get_address_history(addr)
             for tx_hash, height in old_hist.items():
                 if (tx_hash, height) not in hist:
                     # make tx local
+                    self._mark_tx_history_dirty(tx_hash)
                     self.unverified_tx.pop(tx_hash, None)
                     self.unconfirmed_tx.pop(tx_hash, None)
                     self.db.remove_verified_tx(tx_hash)
@@ -467,6 +630,60 @@ class AddressSynchronizer(Logger, EventListener):
         for txid in itertools.chain(self.db.list_txi(), self.db.list_txo()):
             self._add_tx_to_local_history(txid)
 
+    @profiler
+    def load_utxo_index(self):
+        # index of our coins, kept in sync with db.txo and db.txi,
+        # so that balance and coin queries do not have to go through the whole history.
+        # Heights are not indexed: they change without the tx being re-added
+        # (verification, reorgs, ...), so they are looked up with get_tx_height.
+        # Outpoints are binary (TxOutpoint), the outpoints of a tx share its txid bytes.
+        self._coins = {}  # type: Dict[TxOutpoint, Tuple[str, int, bool]]  # outpoint -> (address, value, is_coinbase)
+        self._coins_by_addr = defaultdict(set)  # type: Dict[str, Set[TxOutpoint]]  # address -> set(outpoint)
+        self._utxos_by_addr = defaultdict(set)  # type: Dict[str, Set[TxOutpoint]]  # address -> set(unspent outpoint)
+        self._spent_coins = {}  # type: Dict[TxOutpoint, str]  # outpoint -> spending txid
+        for txid in self.db.list_txo():
+            txid_bytes = bytes.fromhex(txid)
+            for addr in self.db.get_txo_addresses(txid):
+                for n, (v, is_cb) in self.db.get_txo_addr(txid, addr).items():
+                    self._add_coin_to_index(TxOutpoint(txid=txid_bytes, out_idx=n), addr, v, is_cb)
+        for txid in self.db.list_txi():
+            for addr in self.db.get_txi_addresses(txid):
+                for ser, v in self.db.get_txi_addr(txid, addr):
+                    self._add_spent_coin_to_index(TxOutpoint.from_str(ser), txid)
+
+    def _add_coin_to_index(self, prevout: TxOutpoint, addr: str, value: int, is_coinbase: bool) -> None:
+        self._coins[prevout] = addr, value, is_coinbase
+        self._coins_by_addr[addr].add(prevout)
+        if prevout not in self._spent_coins:
+            self._utxos_by_addr[addr].add(prevout)
+
+    def _add_spent_coin_to_index(self, prevout: TxOutpoint, spending_txid: str) -> None:
+        self._spent_coins[prevout] = spending_txid
+        coin = self._coins.get(prevout)
+        if coin is not None:
+            self._utxos_by_addr[coin[0]].discard(prevout)
+
+    def _remove_tx_from_utxo_index(self, tx_hash: str) -> None:
+        """Undoes the effects of tx_hash on the index.
+        Must be called before its txi and txo are removed from the db.
+        """
+        for addr in self.db.get_txi_addresses(tx_hash):
+            for ser, v in self.db.get_txi_addr(tx_hash, addr):
+                prevout = TxOutpoint.from_str(ser)
+                if self._spent_coins.get(prevout) != tx_hash:
+                    continue
+                self._spent_coins.pop(prevout)
+                coin = self._coins.get(prevout)
+                if coin is not None:
+                    self._utxos_by_addr[coin[0]].add(prevout)
+        tx_hash_bytes = bytes.fromhex(tx_hash)
+        for addr in self.db.get_txo_addresses(tx_hash):
+            for n in self.db.get_txo_addr(tx_hash, addr):
+                prevout = TxOutpoint(txid=tx_hash_bytes, out_idx=n)
+                self._coins.pop(prevout, None)
+                self._coins_by_addr[addr].discard(prevout)
+                self._utxos_by_addr[addr].discard(prevout)
+
     @profiler
     def check_history(self):
         hist_addrs_mine = list(filter(lambda k: self.is_mine(k), self.db.get_history()))
@@ -485,7 +702,7 @@ class AddressSynchronizer(Logger, EventListener):
     def remove_local_transactions_we_dont_have(self):
         for txid in itertools.chain(self.db.list_txi(), self.db.list_txo()):
             tx_height = self.get_tx_height(txid).height
-            if tx_height == TX_HEIGHT_LOCAL and not self.db.get_transaction(txid):
+            if tx_height == TX_HEIGHT_LOCAL and not self.db.has_transaction(txid):
                 self.remove_transaction(txid)
 
     def clear_history(self):
@@ -493,6 +710,8 @@ class AddressSynchronizer(Logger, EventListener):
             with self.transaction_lock:
                 self.db.clear_history()
                 self._history_local.clear()
+                self._history_indexes.clear()
+                self.load_utxo_index()
                 self._get_balance_cache.clear()  # invalidate cache
 
     def _get_tx_sort_key(self, tx_hash: str) -> Tuple[int, int]:
@@ -531,46 +750,111 @@ class AddressSynchronizer(Logger, EventListener):
                 self.threadlocal_cache.local_height = orig_val
         return f
 
+    def _mark_tx_history_dirty(self, txid: str) -> None:
+        """The delta or the position of txid in the history might have changed."""
+        for index in self._history_indexes.values():
+            index.dirty_txids.add(txid)
+
+    def _get_history_index(self, domain: Set[str]) -> _HistoryIndex:
+        domain = frozenset(domain)
+        index = self._history_indexes.get(domain)
+        if index is None:
+            index = _HistoryIndex(domain)
+            for addr in domain:
+                index.dirty_txids |= self._history_local.get(addr, set())
+            self._history_indexes[domain] = index
+        # future txs become local when the chain reaches their wanted height
+        local_height = self.get_local_height()
+        if index.local_height != local_height:
+            index.dirty_txids |= self.future_tx.keys()
+            index.local_height = local_height
+        for txid in index.dirty_txids:
+            index.remove(txid)
+            addrs = set(itertools.chain(self.db.get_txi_addresses(txid), self.db.get_txo_addresses(txid)))
+            addrs &= domain
+            if not addrs:
+                continue
+            delta = sum(self.get_tx_delta(txid, addr) for addr in addrs)
+            height, txpos = self._get_tx_sort_key(txid)
+            timestamp = self.get_tx_height(txid).timestamp or TX_TIMESTAMP_INF
+            index.insert((height, txpos, txid), delta, timestamp)
+        index.dirty_txids.clear()
+        index.update_balances()
+        return index
+
+    def _get_history_item(self, index: _HistoryIndex, pos: int) -> HistoryItem:
+        txid = index.keys[pos][2]
+        return HistoryItem(
+            txid=txid,
+            tx_mined_status=self.get_tx_height(txid),
+            delta=index.deltas[pos],
+            fee=self.get_tx_fee(txid),
+            balance=index.balances[pos],
+            monotonic_timestamp=index.monotonic_timestamps[pos])
+
     @with_lock
     @with_transaction_lock
     @with_local_height_cached
-    def get_history(self, domain) -> Sequence[HistoryItem]:
-        domain = set(domain)
-        # 1. Get the history of each address in the domain, maintain the
-        #    delta of a tx as the sum of its deltas on domain addresses
-        tx_deltas = defaultdict(int)  # type: Dict[str, int]
-        for addr in domain:
-            h = self.get_address_history(addr).items()
-            for tx_hash, height in h:
-                tx_deltas[tx_hash] += self.get_tx_delta(tx_hash, addr)
-        # 2. create sorted history
-        history = []
-        for tx_hash in tx_deltas:
-            delta = tx_deltas[tx_hash]
-            tx_mined_status = self.get_tx_height(tx_hash)
-            fee = self.get_tx_fee(tx_hash)
-            history.append((tx_hash, tx_mined_status, delta, fee))
-        history.sort(key = lambda x: self._get_tx_sort_key(x[0]))
-        # 3. add balance
-        h2 = []
-        balance = 0
-        for tx_hash, tx_mined_status, delta, fee in history:
-            balance += delta
-            h2.append(HistoryItem(
-                txid=tx_hash,
-                tx_mined_status=tx_mined_status,
-                delta=delta,
-                fee=fee,
-                balance=balance))
-        # sanity check
-        c, u, x = self.get_balance(domain)
-        if balance != c + u + x:
-            self.logger.error(f'sanity check failed! c={c},u={u},x={x} while history balance={balance}')
-            raise Exception("wallet.get_history() failed balance sanity-check")
+    def get_history(
+            self,
+            domain,
+            *,
+            from_height: int = None,
+            to_height: int = None,
+            after_txid: str = None,
+            limit: int = None,
+    ) -> Sequence[HistoryItem]:
+        """Returns the history of domain, oldest first.
+
+        from_height, to_height: only txs mined in [from_height, to_height).
+            Unconfirmed and local txs are included by from_height, but not by to_height.
+        after_txid, limit: pagination. Returns at most limit items, after after_txid.
+        Pages cost O(log(n) + limit).
+        """
+        index = self._get_history_index(domain)
+        start, end = 0, len(index)
+        if from_height is not None:
+            start = index.bisect_sort_height(max(from_height, 1))
+        if to_height is not None:
+            end = index.bisect_sort_height(max(to_height, 1))
+        if after_txid is not None:
+            pos = index.get_pos(after_txid)
+            if pos is None:
+                raise KeyError(f"tx not in history: {after_txid}")
+            start = max(start, pos + 1)
+        if limit is not None:
+            end = min(end, start + max(limit, 0))
+        h2 = [self._get_history_item(index, pos) for pos in range(start, end)]
+        if self.config.WALLET_HISTORY_SANITY_CHECK and (start, end) == (0, len(index)):
+            balance = h2[-1].balance if h2 else 0
+            c, u, x = self.get_balance(domain)
+            if balance != c + u + x:
+                self.logger.error(f'sanity check failed! c={c},u={u},x={x} while history balance={balance}')
+                raise Exception("wallet.get_history() failed balance sanity-check")
         return h2
 
+    @with_lock
+    @with_transaction_lock
+    @with_local_height_cached
+    def get_balance_at_timestamp(self, domain, target_timestamp: int) -> int:
+        """Returns the balance of domain before the first tx that is unconfirmed
+        or mined after target_timestamp.
+        Block timestamps are assumed to be monotonic (which is false...!)
+        """
+        index = self._get_history_index(domain)
+        lo, hi = 0, len(index)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            timestamp = self.get_tx_height(index.keys[mid][2]).timestamp
+            if timestamp is None or timestamp > target_timestamp:
+                hi = mid
+            else:
+                lo = mid + 1
+        return index.balances[lo - 1] if lo > 0 else 0
+
     def _add_tx_to_local_history(self, txid):
         with self.transaction_lock:
+            self._mark_tx_history_dirty(txid)
             for addr in itertools.chain(self.db.get_txi_addresses(txid), self.db.get_txo_addresses(txid)):
                 cur_hist = self._history_local.get(addr, set())
                 cur_hist.add(txid)
@@ -579,6 +863,7 @@ class AddressSynchronizer(Logger, EventListener):
 
     def _remove_tx_from_local_history(self, txid):
         with self.transaction_lock:
+            self._mark_tx_history_dirty(txid)
             for addr in itertools.chain(self.db.get_txi_addresses(txid), self.db.get_txo_addresses(txid)):
                 cur_hist = self._history_local.get(addr, set())
                 try:
@@ -615,26 +900,32 @@ class AddressSynchronizer(Logger, EventListener):
                 with self.lock:
                     self.db.remove_verified_tx(tx_hash)
                     self.unconfirmed_tx[tx_hash] = tx_height
+                    self._mark_tx_history_dirty(tx_hash)
                 if self.verifier:
                     self.verifier.remove_spv_proof_for_tx(tx_hash)
         else:
             with self.lock:
+                self._mark_tx_history_dirty(tx_hash)
                 if tx_height > 0:
                     self.unverified_tx[tx_hash] = tx_height
                 else:
                     self.unconfirmed_tx[tx_hash] = tx_height
+            if tx_height > 0 and self.verifier:
+                self.verifier.wakeup()
 
     def remove_unverified_tx(self, tx_hash, tx_height):
         with self.lock:
             new_height = self.unverified_tx.get(tx_hash)
             if new_height == tx_height:
                 self.unverified_tx.pop(tx_hash, None)
+                self._mark_tx_history_dirty(tx_hash)
 
     def add_verified_tx(self, tx_hash: str, info: TxMinedInfo):
         # Remove from the unverified map and add to the verified map
         with self.lock:
             self.unverified_tx.pop(tx_hash, None)
             self.db.add_verified_tx(tx_hash, info)
+            self._mark_tx_history_dirty(tx_hash)
         util.trigger_callback('adb_added_verified_tx', self, tx_hash)
 
     def get_unverified_txs(self) -> Dict[str, int]:
@@ -663,7 +954,10 @@ class AddressSynchronizer(Logger, EventListener):
                         # into unverified_tx with the old height, and if we get
                         # a status update, that will overwrite it.
                         self.unverified_tx[tx_hash] = tx_height
+                        self._mark_tx_history_dirty(tx_hash)
                         txs.add(tx_hash)
+            if txs:
+                self._get_balance_cache.clear()  # invalidate cache
 
         for tx_hash in txs:
             util.trigger_callback('adb_removed_verified_tx', self, tx_hash)
@@ -685,6 +979,7 @@ class AddressSynchronizer(Logger, EventListener):
         with self.lock:
             old_height = self.future_tx.get(txid) or None
             self.future_tx[txid] = wanted_height
+            self._mark_tx_history_dirty(txid)
         if old_height != wanted_height:
             util.trigger_callback('adb_set_future_tx', self, txid)
 
@@ -822,33 +1117,28 @@ class AddressSynchronizer(Logger, EventListener):
                     sent[txi] = tx_hash, height, txpos
         return received, sent
 
+    def _get_coin(self, prevout: TxOutpoint) -> PartialTxInput:
+        address, value, is_cb = self._coins[prevout]
+        tx_mined_info = self.get_tx_height(prevout.txid.hex())
+        utxo = PartialTxInput(prevout=prevout, is_coinbase_output=is_cb)
+        utxo._trusted_address = address
+        utxo._trusted_value_sats = value
+        utxo.block_height = tx_mined_info.height
+        utxo.block_txpos = tx_mined_info.txpos if tx_mined_info.txpos is not None else -1
+        spent_txid = self._spent_coins.get(prevout)
+        utxo.spent_txid = spent_txid
+        utxo.spent_height = self.get_tx_height(spent_txid).height if spent_txid else None
+        return utxo
+
     def get_addr_outputs(self, address: str) -> Dict[TxOutpoint, PartialTxInput]:
-        received, sent = self.get_addr_io(address)
-        out = {}
-        for prevout_str, v in received.items():
-            tx_height, tx_pos, value, is_cb = v
-            prevout = TxOutpoint.from_str(prevout_str)
-            utxo = PartialTxInput(prevout=prevout, is_coinbase_output=is_cb)
-            utxo._trusted_address = address
-            utxo._trusted_value_sats = value
-            utxo.block_height = tx_height
-            utxo.block_txpos = tx_pos
-            if prevout_str in sent:
-                txid, height, pos = sent[prevout_str]
-                utxo.spent_txid = txid
-                utxo.spent_height = height
-            else:
-                utxo.spent_txid = None
-                utxo.spent_height = None
-            out[prevout] = utxo
-        return out
+        with self.lock, self.transaction_lock:
+            coins = [self._get_coin(prevout) for prevout in self._coins_by_addr.get(address, ())]
+        return {utxo.prevout: utxo for utxo in coins}
 
     def get_addr_utxo(self, address: str) -> Dict[TxOutpoint, PartialTxInput]:
-        out = self.get_addr_outputs(address)
-        for k, v in list(out.items()):
-            if v.spent_height is not None:
-                out.pop(k)
-        return out
+        with self.lock, self.transaction_lock:
+            coins = [self._get_coin(prevout) for prevout in self._utxos_by_addr.get(address, ())]
+        return {utxo.prevout: utxo for utxo in coins}
 
     # return the total amount ever received by an address
     def get_addr_received(self, address):
@@ -878,43 +1168,29 @@ class AddressSynchronizer(Logger, EventListener):
         if cached_value:
             return cached_value
 
-        coins = {}
-        for address in domain:
-            coins.update(self.get_addr_outputs(address))
-
+        excluded_prevouts = {TxOutpoint.from_str(x) for x in excluded_coins}
         c = u = x = 0
         mempool_height = self.get_local_height() + 1  # height of next block
-        for utxo in coins.values():  # type: PartialTxInput
-            if utxo.spent_height is not None:
-                continue
-            if utxo.prevout.to_str() in excluded_coins:
-                continue
-            v = utxo.value_sats()
-            tx_height = utxo.block_height
-            is_cb = utxo.is_coinbase_output()
-            if is_cb and tx_height + COINBASE_MATURITY > mempool_height:
-                x += v
-            elif tx_height > 0:
-                c += v
-            else:
-                txid = utxo.prevout.txid.hex()
-                tx = self.db.get_transaction(txid)
-                assert tx is not None # txid comes from get_addr_io
-                # we look at the outputs that are spent by this transaction
-                # if those outputs are ours and confirmed, we count this coin as confirmed
-                confirmed_spent_amount = 0
-                for txin in tx.inputs():
-                    if txin.prevout in coins:
-                        coin = coins[txin.prevout]
-                        if coin.block_height > 0:
-                            confirmed_spent_amount += coin.value_sats()
-                # Compare amount, in case tx has confirmed and unconfirmed inputs, or is a coinjoin.
-                # (fixme: tx may have multiple change outputs)
-                if confirmed_spent_amount >= v:
+        for address in domain:
+            for prevout in self._utxos_by_addr.get(address, ()):
+                if prevout in excluded_prevouts:
+                    continue
+                _, v, is_cb = self._coins[prevout]
+                txid = prevout.txid.hex()
+                tx_height = self.get_tx_height(txid).height
+                if is_cb and tx_height + COINBASE_MATURITY > mempool_height:
+                    x += v
+                elif tx_height > 0:
                     c += v
                 else:
-                    c += confirmed_spent_amount
-                    u += v - confirmed_spent_amount
+                    confirmed_spent_amount = self._get_confirmed_spent_amount(txid, domain)
+                    # Compare amount, in case tx has confirmed and unconfirmed inputs, or is a coinjoin.
+                    # (fixme: tx may have multiple change outputs)
+                    if confirmed_spent_amount >= v:
+                        c += v
+                    else:
+                        c += confirmed_spent_amount
+                        u += v - confirmed_spent_amount
         result = c, u, x
         # cache result.
         # Cache needs to be invalidated if a transaction is added to/
@@ -922,6 +1198,20 @@ class AddressSynchronizer(Logger, EventListener):
         self._get_balance_cache[cache_key] = result
         return result
 
+    def _get_confirmed_spent_amount(self, txid: str, domain: Set[str]) -> int:
+        """Returns the value of the confirmed coins of domain spent by txid."""
+        # we look at the outputs that are spent by this transaction
+        # if those outputs are ours and confirmed, we count this coin as confirmed.
+        # note: txi has our inputs, so that the tx does not need to be deserialized
+        confirmed_spent_amount = 0
+        for addr in self.db.get_txi_addresses(txid):
+            if addr not in domain:
+                continue
+            for prevout_str, value in self.db.get_txi_addr(txid, addr):
+                if self.get_tx_height(prevout_str.split(':')[0]).height > 0:
+                    confirmed_spent_amount += value
+        return confirmed_spent_amount
+
     @with_local_height_cached
     def get_utxos(
             self,
@@ -947,7 +1237,8 @@ class AddressSynchronizer(Logger, EventListener):
             domain = set(domain) - set(excluded_addresses)
         mempool_height = block_height + 1  # height of next block
         for addr in domain:
-            txos = self.get_addr_outputs(addr)
+            # spent coins are only needed if we look at the past
+            txos = self.get_addr_outputs(addr) if confirmed_spending_only else self.get_addr_utxo(addr)
             for txo in txos.values():
                 if txo.spent_height is not None:
                     if not confirmed_spending_only:
@@ -969,8 +1260,7 @@ class AddressSynchronizer(Logger, EventListener):
         return self.get_address_history_len(address) != 0
 
     def is_empty(self, address: str) -> bool:
-        coins = self.get_addr_utxo(address)
-        return not bool(coins)
+        return not self._utxos_by_addr.get(address)
 
     @with_local_height_cached
     def address_is_old(self, address: str, *, req_conf: int = 3) -> bool:
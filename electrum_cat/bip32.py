@@ -101,6 +101,29 @@ def _CKD_pub(parent_pubkey: bytes, parent_chaincode: bytes, child_index: bytes)
     return child_pubkey, child_chaincode
 
 
+def CKD_pub_range(parent_pubkey: bytes, parent_chaincode: bytes, child_indices: Iterable[int]) -> List[bytes]:
+    """Returns the pubkeys of the children at child_indices, same as CKD_pub.
+    The parent point is parsed only once.
+    """
+    parent_point = ecc.ECPubkey(parent_pubkey)  # parsed once for all the children
+    child_pubkeys = []
+    for child_index in child_indices:
+        if child_index < 0: raise ValueError('the bip32 index needs to be non-negative')
+        if child_index & BIP32_PRIME: raise Exception('not possible to derive hardened child from parent pubkey')
+        I = hmac_oneshot(parent_chaincode, parent_pubkey + child_index.to_bytes(4, byteorder="big"), hashlib.sha512)
+        I_left = ecc.string_to_number(I[0:32])
+        pubkey = None
+        if 0 < I_left < ecc.CURVE_ORDER:
+            pubkey = ecc.GENERATOR * I_left + parent_point
+        if pubkey is None or pubkey.is_at_infinity():
+            # let CKD_pub skip the index
+            child_pubkey, _ = CKD_pub(parent_pubkey, parent_chaincode, child_index)
+        else:
+            child_pubkey = pubkey.get_public_key_bytes(compressed=True)
+        child_pubkeys.append(child_pubkey)
+    return child_pubkeys
+
+
 def xprv_header(xtype: str, *, net=None) -> bytes:
     if net is None:
         net = constants.net
@@ -282,6 +305,13 @@ class BIP32Node(NamedTuple):
                          fingerprint=fingerprint,
                          child_number=child_number)
 
+    def derive_child_pubkeys(self, child_indices: Iterable[int]) -> List[bytes]:
+        """Returns the compressed pubkeys of the non-hardened children
+        at child_indices, e.g. range(0, 1000).
+        """
+        pubkey = self.eckey.get_public_key_bytes(compressed=True)
+        return CKD_pub_range(pubkey, self.chaincode, child_indices)
+
     def calc_fingerprint_of_this_node(self) -> bytes:
         """Returns the fingerprint of this node.
         Note that self.fingerprint is of the *parent*.
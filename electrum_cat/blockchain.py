@@ -20,31 +20,71 @@
 # ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
+import asyncio
+import hashlib
+import itertools
+import mmap
 import os
+import random
+import struct
 import threading
 import time
-from typing import Optional, Dict, Mapping, Sequence, TYPE_CHECKING
+from collections import deque
+from typing import Optional, Dict, List, Mapping, Sequence, Tuple, NamedTuple, BinaryIO, Callable, TYPE_CHECKING
 
 from . import util
-from .bitcoin import hash_encode
+from .bitcoin import hash_encode, verify_usermessage_with_address
 from .crypto import sha256d
 from . import constants
-from .util import bfh, with_lock
+from .util import bfh, with_lock, LRUCache
 from .logging import get_logger, Logger
 
 if TYPE_CHECKING:
     from .simple_config import SimpleConfig
 
+from .scrypt import scrypt_1024_1_1_80
+
+_logger = get_logger(__name__)
+
+HAS_SCRYPT = False
 try:
     import scrypt
-    getPoWHash = lambda x: scrypt.hash(x, x, N=1024, r=1, p=1, buflen=32)
 except ImportError:
-    util.print_msg("Warning: package scrypt not available; synchronization could be very slow")
-    from .scrypt import scrypt_1024_1_1_80 as getPoWHash
+    pass
+else:
+    HAS_SCRYPT = True
 
-_logger = get_logger(__name__)
+# hashlib.scrypt is only available if python was built against OpenSSL 1.1+
+HAS_HASHLIB_SCRYPT = hasattr(hashlib, 'scrypt')
+
+if not (HAS_SCRYPT or HAS_HASHLIB_SCRYPT):
+    util.print_msg("Warning: package scrypt not available; synchronization could be very slow")
 
 HEADER_SIZE = 80  # bytes
+# number of deserialized headers kept in memory, per Blockchain
+# (target calculation and SPV checks read the same recent headers over and over)
+HEADERS_CACHE_SIZE = 4032
+
+# Each headers file has a sidecar index, with one record per height above the max checkpoint:
+# cumulative chainwork (uint256, big-endian) and bits (uint32, little-endian) of that header.
+CHAINWORK_INDEX_SUFFIX = '.chainwork'
+CHAINWORK_INDEX_MAGIC = b'ECWI'
+CHAINWORK_INDEX_VERSION = 1
+_CHAINWORK_INDEX_HEADER = struct.Struct('<4sBI')  # magic, version, max checkpoint the index was built with
+_CHAINWORK_INDEX_RECORD = struct.Struct('<32sI')
+
+# A headers snapshot lets a new install skip syncing the headers after the last checkpoint.
+# It holds the raw headers from the start of the last checkpointed chunk up to some tip,
+# so that the retarget of every header after the checkpoint can be checked from it alone.
+HEADERS_SNAPSHOT_FILENAME = 'headers_snapshot'
+HEADERS_SNAPSHOT_MAGIC = b'ECHS'
+HEADERS_SNAPSHOT_VERSION = 1
+# magic, version, genesis, first height, num headers, chainwork at tip, max checkpoint the chainwork was computed with
+_HEADERS_SNAPSHOT_HEADER = struct.Struct('<4sB32sII32sI')
+# on import, PoW is only checked for a random sample of the headers after the last checkpoint (and the tip)
+HEADERS_SNAPSHOT_POW_SAMPLE_SIZE = 128
+# more than any of the retarget algorithms looks back
+_RETARGET_WINDOW = 64
 
 # see https://github.com/CatcoinCore/catcoincore/blob/feat/catcoin-v2/src/chainparams.cpp#L82
 MAX_TARGET = 0x00000fffffffffffffffffffffffffffffffffffffffffffffffffffffffffff  # compact: 0x1d00ffff
@@ -58,6 +98,10 @@ class InvalidHeader(Exception):
     pass
 
 
+class HeadersSnapshotError(Exception):
+    pass
+
+
 def serialize_header(header_dict: dict) -> bytes:
     s = (
         int.to_bytes(header_dict['version'], length=4, byteorder="little", signed=False)
@@ -98,6 +142,68 @@ def hash_raw_header(header: bytes) -> str:
     return hash_encode(sha256d(header))
 
 
+def _pow_hashes_scrypt(raw_headers: Sequence[bytes]) -> List[bytes]:
+    _hash = scrypt.hash
+    return [_hash(x, x, N=1024, r=1, p=1, buflen=32) for x in raw_headers]
+
+
+def _pow_hashes_hashlib(raw_headers: Sequence[bytes]) -> List[bytes]:
+    _hash = hashlib.scrypt
+    return [_hash(x, salt=x, n=1024, r=1, p=1, dklen=32) for x in raw_headers]
+
+
+def _pow_hashes_python(raw_headers: Sequence[bytes]) -> List[bytes]:
+    return [scrypt_1024_1_1_80(x) for x in raw_headers]
+
+
+# the available scrypt implementations, fastest first. name -> function hashing a list of raw headers
+POW_HASH_BACKENDS = {}  # type: Dict[str, Callable[[Sequence[bytes]], List[bytes]]]
+if HAS_SCRYPT:
+    POW_HASH_BACKENDS['scrypt'] = _pow_hashes_scrypt
+if HAS_HASHLIB_SCRYPT:
+    POW_HASH_BACKENDS['hashlib'] = _pow_hashes_hashlib
+POW_HASH_BACKENDS['python'] = _pow_hashes_python
+# chosen once, at import time
+_pow_hash_backend = next(iter(POW_HASH_BACKENDS))
+
+
+def get_pow_hash_backend() -> str:
+    """Returns the name of the scrypt implementation used for PoW hashing."""
+    return _pow_hash_backend
+
+
+def getPoWHash(header: bytes) -> bytes:
+    return pow_hash_raw_headers(header)[0]
+
+
+def pow_hash_raw_headers(data: bytes) -> Sequence[bytes]:
+    """Returns the scrypt PoW hashes of all the headers in data,
+    which is the concatenation of serialized headers (e.g. a chunk).
+    """
+    if len(data) % HEADER_SIZE != 0:
+        raise InvalidHeader(f'Invalid headers data length: {len(data)}')
+    raw_headers = [data[i:i+HEADER_SIZE] for i in range(0, len(data), HEADER_SIZE)]
+    return POW_HASH_BACKENDS[_pow_hash_backend](raw_headers)
+
+
+async def pow_hash_raw_headers_in_executor(data: bytes) -> Sequence[bytes]:
+    """Same as pow_hash_raw_headers, but the hashing is done off the event loop,
+    with the headers split between the worker processes (or in a thread, without them).
+    """
+    if len(data) % HEADER_SIZE != 0:
+        raise InvalidHeader(f'Invalid headers data length: {len(data)}')
+    executor, num_workers = util.get_worker_pool()
+    num_headers = len(data) // HEADER_SIZE
+    slice_size = max(1, -(-num_headers // num_workers)) * HEADER_SIZE
+    loop = asyncio.get_running_loop()
+    futures = [loop.run_in_executor(executor, pow_hash_raw_headers, data[i:i+slice_size])
+               for i in range(0, len(data), slice_size)]
+    pow_hashes = []
+    for hashes in await asyncio.gather(*futures):
+        pow_hashes.extend(hashes)
+    return pow_hashes
+
+
 def pow_hash_header(header: dict) -> str:
     return hash_encode(getPoWHash(serialize_header(header)))
 
@@ -120,7 +226,9 @@ def read_blockchains(config: 'SimpleConfig'):
         header_after_cp = best_chain.read_header(constants.net.max_checkpoint()+1)
         if not header_after_cp or not best_chain.can_connect(header_after_cp, check_height=False):
             _logger.info("[blockchain] deleting best chain. cannot connect header after last cp to last cp.")
+            best_chain.close_headers_file()
             os.unlink(best_chain.path())
+            _delete_chainwork_index(best_chain.path())
             best_chain.update_size()
     # forks
     fdir = os.path.join(util.get_headers_dir(config), 'forks')
@@ -129,9 +237,12 @@ def read_blockchains(config: 'SimpleConfig'):
     l = filter(lambda x: x.startswith('fork2_') and '.' not in x, os.listdir(fdir))
     l = sorted(l, key=lambda x: int(x.split('_')[1]))  # sort by forkpoint
 
-    def delete_chain(filename, reason):
+    def delete_chain(filename, reason, chain: 'Blockchain' = None):
         _logger.info(f"[blockchain] deleting chain {filename}: {reason}")
+        if chain is not None:
+            chain.close_headers_file()
         os.unlink(os.path.join(fdir, filename))
+        _delete_chainwork_index(os.path.join(fdir, filename))
 
     def instantiate_chain(filename):
         __, forkpoint, prev_hash, first_hash = filename.split('_')
@@ -157,10 +268,10 @@ def read_blockchains(config: 'SimpleConfig'):
         # consistency checks
         h = b.read_header(b.forkpoint)
         if first_hash != hash_header(h):
-            delete_chain(filename, "incorrect first hash for chain")
+            delete_chain(filename, "incorrect first hash for chain", b)
             return
         if not b.parent.can_connect(h, check_height=False):
-            delete_chain(filename, "cannot connect chain to parent")
+            delete_chain(filename, "cannot connect chain to parent", b)
             return
         chain_id = b.get_id()
         assert first_hash == chain_id, (first_hash, chain_id)
@@ -174,10 +285,31 @@ def get_best_chain() -> 'Blockchain':
     return blockchains[constants.net.GENESIS]
 
 
-# block hash -> chain work; up to and including that block
-_CHAINWORK_CACHE = {
-    "0000000000000000000000000000000000000000000000000000000000000000": 0,  # virtual block at height -1
-}  # type: Dict[str, int]
+def chainwork_of_target(target: int) -> int:
+    """work done by a single header with given target"""
+    return ((2 ** 256 - target - 1) // (target + 1)) + 1
+
+
+def _chainwork_in_checkpoint_region(height: int) -> int:
+    """Chainwork up to and including height, for heights covered by checkpoints.
+    The target stored with the checkpoint of a chunk is used for all of the chunk.
+    """
+    assert -1 <= height <= constants.net.max_checkpoint(), height
+    if height < 0 or not constants.net.CHECKPOINTS:
+        return 0
+    running_total = 0
+    index = height // 2016
+    for _, target, _ in constants.net.CHECKPOINTS[:index]:
+        running_total += 2016 * chainwork_of_target(target)
+    running_total += (height % 2016 + 1) * chainwork_of_target(constants.net.CHECKPOINTS[index][1])
+    return running_total
+
+
+def _delete_chainwork_index(headers_path: str) -> None:
+    try:
+        os.unlink(headers_path + CHAINWORK_INDEX_SUFFIX)
+    except FileNotFoundError:
+        pass
 
 
 def init_headers_file_for_best_chain():
@@ -185,6 +317,9 @@ def init_headers_file_for_best_chain():
     filename = b.path()
     length = HEADER_SIZE * len(constants.net.CHECKPOINTS) * 2016
     if not os.path.exists(filename) or os.path.getsize(filename) < length:
+        with b.lock:
+            b.close_headers_file()
+            _delete_chainwork_index(filename)
         with open(filename, 'wb') as f:
             if length > 0:
                 f.seek(length - 1)
@@ -192,6 +327,160 @@ def init_headers_file_for_best_chain():
         util.ensure_sparse_file(filename)
     with b.lock:
         b.update_size()
+    if b.height() <= constants.net.max_checkpoint():
+        _import_headers_snapshot_for_best_chain()
+
+
+def _import_headers_snapshot_for_best_chain() -> None:
+    b = get_best_chain()
+    path = os.path.join(util.get_headers_dir(b.config), HEADERS_SNAPSHOT_FILENAME)
+    if not os.path.exists(path):
+        return
+    trusted_signers = list(constants.net.HEADERS_SNAPSHOT_SIGNERS) + list(b.config.HEADERS_SNAPSHOT_SIGNERS or [])
+    try:
+        with open(path, 'rb') as f:
+            snapshot = HeadersSnapshot.deserialize(f.read())
+        b.import_headers_snapshot(snapshot, trusted_signers=trusted_signers)
+    except (HeadersSnapshotError, InvalidHeader, MissingHeader) as e:
+        _logger.warning(f"[blockchain] not using headers snapshot {path}: {e!r}")
+        return
+    _logger.info(f"[blockchain] imported headers snapshot. height: {b.height()}")
+
+
+class HeadersSnapshot(NamedTuple):
+    """Raw headers of the best chain starting at first_height, and the chainwork at their tip."""
+    first_height: int
+    data: bytes
+    chainwork: int
+    max_checkpoint: int
+    signer: Optional[str] = None  # address
+    signature: Optional[bytes] = None
+
+    def tip(self) -> int:
+        return self.first_height + len(self.data) // HEADER_SIZE - 1
+
+    def serialize_body(self) -> bytes:
+        return _HEADERS_SNAPSHOT_HEADER.pack(
+            HEADERS_SNAPSHOT_MAGIC, HEADERS_SNAPSHOT_VERSION, constants.net.rev_genesis_bytes(),
+            self.first_height, len(self.data) // HEADER_SIZE, self.chainwork.to_bytes(32, byteorder='big'),
+            self.max_checkpoint) + self.data
+
+    def message_to_sign(self) -> str:
+        """Signed as a user message, so any wallet (or bitcoind's signmessage) can sign snapshots."""
+        return sha256d(self.serialize_body()).hex()
+
+    def serialize(self) -> bytes:
+        signer = (self.signer or '').encode('ascii')
+        signature = self.signature or b''
+        assert len(signature) == (65 if signer else 0), len(signature)
+        return self.serialize_body() + bytes([len(signer)]) + signer + signature
+
+    @classmethod
+    def deserialize(cls, raw: bytes) -> 'HeadersSnapshot':
+        if len(raw) < _HEADERS_SNAPSHOT_HEADER.size:
+            raise HeadersSnapshotError('truncated snapshot')
+        magic, version, genesis, first_height, num_headers, chainwork, max_checkpoint = \
+            _HEADERS_SNAPSHOT_HEADER.unpack_from(raw)
+        if magic != HEADERS_SNAPSHOT_MAGIC:
+            raise HeadersSnapshotError('not a headers snapshot')
+        if version != HEADERS_SNAPSHOT_VERSION:
+            raise HeadersSnapshotError(f'unsupported snapshot version: {version}')
+        if genesis != constants.net.rev_genesis_bytes():
+            raise HeadersSnapshotError('snapshot is for another network')
+        pos = _HEADERS_SNAPSHOT_HEADER.size + num_headers * HEADER_SIZE
+        data = raw[_HEADERS_SNAPSHOT_HEADER.size:pos]
+        if len(raw) < pos + 1:
+            raise HeadersSnapshotError('truncated snapshot')
+        signer_len = raw[pos]
+        signer = raw[pos + 1:pos + 1 + signer_len]
+        signature = raw[pos + 1 + signer_len:]
+        if len(signer) != signer_len or len(signature) != (65 if signer_len else 0):
+            raise HeadersSnapshotError('invalid signature')
+        return HeadersSnapshot(
+            first_height=first_height,
+            data=data,
+            chainwork=int.from_bytes(chainwork, byteorder='big'),
+            max_checkpoint=max_checkpoint,
+            signer=signer.decode('ascii') if signer else None,
+            signature=signature or None)
+
+    def verify_signature(self, trusted_signers: Sequence[str]) -> None:
+        if self.signer is None:
+            raise HeadersSnapshotError('snapshot is not signed')
+        if self.signer not in trusted_signers:
+            raise HeadersSnapshotError(f'snapshot signed by untrusted signer: {self.signer}')
+        if not verify_usermessage_with_address(self.signer, self.signature, self.message_to_sign().encode('ascii')):
+            raise HeadersSnapshotError('invalid signature')
+
+
+class LWMAState:
+    """Rolling state of the LWMA difficulty window ending at `height`.
+
+    Keeps the timestamps of the last N+1 headers, and the running sums
+    needed by the LWMA formula, so that moving the window forward by one
+    header is O(1) instead of O(N).
+    """
+
+    def __init__(self, headers: Sequence[dict]):
+        self._N = N = constants.net.LWMA_AVERAGING_WINDOW
+        self._T = T = constants.net.POW_TARGET_SPACING
+        self._k = N * (N + 1) * T // 2
+        assert len(headers) == N + 1, len(headers)
+        self.height = headers[-1]['block_height']
+        self.tip_hash = hash_header(headers[-1])
+        self._timestamps = deque(h['timestamp'] for h in headers)  # heights height-N..height
+        self._target_terms = deque(self._target_term(h) for h in headers[1:])  # heights height-N+1..height
+        timestamps = list(self._timestamps)
+        self._solvetimes = deque(min(6 * T, b - a) for a, b in zip(timestamps, timestamps[1:]))
+        self._sum_solvetimes = sum(self._solvetimes)
+        self._sum_weighted_solvetimes = sum(j * s for j, s in enumerate(self._solvetimes, start=1))
+        self._sum_target_terms = sum(self._target_terms)
+        # number of timestamps in the window that are not strictly increasing
+        self._num_out_of_order = sum(1 for a, b in zip(timestamps, timestamps[1:]) if b <= a)
+
+    def _target_term(self, header: dict) -> int:
+        return Blockchain.bits_to_target(header['bits']) // self._N // self._k
+
+    def append(self, header: dict, header_hash: str = None) -> None:
+        """Moves the window forward, to end at header."""
+        assert header['block_height'] == self.height + 1, (header['block_height'], self.height)
+        assert header['prev_block_hash'] == self.tip_hash
+        timestamp = header['timestamp']
+        prev_timestamp = self._timestamps[-1]
+        # drop the oldest block of the window
+        oldest_timestamp = self._timestamps.popleft()
+        if self._timestamps[0] <= oldest_timestamp:
+            self._num_out_of_order -= 1
+        oldest_solvetime = self._solvetimes.popleft()
+        self._sum_target_terms -= self._target_terms.popleft()
+        # add the new one. weights of the other solvetimes decrease by one
+        solvetime = min(6 * self._T, timestamp - prev_timestamp)
+        self._sum_weighted_solvetimes += self._N * solvetime - self._sum_solvetimes
+        self._sum_solvetimes += solvetime - oldest_solvetime
+        self._solvetimes.append(solvetime)
+        self._timestamps.append(timestamp)
+        if timestamp <= prev_timestamp:
+            self._num_out_of_order += 1
+        target_term = self._target_term(header)
+        self._target_terms.append(target_term)
+        self._sum_target_terms += target_term
+        self.height += 1
+        self.tip_hash = header_hash or hash_header(header)
+
+    def get_next_target(self) -> int:
+        if self._num_out_of_order == 0:
+            sum_weighted_solvetimes = self._sum_weighted_solvetimes
+        else:
+            # timestamps are forced to be increasing, starting from the beginning of the window.
+            # this is rare, so just redo the full calculation
+            sum_weighted_solvetimes = 0
+            previous_timestamp = self._timestamps[0]
+            for j, timestamp in enumerate(itertools.islice(self._timestamps, 1, None), start=1):
+                this_timestamp = timestamp if timestamp > previous_timestamp else previous_timestamp + 1
+                solvetime = min(6 * self._T, this_timestamp - previous_timestamp)
+                previous_timestamp = this_timestamp
+                sum_weighted_solvetimes += solvetime * j
+        return min(MAX_TARGET, self._sum_target_terms * sum_weighted_solvetimes)
 
 
 class Blockchain(Logger):
@@ -213,6 +502,11 @@ class Blockchain(Logger):
         self._forkpoint_hash = forkpoint_hash  # blockhash at forkpoint. "first hash"
         self._prev_hash = prev_hash  # blockhash immediately before forkpoint
         self.lock = threading.RLock()
+        self._headers_mmap = None  # type: Optional[mmap.mmap]
+        self._chainwork_index_file = None  # type: Optional[BinaryIO]  # see _get_chainwork_index_file
+        self._chainwork_index_size = 0  # number of complete records, while the index file is open
+        self._headers_cache = LRUCache(maxsize=HEADERS_CACHE_SIZE)  # type: LRUCache[int, dict]  # height -> header
+        self._lwma_state = None  # type: Optional[LWMAState]
         self.update_size()
 
     @property
@@ -309,9 +603,40 @@ class Blockchain(Logger):
     def update_size(self) -> None:
         p = self.path()
         self._size = os.path.getsize(p)//HEADER_SIZE if os.path.exists(p) else 0
+        # the mapping has the old size of the file (or even points to another file, after a swap)
+        self._close_headers_mmap()
+        for height in [h for h in self._headers_cache if h > self.height()]:
+            del self._headers_cache[height]
+
+    @with_lock
+    def close_headers_file(self) -> None:
+        """Releases the memory map of the headers file and the chainwork index,
+        and forgets cached headers.
+        Must be called before the files are deleted or replaced.
+        """
+        self._close_headers_mmap()
+        self._close_chainwork_index()
+        self._headers_cache.clear()
+
+    def _close_headers_mmap(self) -> None:
+        if self._headers_mmap is not None:
+            self._headers_mmap.close()
+            self._headers_mmap = None
+
+    def _get_headers_mmap(self) -> Optional[mmap.mmap]:
+        if self._headers_mmap is None:
+            name = self.path()
+            self.assert_headers_file_available(name)
+            with open(name, 'rb') as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    return None  # cannot map an empty file
+                self._headers_mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._headers_mmap
 
     @classmethod
-    def verify_header(cls, header: dict, prev_hash: str, target: int, expected_header_hash: str=None) -> None:
+    def verify_header(cls, header: dict, prev_hash: str, target: int, expected_header_hash: str=None,
+                      *, pow_hash: bytes = None, check_pow: bool = True) -> None:
+        """pow_hash, if given, is the already computed (little-endian) scrypt hash of header."""
         _hash = hash_header(header)
         if expected_header_hash and expected_header_hash != _hash:
             raise InvalidHeader("hash mismatches with expected: {} vs {}".format(expected_header_hash, _hash))
@@ -322,16 +647,29 @@ class Blockchain(Logger):
         bits = cls.target_to_bits(target)
         if bits != header.get('bits'):
             raise InvalidHeader("bits mismatch: %s vs %s" % (bits, header.get('bits')))
-        _pow_hash = pow_hash_header(header)
-        pow_hash_as_num = int.from_bytes(bfh(_pow_hash), byteorder='big')
+        if not check_pow:
+            return
+        if pow_hash is None:
+            pow_hash = getPoWHash(serialize_header(header))
+        pow_hash_as_num = int.from_bytes(pow_hash, byteorder='little')
         if pow_hash_as_num > target:
             raise InvalidHeader(f"insufficient proof of work: {pow_hash_as_num} vs target {target}")
 
-    def verify_chunk(self, index: int, data: bytes) -> None:
+    def verify_chunk(self, index: int, data: bytes, *, pow_hashes: Sequence[bytes] = None) -> None:
+        """pow_hashes, if given, are the already computed scrypt hashes of the headers in data.
+        The checks that depend on previous headers (prev hash, target) are always done here.
+        """
         num = len(data) // HEADER_SIZE
         start_height = index * 2016
         prev_hash = self.get_hash(start_height - 1)
         target = self.get_target(start_height - 1)
+        if constants.net.TESTNET:
+            pow_hashes = None
+        elif pow_hashes is None:
+            # hash the whole chunk in one go, instead of header-by-header
+            pow_hashes = pow_hash_raw_headers(data[:num*HEADER_SIZE])
+        elif len(pow_hashes) != num:
+            raise InvalidHeader(f"got {len(pow_hashes)} pow hashes for {num} headers")
         headers = {}
         for i in range(num):
             height = start_height + i
@@ -343,11 +681,42 @@ class Blockchain(Logger):
             header = deserialize_header(raw_header, height)
             if height > constants.net.TARGET_DISRUPTION_HEIGHT1:
                 target = self.get_target(height - 1, headers)
-            self.verify_header(header, prev_hash, target, expected_header_hash)
+            self.verify_header(header, prev_hash, target, expected_header_hash,
+                               pow_hash=pow_hashes[i] if pow_hashes else None)
             # print(f"Verified {height}")
-            prev_hash = hash_header(header)
+            prev_hash = hash_raw_header(raw_header)
             headers[height] = header
 
+    @classmethod
+    def verify_chunk_headers(cls, index: int, data: bytes, *, pow_hashes: Sequence[bytes] = None) -> None:
+        """Checks the headers of a chunk on their own, without looking at our chain:
+        their linkage, and their PoW against the target they claim.
+        A chunk that passes this but not verify_chunk might be from another branch.
+        """
+        num = len(data) // HEADER_SIZE
+        if len(data) != num * HEADER_SIZE:
+            raise InvalidHeader(f"chunk of {len(data)} bytes is not made of headers")
+        if constants.net.TESTNET:
+            pow_hashes = None
+        elif pow_hashes is None:
+            pow_hashes = pow_hash_raw_headers(data)
+        elif len(pow_hashes) != num:
+            raise InvalidHeader(f"got {len(pow_hashes)} pow hashes for {num} headers")
+        prev_hash = None
+        for i in range(num):
+            raw_header = data[i*HEADER_SIZE : (i+1)*HEADER_SIZE]
+            header = deserialize_header(raw_header, index * 2016 + i)
+            if prev_hash is not None and prev_hash != header['prev_block_hash']:
+                raise InvalidHeader(f"prev hash mismatch: {prev_hash} vs {header['prev_block_hash']}")
+            if pow_hashes:
+                target = cls.bits_to_target(header['bits'])
+                if target > MAX_TARGET:
+                    raise InvalidHeader(f"target above max target: {header['bits']}")
+                pow_hash_as_num = int.from_bytes(pow_hashes[i], byteorder='little')
+                if pow_hash_as_num > target:
+                    raise InvalidHeader(f"insufficient proof of work: {pow_hash_as_num} vs target {target}")
+            prev_hash = hash_raw_header(raw_header)
+
     @with_lock
     def path(self):
         d = util.get_headers_dir(self.config)
@@ -435,7 +804,12 @@ class Blockchain(Logger):
         self._forkpoint_hash, parent._forkpoint_hash = parent._forkpoint_hash, hash_raw_header(parent_data[:HEADER_SIZE])
         self._prev_hash, parent._prev_hash = parent._prev_hash, self._prev_hash
         # parent's new name
+        self.close_headers_file()
+        parent.close_headers_file()
         os.replace(child_old_name, parent.path())
+        # our index is now the (truncated) one of the parent's old file. the parent's gets rebuilt
+        _delete_chainwork_index(child_old_name)
+        _delete_chainwork_index(parent.path())
         self.update_size()
         parent.update_size()
         # update pointers
@@ -460,6 +834,15 @@ class Blockchain(Logger):
     def write(self, data: bytes, offset: int, truncate: bool=True) -> None:
         filename = self.path()
         self.assert_headers_file_available(filename)
+        first_height = self.forkpoint + offset // HEADER_SIZE
+        for height in [h for h in self._headers_cache if h >= first_height]:
+            del self._headers_cache[height]
+        self._close_headers_mmap()
+        # Forget the index for the overwritten heights before touching the headers,
+        # so that a crash in between leaves a shorter (but correct) index.
+        last_height = first_height + len(data) // HEADER_SIZE - 1
+        if not constants.net.TESTNET and (truncate or last_height >= self._chainwork_index_start_height()):
+            self._truncate_chainwork_index(first_height)
         with open(filename, 'rb+') as f:
             if truncate and offset != self._size * HEADER_SIZE:
                 f.seek(offset)
@@ -488,17 +871,21 @@ class Blockchain(Logger):
             return self.parent.read_header(height)
         if height > self.height():
             return
-        delta = height - self.forkpoint
-        name = self.path()
-        self.assert_headers_file_available(name)
-        with open(name, 'rb') as f:
-            f.seek(delta * HEADER_SIZE)
-            h = f.read(HEADER_SIZE)
+        header = self._headers_cache.get(height)
+        if header is None:
+            delta = height - self.forkpoint
+            # note: slicing the mmap copies the 80 bytes, without any syscall.
+            #       (a memoryview would pin the mapping, which we need to be able to close)
+            headers_mmap = self._get_headers_mmap()
+            h = headers_mmap[delta * HEADER_SIZE:(delta + 1) * HEADER_SIZE] if headers_mmap is not None else b''
             if len(h) < HEADER_SIZE:
                 raise Exception('Expected to read a full header. This was only {} bytes'.format(len(h)))
-        if h == bytes([0])*HEADER_SIZE:
-            return None
-        return deserialize_header(h, height)
+            if h == bytes([0])*HEADER_SIZE:
+                return None
+            header = deserialize_header(h, height)
+            self._headers_cache[height] = header
+        # callers might modify the returned dict
+        return dict(header)
 
     def header_at_tip(self) -> Optional[dict]:
         """Return latest header."""
@@ -576,22 +963,10 @@ class Blockchain(Logger):
 
     def get_target_3(self, last_height: int, headers: dict) -> int:
         first_height = last_height - 36
-        try:
-            first_timestamp = headers[first_height].get("timestamp")
-        except:
-            try:
-                first_timestamp = self.read_header(first_height).get('timestamp')
-            except:
-                raise MissingHeader()
-        try:
-            last_timestamp = headers[last_height].get("timestamp")
-            last_bits = headers[last_height].get("bits")
-        except:
-            try:
-                last_timestamp = self.read_header(last_height).get("timestamp")
-                last_bits = self.read_header(last_height).get("bits")
-            except:
-                raise MissingHeader()
+        first_timestamp = self._get_header_for_target(first_height, headers)['timestamp']
+        last_header = self._get_header_for_target(last_height, headers)
+        last_timestamp = last_header['timestamp']
+        last_bits = last_header['bits']
         numerator = 112
         denominator = 100
         lowLimit = (constants.net.POW_TARGET_TIMESPAN_V2 * denominator) // numerator
@@ -610,22 +985,10 @@ class Blockchain(Logger):
 
     def get_target_4(self, last_height: int, headers: dict) -> int:
         first_height = last_height - 8
-        try:
-            first_timestamp = headers[first_height].get("timestamp")
-        except:
-            try:
-                first_timestamp = self.read_header(first_height).get('timestamp')
-            except:
-                raise MissingHeader()
-        try:
-            last_timestamp = headers[last_height].get("timestamp")
-            last_bits = headers[last_height].get("bits")
-        except:
-            try:
-                last_timestamp = self.read_header(last_height).get("timestamp")
-                last_bits = self.read_header(last_height).get("bits")
-            except:
-                raise MissingHeader()
+        first_timestamp = self._get_header_for_target(first_height, headers)['timestamp']
+        last_header = self._get_header_for_target(last_height, headers)
+        last_timestamp = last_header['timestamp']
+        last_bits = last_header['bits']
         nActualTimespan = (last_timestamp - first_timestamp) // 8
         newTarget = self.bits_to_target(last_bits)
         i = 0
@@ -666,22 +1029,10 @@ class Blockchain(Logger):
 
     def get_target_5(self, last_height: int, headers: dict) -> int:
         first_height = last_height - 1
-        try:
-            first_timestamp = headers[first_height].get("timestamp")
-        except:
-            try:
-                first_timestamp = self.read_header(first_height).get('timestamp')
-            except:
-                raise MissingHeader()
-        try:
-            last_timestamp = headers[last_height].get("timestamp")
-            last_bits = headers[last_height].get("bits")
-        except:
-            try:
-                last_timestamp = self.read_header(last_height).get("timestamp")
-                last_bits = self.read_header(last_height).get("bits")
-            except:
-                raise MissingHeader()
+        first_timestamp = self._get_header_for_target(first_height, headers)['timestamp']
+        last_header = self._get_header_for_target(last_height, headers)
+        last_timestamp = last_header['timestamp']
+        last_bits = last_header['bits']
         timestamp = last_timestamp % 60
         if (timestamp >= 0 and timestamp <= 14) or (timestamp >= 30 and timestamp <= 44):
             nActualTimespan = last_timestamp - first_timestamp
@@ -700,51 +1051,38 @@ class Blockchain(Logger):
             return newTarget
         return self.get_target_4(last_height, headers)
 
+    def _get_header_for_target(self, height: int, headers: Optional[dict]) -> dict:
+        """Returns the header at height, from headers (not yet saved, e.g. the chunk
+        being verified) if it is there, otherwise from the headers file.
+        """
+        header = headers.get(height) if headers else None
+        if header is None:
+            try:
+                header = self.read_header(height)
+            except Exception:
+                raise MissingHeader(height)
+            if header is None:
+                raise MissingHeader(height)
+        return header
+
     def get_target_lwma(self, last_height: int, headers: dict) -> int:
-        T = constants.net.POW_TARGET_SPACING
         N = constants.net.LWMA_AVERAGING_WINDOW
-        pow_limit = MAX_TARGET
-        height = last_height
-    
-        if height < N:
-            return pow_limit
-
-        k = N * (N + 1) * T // 2
-        sum_weighted_solvetimes = 0
-        j = 0
-        avg_target = 0
-
-        try:
-            previous_timestamp = headers[height - N].get("timestamp")
-        except:
-            try:
-                previous_timestamp = self.read_header(height - N).get("timestamp")
-            except:
-                raise MissingHeader()
+        if last_height < N:
+            return MAX_TARGET
+        last_header = self._get_header_for_target(last_height, headers)
+        last_hash = hash_header(last_header)
+        with self.lock:
+            state = self._lwma_state
+            if (state is not None and state.height == last_height - 1
+                    and state.tip_hash == last_header['prev_block_hash']):
+                state.append(last_header, last_hash)
+            elif state is None or state.height != last_height or state.tip_hash != last_hash:
+                # first use, or jumped elsewhere (e.g. reorg or other fork): rebuild the window
+                window = [self._get_header_for_target(height, headers)
+                          for height in range(last_height - N, last_height + 1)]
+                state = self._lwma_state = LWMAState(window)
+            return state.get_next_target()
 
-        for i in range(height - N + 1, height + 1):
-            try:
-                block = headers[i]
-            except:
-                try:
-                    block = self.read_header(i)
-                except:
-                    raise MissingHeader()
-
-            this_timestamp = block.get("timestamp") if block.get("timestamp") > previous_timestamp else previous_timestamp + 1
-            solvetime = min(6 * T, this_timestamp - previous_timestamp)
-            previous_timestamp = this_timestamp
-            j += 1
-            sum_weighted_solvetimes += solvetime * j
-            target = self.bits_to_target(block.get("bits"))
-            avg_target += target // N // k
-
-        next_target = avg_target * sum_weighted_solvetimes
-
-        if next_target > pow_limit:
-            next_target = pow_limit
-        return next_target
-            
     def get_target(self, last_height: int, headers=None) -> int:
         # compute target from chunk x, used in chunk x+1
         if constants.net.TESTNET:
@@ -803,9 +1141,12 @@ class Blockchain(Logger):
 
     def chainwork_of_header_at_height(self, height: int) -> int:
         """work done by single header at given height"""
-        target = self.get_target(height-1)
-        work = ((2 ** 256 - target - 1) // (target + 1)) + 1
-        return work
+        if height <= constants.net.max_checkpoint():
+            return chainwork_of_target(constants.net.CHECKPOINTS[height // 2016][1])
+        if height < self.forkpoint:
+            return self.parent.chainwork_of_header_at_height(height)
+        _, bits = self._get_chainwork_index_record(height)
+        return chainwork_of_target(self.bits_to_target(bits))
 
     @with_lock
     def get_chainwork(self, height=None) -> int:
@@ -815,24 +1156,104 @@ class Blockchain(Logger):
             # On testnet/regtest, difficulty works somewhat different.
             # It's out of scope to properly implement that.
             return height
-        last_retarget = height // 2016 * 2016 - 1
-        cached_height = last_retarget
-        while _CHAINWORK_CACHE.get(self.get_hash(cached_height)) is None:
-            if cached_height <= -1:
-                break
-            cached_height -= 2016
-        assert cached_height >= -1, cached_height
-        running_total = _CHAINWORK_CACHE[self.get_hash(cached_height)]
-        while cached_height < last_retarget:
-            cached_height += 2016
-            work_in_single_header = self.chainwork_of_header_at_height(cached_height)
-            work_in_chunk = 2016 * work_in_single_header
-            running_total += work_in_chunk
-            _CHAINWORK_CACHE[self.get_hash(cached_height)] = running_total
-        cached_height += 2016
-        work_in_single_header = self.chainwork_of_header_at_height(cached_height)
-        work_in_last_partial_chunk = (height % 2016 + 1) * work_in_single_header
-        return running_total + work_in_last_partial_chunk
+        if height <= constants.net.max_checkpoint():
+            return _chainwork_in_checkpoint_region(height)
+        if height < self.forkpoint:
+            return self.parent.get_chainwork(height)
+        chainwork, _ = self._get_chainwork_index_record(height)
+        return chainwork
+
+    def chainwork_index_path(self) -> str:
+        return self.path() + CHAINWORK_INDEX_SUFFIX
+
+    def _chainwork_index_start_height(self) -> int:
+        """Height of the first record of the index."""
+        return max(self.forkpoint, constants.net.max_checkpoint() + 1)
+
+    @with_lock
+    def _get_chainwork_index_file(self) -> BinaryIO:
+        """Returns the index file, opened once and kept open until close_headers_file.
+        Recreates the file if it is missing, or was built for other checkpoints.
+        """
+        if self._chainwork_index_file is not None:
+            return self._chainwork_index_file
+        name = self.chainwork_index_path()
+        header = _CHAINWORK_INDEX_HEADER.pack(
+            CHAINWORK_INDEX_MAGIC, CHAINWORK_INDEX_VERSION, constants.net.max_checkpoint())
+        try:
+            f = open(name, 'rb+')
+        except FileNotFoundError:
+            f = open(name, 'wb+')
+        if f.read(_CHAINWORK_INDEX_HEADER.size) == header:
+            size = os.fstat(f.fileno()).st_size - _CHAINWORK_INDEX_HEADER.size
+            self._chainwork_index_size = size // _CHAINWORK_INDEX_RECORD.size
+        else:
+            f.seek(0)
+            f.truncate()
+            f.write(header)
+            f.flush()
+            self._chainwork_index_size = 0
+        self._chainwork_index_file = f
+        return f
+
+    def _close_chainwork_index(self) -> None:
+        if self._chainwork_index_file is not None:
+            self._chainwork_index_file.close()
+            self._chainwork_index_file = None
+
+    @with_lock
+    def _get_chainwork_index_size(self) -> int:
+        """Number of complete records in the index file."""
+        self._get_chainwork_index_file()
+        return self._chainwork_index_size
+
+    @with_lock
+    def _truncate_chainwork_index(self, height: int) -> None:
+        """Forgets the records for height and above."""
+        num_records = max(0, height - self._chainwork_index_start_height())
+        if num_records >= self._get_chainwork_index_size():
+            return
+        f = self._get_chainwork_index_file()
+        f.truncate(_CHAINWORK_INDEX_HEADER.size + num_records * _CHAINWORK_INDEX_RECORD.size)
+        f.flush()
+        self._chainwork_index_size = num_records
+
+    @with_lock
+    def _get_chainwork_index_record(self, height: int) -> Tuple[int, int]:
+        """Returns (chainwork, bits) at height. Missing records up to height
+        are computed from the headers, and appended to the index.
+        """
+        start_height = self._chainwork_index_start_height()
+        assert start_height <= height <= self.height(), (start_height, height, self.height())
+        first_missing_height = start_height + self._get_chainwork_index_size()
+        if height < first_missing_height:
+            f = self._get_chainwork_index_file()
+            f.seek(_CHAINWORK_INDEX_HEADER.size + (height - start_height) * _CHAINWORK_INDEX_RECORD.size)
+            chainwork, bits = _CHAINWORK_INDEX_RECORD.unpack(f.read(_CHAINWORK_INDEX_RECORD.size))
+            return int.from_bytes(chainwork, byteorder='big'), bits
+        # e.g. new headers were saved since the last call
+        chainwork = self.get_chainwork(first_missing_height - 1)
+        records = []
+        for h in range(first_missing_height, height + 1):
+            bits = self._get_header_for_target(h, None)['bits']
+            chainwork += chainwork_of_target(self.bits_to_target(bits))
+            records.append(_CHAINWORK_INDEX_RECORD.pack(chainwork.to_bytes(32, byteorder='big'), bits))
+        self._write_chainwork_index_records(first_missing_height, records)
+        return chainwork, bits
+
+    @with_lock
+    def _write_chainwork_index_records(self, height: int, records: Sequence[bytes]) -> None:
+        """Writes the records for height and above, forgetting any after them."""
+        start_height = self._chainwork_index_start_height()
+        num_records = self._get_chainwork_index_size()
+        assert start_height <= height <= start_height + num_records, (start_height, height, num_records)
+        f = self._get_chainwork_index_file()
+        # note: not appending, there might be a partially written record at the end
+        f.seek(_CHAINWORK_INDEX_HEADER.size + (height - start_height) * _CHAINWORK_INDEX_RECORD.size)
+        f.write(b''.join(records))
+        f.truncate()
+        f.flush()
+        self._chainwork_index_size = height - start_height + len(records)
 
     def can_connect(self, header: dict, check_height: bool=True) -> bool:
         if header is None:
@@ -858,11 +1279,11 @@ class Blockchain(Logger):
             return False
         return True
 
-    def connect_chunk(self, idx: int, hexdata: str) -> bool:
+    def connect_chunk(self, idx: int, hexdata: str, *, pow_hashes: Sequence[bytes] = None) -> bool:
         assert idx >= 0, idx
         try:
             data = bfh(hexdata)
-            self.verify_chunk(idx, data)
+            self.verify_chunk(idx, data, pow_hashes=pow_hashes)
             self.save_chunk(idx, data)
             return True
         except BaseException as e:
@@ -891,6 +1312,80 @@ class Blockchain(Logger):
             self.logger.info(f'verify_chunk_before_cp idx {idx} failed: {repr(e)}')
             return False
 
+    @with_lock
+    def import_headers_snapshot(self, snapshot: HeadersSnapshot, *, trusted_signers: Sequence[str]) -> None:
+        """Saves the headers of snapshot, from the start of the last checkpointed chunk, in a single write.
+        Linkage and retargets are checked for all headers, PoW only for a random sample of them.
+        """
+        assert self.parent is None
+        snapshot.verify_signature(trusted_signers)
+        cps = constants.net.CHECKPOINTS
+        max_cp = constants.net.max_checkpoint()
+        if not cps:
+            raise HeadersSnapshotError('no checkpoints')
+        if self.height() > max_cp:
+            raise HeadersSnapshotError('we already have headers after the last checkpoint')
+        start_height = (len(cps) - 1) * 2016
+        if snapshot.first_height > start_height:
+            raise HeadersSnapshotError(f'snapshot starts after our last checkpointed chunk: {snapshot.first_height}')
+        tip = snapshot.tip()
+        if tip <= max_cp:
+            raise HeadersSnapshotError(f'snapshot has no headers after the last checkpoint. tip: {tip}')
+        data = snapshot.data[(start_height - snapshot.first_height) * HEADER_SIZE:]
+
+        def raw_header_at(height: int) -> bytes:
+            delta = height - start_height
+            return data[delta * HEADER_SIZE:(delta + 1) * HEADER_SIZE]
+
+        sample = random.sample(range(max_cp + 1, tip), min(HEADERS_SNAPSHOT_POW_SAMPLE_SIZE, tip - max_cp - 1))
+        sample.append(tip)
+        pow_hashes = {} if constants.net.TESTNET else dict(zip(
+            sample, pow_hash_raw_headers(b''.join(raw_header_at(height) for height in sample))))
+        prev_hash = self.get_hash(start_height - 1)
+        chainwork = _chainwork_in_checkpoint_region(max_cp)
+        chainwork_records = []
+        headers = {}
+        for height in range(start_height, tip + 1):
+            raw_header = raw_header_at(height)
+            header = deserialize_header(raw_header, height)
+            if height <= max_cp:
+                if prev_hash != header['prev_block_hash']:
+                    raise InvalidHeader(f"prev hash mismatch at height {height}")
+                if height == max_cp and hash_raw_header(raw_header) != cps[-1][0]:
+                    raise InvalidHeader("hash mismatches with last checkpoint")
+            else:
+                target = self.get_target(height - 1, headers)
+                self.verify_header(header, prev_hash, target,
+                                   pow_hash=pow_hashes.get(height), check_pow=height in pow_hashes)
+                chainwork += chainwork_of_target(self.bits_to_target(header['bits']))
+                chainwork_records.append(_CHAINWORK_INDEX_RECORD.pack(chainwork.to_bytes(32, byteorder='big'), header['bits']))
+            prev_hash = hash_raw_header(raw_header)
+            headers[height] = header
+            headers.pop(height - _RETARGET_WINDOW, None)
+        if constants.net.TESTNET:
+            chainwork = tip  # see get_chainwork
+        # the chainwork of the checkpoint region is computed from the checkpoints, so we
+        # can only compare with snapshots made with the same checkpoints as ours
+        if snapshot.max_checkpoint == max_cp and chainwork != snapshot.chainwork:
+            raise HeadersSnapshotError(f'chainwork mismatch: {chainwork} vs {snapshot.chainwork}')
+        self.write(data, start_height * HEADER_SIZE)
+        if not constants.net.TESTNET:
+            self._write_chainwork_index_records(max_cp + 1, chainwork_records)
+
+    def get_headers_snapshot(self) -> HeadersSnapshot:
+        """Snapshot of this chain, starting at our last checkpointed chunk."""
+        first_height = max(0, len(constants.net.CHECKPOINTS) - 1) * 2016
+        if self.height() <= constants.net.max_checkpoint():
+            raise HeadersSnapshotError('no headers after the last checkpoint')
+        data = []
+        for height in range(first_height, self.height() + 1):
+            header = self.read_header(height)
+            if header is None:
+                raise MissingHeader(height)
+            data.append(serialize_header(header))
+        return HeadersSnapshot(first_height=first_height, data=b''.join(data), chainwork=self.get_chainwork(),
+                               max_checkpoint=constants.net.max_checkpoint())
+
     def get_checkpoints(self):
         # for each chunk, store the hash of the last block and the target after the chunk
         cp = []
@@ -27,6 +27,8 @@ import ipaddress
 import time
 import random
 import os
+import hashlib
+import struct
 from collections import defaultdict
 from typing import Sequence, List, Tuple, Optional, Dict, NamedTuple, TYPE_CHECKING, Set
 import binascii
@@ -357,11 +359,56 @@ PRIMARY KEY(node_id)
 )"""
 
 
+# The gossip snapshot is a copy of the decoded channel_info, node_info and policy
+# tables, so that load_data does not need to decode every message again.
+# Each record has the digest of the message it corresponds to; rows whose
+# message is not in the snapshot are decoded.
+GOSSIP_SNAPSHOT_MAGIC = b'GOSSNAPS'
+GOSSIP_SNAPSHOT_VERSION = 1
+# magic, version, chain_hash, sha256 of the rest, number of channels, nodes and policies
+_SNAPSHOT_HEADER = struct.Struct('>8sH32s32sIII')
+# digest, short_channel_id, node1_id, node2_id, capacity_sat (-1 if unknown)
+_SNAPSHOT_CHANNEL = struct.Struct('>8s8s33s33sq')
+# digest, node_id, timestamp, length of features, length of alias; followed by features and alias
+_SNAPSHOT_NODE = struct.Struct('>8s33sIHB')
+# digest, key, cltv_delta, htlc_minimum_msat, has htlc_maximum_msat, htlc_maximum_msat,
+# fee_base_msat, fee_proportional_millionths, channel_flags, message_flags, timestamp
+_SNAPSHOT_POLICY = struct.Struct('>8s41sHQ?QIIBBI')
+
+
+class GossipSnapshotError(Exception): pass
+
+
+def gossip_msg_digest(msg: bytes) -> bytes:
+    return hashlib.sha256(msg).digest()[:8]
+
+
+def _channel_announcement_node_ids(msg: bytes) -> Tuple[bytes, bytes]:
+    # type, 4 signatures, len, features, chain_hash, short_channel_id, node_id_1, node_id_2
+    offset = 2 + 4 * 64
+    offset += 2 + int.from_bytes(msg[offset:offset + 2], 'big') + 32 + 8
+    return msg[offset:offset + 33], msg[offset + 33:offset + 66]
+
+
+def _node_announcement_timestamp(msg: bytes) -> int:
+    # type, signature, flen, features, timestamp
+    offset = 2 + 64
+    offset += 2 + int.from_bytes(msg[offset:offset + 2], 'big')
+    return int.from_bytes(msg[offset:offset + 4], 'big')
+
+
+def _channel_update_timestamp(msg: bytes) -> int:
+    # type, signature, chain_hash, short_channel_id, timestamp
+    offset = 2 + 64 + 32 + 8
+    return int.from_bytes(msg[offset:offset + 4], 'big')
+
+
 class ChannelDB(SqlDB):
 
     NUM_MAX_RECENT_PEERS = 20
     PRIVATE_CHAN_UPD_CACHE_TTL_NORMAL = 600
     PRIVATE_CHAN_UPD_CACHE_TTL_SHORT = 120
+    SNAPSHOT_INTERVAL = 3600  # seconds between writes of the gossip snapshot, see save_snapshot
 
     def __init__(self, network: 'Network'):
         path = self.get_file_path(network.config)
@@ -388,9 +435,13 @@ class ChannelDB(SqlDB):
         self._chans_with_0_policies = set()  # type: Set[ShortChannelID]
         self._chans_with_1_policies = set()  # type: Set[ShortChannelID]
         self._chans_with_2_policies = set()  # type: Set[ShortChannelID]
+        # node_ids whose channels, policies or features changed, see pop_graph_changes
+        self._graph_changes = set()  # type: Set[bytes]
 
         self.data_loaded = asyncio.Event()
         self.network = network # only for callback
+        self.snapshot_path = path + '_snapshot'
+        self._snapshot_dirty = False  # the tables changed since the snapshot was written. only used in the sql thread
 
     @classmethod
     def get_file_path(cls, config: 'SimpleConfig') -> str:
@@ -484,6 +535,7 @@ class ChannelDB(SqlDB):
             self._channels[channel_info.short_channel_id] = channel_info
             self._channels_for_node[channel_info.node1_id].add(channel_info.short_channel_id)
             self._channels_for_node[channel_info.node2_id].add(channel_info.short_channel_id)
+            self._graph_changes.update((channel_info.node1_id, channel_info.node2_id))
         self._update_num_policies_for_chan(channel_info.short_channel_id)
         if 'raw' in msg:
             self._db_save_channel(channel_info.short_channel_id, msg['raw'])
@@ -549,6 +601,7 @@ class ChannelDB(SqlDB):
         policy = Policy.from_msg(payload)
         with self.lock:
             self._policies[key] = policy
+            self._graph_changes.update((channel_info.node1_id, channel_info.node2_id))
         self._update_num_policies_for_chan(short_channel_id)
         if 'raw' in payload:
             self._db_save_policy(policy.key, payload['raw'])
@@ -594,29 +647,34 @@ class ChannelDB(SqlDB):
     @sql
     def _db_save_policy(self, key: bytes, msg: bytes):
         # 'msg' is a 'channel_update' message
+        self._snapshot_dirty = True
         c = self.conn.cursor()
         c.execute("""REPLACE INTO policy (key, msg) VALUES (?,?)""", [key, msg])
 
     @sql
     def _db_delete_policy(self, node_id: bytes, short_channel_id: ShortChannelID):
         key = short_channel_id + node_id
+        self._snapshot_dirty = True
         c = self.conn.cursor()
         c.execute("""DELETE FROM policy WHERE key=?""", (key,))
 
     @sql
     def _db_save_channel(self, short_channel_id: ShortChannelID, msg: bytes):
         # 'msg' is a 'channel_announcement' message
+        self._snapshot_dirty = True
         c = self.conn.cursor()
         c.execute("REPLACE INTO channel_info (short_channel_id, msg) VALUES (?,?)", [short_channel_id, msg])
 
     @sql
     def _db_delete_channel(self, short_channel_id: ShortChannelID):
+        self._snapshot_dirty = True
         c = self.conn.cursor()
         c.execute("""DELETE FROM channel_info WHERE short_channel_id=?""", (short_channel_id,))
 
     @sql
     def _db_save_node_info(self, node_id: bytes, msg: bytes):
         # 'msg' is a 'node_announcement' message
+        self._snapshot_dirty = True
         c = self.conn.cursor()
         c.execute("REPLACE INTO node_info (node_id, msg) VALUES (?,?)", [node_id, msg])
 
@@ -687,6 +745,7 @@ class ChannelDB(SqlDB):
             # save
             with self.lock:
                 self._nodes[node_id] = node_info
+                self._graph_changes.add(node_id)
             if 'raw' in msg_payload:
                 self._db_save_node_info(node_id, msg_payload['raw'])
             with self.lock:
@@ -711,6 +770,9 @@ class ChannelDB(SqlDB):
                 node_id, scid = key
                 with self.lock:
                     self._policies.pop(key)
+                    self._graph_changes.add(node_id)
+                    if channel_info := self._channels.get(scid):
+                        self._graph_changes.update((channel_info.node1_id, channel_info.node2_id))
                 self._db_delete_policy(*key)
                 self._update_num_policies_for_chan(scid)
             self.update_counts()
@@ -774,6 +836,7 @@ class ChannelDB(SqlDB):
             if channel_info:
                 self._channels_for_node[channel_info.node1_id].remove(channel_info.short_channel_id)
                 self._channels_for_node[channel_info.node2_id].remove(channel_info.short_channel_id)
+                self._graph_changes.update((channel_info.node1_id, channel_info.node2_id))
         self._update_num_policies_for_chan(short_channel_id)
         # delete from database
         self._db_delete_channel(short_channel_id)
@@ -825,39 +888,65 @@ class ChannelDB(SqlDB):
             return newest_ts
         sorted_node_ids = sorted(self._addresses.keys(), key=newest_ts_for_node_id, reverse=True)
         self._recent_peers = sorted_node_ids[:self.NUM_MAX_RECENT_PEERS]
+        # rows whose message is in the snapshot are not decoded
+        snapshot = self._read_snapshot()
+        snapshot_channels, snapshot_nodes, snapshot_policies = snapshot or ({}, {}, {})
+        num_from_snapshot = 0
+        num_decoded = 0
+
+        def from_snapshot(records: dict, key: bytes, msg: bytes):
+            nonlocal num_from_snapshot, num_decoded
+            record = records.get(key)
+            if record is not None and record[0] == gossip_msg_digest(msg):
+                num_from_snapshot += 1
+                return record[1]
+            num_decoded += 1
+            return None
+
         c.execute("""SELECT * FROM channel_info""")
         for short_channel_id, msg in c:
             maybe_abort()
-            try:
-                ci = ChannelInfo.from_raw_msg(msg)
-            except IncompatibleOrInsaneFeatures:
-                continue
-            except FailedToParseMsg:
-                continue
+            ci = from_snapshot(snapshot_channels, short_channel_id, msg)
+            if ci is None:
+                try:
+                    ci = ChannelInfo.from_raw_msg(msg)
+                except IncompatibleOrInsaneFeatures:
+                    continue
+                except FailedToParseMsg:
+                    continue
             self._channels[ShortChannelID.normalize(short_channel_id)] = ci
         c.execute("""SELECT * FROM node_info""")
         for node_id, msg in c:
             maybe_abort()
-            try:
-                node_info, node_addresses = NodeInfo.from_raw_msg(msg)
-            except IncompatibleOrInsaneFeatures:
-                continue
-            except FailedToParseMsg:
-                continue
+            node_info = from_snapshot(snapshot_nodes, node_id, msg)
+            if node_info is None:
+                try:
+                    node_info, node_addresses = NodeInfo.from_raw_msg(msg)
+                except IncompatibleOrInsaneFeatures:
+                    continue
+                except FailedToParseMsg:
+                    continue
             # don't load node_addresses because they dont have timestamps
             self._nodes[node_id] = node_info
         c.execute("""SELECT * FROM policy""")
         for key, msg in c:
             maybe_abort()
-            try:
-                p = Policy.from_raw_msg(key, msg)
-            except FailedToParseMsg:
-                continue
+            p = from_snapshot(snapshot_policies, key, msg)
+            if p is None:
+                try:
+                    p = Policy.from_raw_msg(key, msg)
+                except FailedToParseMsg:
+                    continue
             self._policies[(p.start_node, p.short_channel_id)] = p
+        num_snapshot_records = len(snapshot_channels) + len(snapshot_nodes) + len(snapshot_policies)
+        self._snapshot_dirty = num_decoded > 0 or num_from_snapshot < num_snapshot_records
+        self.logger.info(f'gossip snapshot: {num_from_snapshot} rows loaded, {num_decoded} rows decoded')
         for channel_info in self._channels.values():
             self._channels_for_node[channel_info.node1_id].add(channel_info.short_channel_id)
             self._channels_for_node[channel_info.node2_id].add(channel_info.short_channel_id)
             self._update_num_policies_for_chan(channel_info.short_channel_id)
+        with self.lock:
+            self._graph_changes.update(self._channels_for_node.keys())
         self.logger.info(f'data loaded. {len(self._channels)} chans. {len(self._policies)} policies. '
                          f'{len(self._channels_for_node)} nodes.')
         self.update_counts()
@@ -867,6 +956,145 @@ class ChannelDB(SqlDB):
         self.asyncio_loop.call_soon_threadsafe(self.data_loaded.set)
         util.trigger_callback('gossip_db_loaded')
 
+    def _read_snapshot(self) -> Optional[Tuple[dict, dict, dict]]:
+        """Returns the (channels, nodes, policies) of the gossip snapshot, as dicts
+        from the key of the sql row to (digest of msg, decoded msg).
+        """
+        try:
+            with open(self.snapshot_path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            self.logger.info(f'cannot read gossip snapshot: {e!r}')
+            return None
+        try:
+            return self._decode_snapshot(data)
+        except (GossipSnapshotError, struct.error, UnicodeDecodeError) as e:
+            self.logger.info(f'ignoring gossip snapshot: {e!r}')
+            return None
+
+    @classmethod
+    def _decode_snapshot(cls, data: bytes) -> Tuple[dict, dict, dict]:
+        header = _SNAPSHOT_HEADER.unpack_from(data)
+        magic, version, chain_hash, checksum, num_channels, num_nodes, num_policies = header
+        if magic != GOSSIP_SNAPSHOT_MAGIC:
+            raise GossipSnapshotError('not a gossip snapshot')
+        if version != GOSSIP_SNAPSHOT_VERSION:
+            raise GossipSnapshotError(f'unsupported version: {version}')
+        if chain_hash != constants.net.rev_genesis_bytes():
+            raise GossipSnapshotError('wrong chain hash')
+        offset = _SNAPSHOT_HEADER.size
+        if hashlib.sha256(data[offset:]).digest() != checksum:
+            raise GossipSnapshotError('checksum mismatch')
+        channels = {}
+        end = offset + num_channels * _SNAPSHOT_CHANNEL.size
+        for digest, short_channel_id, node1_id, node2_id, capacity_sat in _SNAPSHOT_CHANNEL.iter_unpack(data[offset:end]):
+            channels[short_channel_id] = digest, ChannelInfo(
+                short_channel_id=ShortChannelID.normalize(short_channel_id),
+                node1_id=node1_id,
+                node2_id=node2_id,
+                capacity_sat=capacity_sat if capacity_sat >= 0 else None)
+        offset = end
+        nodes = {}
+        for i in range(num_nodes):
+            digest, node_id, timestamp, features_len, alias_len = _SNAPSHOT_NODE.unpack_from(data, offset)
+            offset += _SNAPSHOT_NODE.size
+            features = int.from_bytes(data[offset:offset + features_len], 'big')
+            offset += features_len
+            alias = data[offset:offset + alias_len].decode('utf8')
+            offset += alias_len
+            nodes[node_id] = digest, NodeInfo(node_id=node_id, features=features, timestamp=timestamp, alias=alias)
+        policies = {}
+        end = offset + num_policies * _SNAPSHOT_POLICY.size
+        if end != len(data):
+            raise GossipSnapshotError('unexpected length')
+        for (digest, key, cltv_delta, htlc_minimum_msat, has_htlc_maximum_msat, htlc_maximum_msat, fee_base_msat,
+                fee_proportional_millionths, channel_flags, message_flags, timestamp) in _SNAPSHOT_POLICY.iter_unpack(data[offset:end]):
+            policies[key] = digest, Policy(
+                key=key,
+                cltv_delta=cltv_delta,
+                htlc_minimum_msat=htlc_minimum_msat,
+                htlc_maximum_msat=htlc_maximum_msat if has_htlc_maximum_msat else None,
+                fee_base_msat=fee_base_msat,
+                fee_proportional_millionths=fee_proportional_millionths,
+                channel_flags=channel_flags,
+                message_flags=message_flags,
+                timestamp=timestamp)
+        return channels, nodes, policies
+
+    def _encode_snapshot(self) -> bytes:
+        """Serializes the decoded messages of the sql tables. Runs in the sql thread.
+        Note: the in-memory tables can be ahead of the sql tables. Records whose
+        in-memory object was not decoded from the stored message are left out,
+        they are decoded again by load_data.
+        """
+        with self.lock:
+            _channels = self._channels.copy()
+            _nodes = self._nodes.copy()
+            _policies = self._policies.copy()
+        c = self.conn.cursor()
+        channels = []
+        c.execute("""SELECT * FROM channel_info""")
+        for short_channel_id, msg in c:
+            ci = _channels.get(short_channel_id)
+            if ci is None or (ci.node1_id, ci.node2_id) != _channel_announcement_node_ids(msg):
+                continue
+            channels.append(_SNAPSHOT_CHANNEL.pack(
+                gossip_msg_digest(msg), short_channel_id, ci.node1_id, ci.node2_id,
+                ci.capacity_sat if ci.capacity_sat is not None else -1))
+        nodes = []
+        c.execute("""SELECT * FROM node_info""")
+        for node_id, msg in c:
+            node_info = _nodes.get(node_id)
+            if node_info is None or node_info.timestamp != _node_announcement_timestamp(msg):
+                continue
+            features = node_info.features.to_bytes((node_info.features.bit_length() + 7) // 8, 'big')
+            alias = node_info.alias.encode('utf8')
+            nodes.append(_SNAPSHOT_NODE.pack(
+                gossip_msg_digest(msg), node_id, node_info.timestamp, len(features), len(alias)) + features + alias)
+        policies = []
+        c.execute("""SELECT * FROM policy""")
+        for key, msg in c:
+            p = _policies.get((key[8:], key[0:8]))
+            if p is None or p.timestamp != _channel_update_timestamp(msg):
+                continue
+            policies.append(_SNAPSHOT_POLICY.pack(
+                gossip_msg_digest(msg), key, p.cltv_delta, p.htlc_minimum_msat,
+                p.htlc_maximum_msat is not None, p.htlc_maximum_msat or 0, p.fee_base_msat,
+                p.fee_proportional_millionths, p.channel_flags, p.message_flags, p.timestamp))
+        body = b''.join(channels) + b''.join(nodes) + b''.join(policies)
+        header = _SNAPSHOT_HEADER.pack(
+            GOSSIP_SNAPSHOT_MAGIC, GOSSIP_SNAPSHOT_VERSION, constants.net.rev_genesis_bytes(),
+            hashlib.sha256(body).digest(), len(channels), len(nodes), len(policies))
+        return header + body
+
+    def _save_snapshot(self) -> None:
+        if not self._snapshot_dirty:
+            return
+        try:
+            data = self._encode_snapshot()
+            temp_path = self.snapshot_path + '.tmp'
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.snapshot_path)
+        except (OSError, struct.error, OverflowError) as e:
+            self.logger.warning(f'cannot write gossip snapshot: {e!r}')
+            return
+        self._snapshot_dirty = False
+        self.logger.info(f'gossip snapshot written: {len(data)} bytes')
+
+    @sql
+    def save_snapshot(self) -> None:
+        """Writes the gossip snapshot, if the tables changed."""
+        self._save_snapshot()
+
+    def close_database(self):
+        if self.data_loaded.is_set():
+            self._save_snapshot()
+
     def _update_num_policies_for_chan(self, short_channel_id: ShortChannelID) -> None:
         channel_info = self.get_channel_info(short_channel_id)
         if channel_info is None:
@@ -888,6 +1116,15 @@ class ChannelDB(SqlDB):
             else:
                 self._chans_with_1_policies.add(short_channel_id)
 
+    def pop_graph_changes(self) -> Set[bytes]:
+        """Returns the node_ids whose channels, policies or features changed
+        since the last call.
+        """
+        with self.lock:
+            changes = self._graph_changes
+            self._graph_changes = set()
+        return changes
+
     def get_num_channels_partitioned_by_policy_count(self) -> Tuple[int, int, int]:
         nchans_with_0p = len(self._chans_with_0_policies)
         nchans_with_1p = len(self._chans_with_1_policies)
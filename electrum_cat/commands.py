@@ -884,10 +884,16 @@ class Commands(Logger):
         return "Catcoin network does not support RBF and Bump Fee at the moment"
 
     @command('w')
-    async def onchain_history(self, show_fiat=False, year=None, show_addresses=False, wallet: Abstract_Wallet = None):
-        """Wallet onchain history. Returns the transaction history of your wallet."""
+    async def onchain_history(self, show_fiat=False, year=None, show_addresses=False,
+                              from_height=None, to_height=None, limit=None, after_txid=None,
+                              wallet: Abstract_Wallet = None):
+        """Wallet onchain history. Returns the transaction history of your wallet.
+        Large histories can be fetched page by page, using 'limit', and passing the
+        txid of the last item of a page as 'after_txid' to get the next one.
+        """
         kwargs = self.get_year_timestamps(year)
-        onchain_history = wallet.get_onchain_history(**kwargs)
+        onchain_history = wallet.get_onchain_history(
+            from_height=from_height, to_height=to_height, after_txid=after_txid, limit=limit, **kwargs)
         out = [x.to_dict() for x in onchain_history.values()]
         if show_fiat:
             from .exchange_rate import FxThread
@@ -1194,7 +1200,7 @@ class Commands(Logger):
         """
         if not is_hash256_str(txid):
             raise UserFacingException(f"{repr(txid)} is not a txid")
-        if not wallet.db.get_transaction(txid):
+        if not wallet.db.has_transaction(txid):
             raise UserFacingException("Transaction not in wallet.")
         return {
             "confirmations": wallet.adb.get_tx_height(txid).conf,
@@ -1310,6 +1316,12 @@ class Commands(Logger):
             self.network.path_finder.liquidity_hints.reset_liquidity_hints()
             self.network.path_finder.clear_blacklist()
 
+    @command('n')
+    async def get_route_cache_stats(self):
+        """Hit rate and latency of the lightning route cache"""
+        if self.network.path_finder:
+            return self.network.path_finder.get_route_cache_stats()
+
     @command('wnpl')
     async def close_channel(self, channel_point, force=False, password=None, wallet: Abstract_Wallet = None):
         txid, index = channel_point.split(':')
@@ -1619,6 +1631,8 @@ command_options = {
     'year':        (None, "Show history for a given year"),
     'from_height': (None, "Only show transactions that confirmed after given block height"),
     'to_height':   (None, "Only show transactions that confirmed before given block height"),
+    'limit':       (None, "Maximum number of items to return"),
+    'after_txid':  (None, "Only show items after this txid (pagination)"),
     'iknowwhatimdoing': (None, "Acknowledge that I understand the full implications of what I am about to do"),
     'gossip':      (None, "Apply command to gossip node instead of wallet"),
     'connection_string':      (None, "Lightning network node ID or network address"),
@@ -1641,6 +1655,7 @@ arg_types = {
     'year': int,
     'from_height': int,
     'to_height': int,
+    'limit': int,
     'tx': convert_raw_tx_to_hex,
     'pubkeys': json_loads,
     'jsontx': json_loads,
@@ -77,6 +77,7 @@ class AbstractNet:
     DEFAULT_SERVERS: Mapping[str, Mapping[str, str]]
     FALLBACK_LN_NODES: Sequence[LNPeerAddr]
     CHECKPOINTS: Sequence[Tuple[str, int]]
+    HEADERS_SNAPSHOT_SIGNERS: Sequence[str] = ()  # addresses trusted to sign headers snapshots
     LN_DNS_SEEDS: Sequence[str]
     XPRV_HEADERS: Mapping[str, int]
     XPRV_HEADERS_INV: Mapping[int, str]
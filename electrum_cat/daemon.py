@@ -237,6 +237,7 @@ class AuthenticatedServer(Logger):
                                     text='Unauthorized', status=401)
             except AuthenticationCredentialsInvalid:
                 return web.Response(text='Forbidden', status=403)
+        http_request = request
         try:
             request = await request.text()
             request = json.loads(request)
@@ -273,8 +274,24 @@ class AuthenticatedServer(Logger):
                     "traceback": "".join(traceback.format_exception(e)),
                 },
             }
+        if (http_request.headers.get('Accept') == 'application/x-ndjson'
+                and isinstance(response.get('result'), list)):
+            return await self._send_ndjson_response(http_request, response['result'])
         return web.json_response(response)
 
+    async def _send_ndjson_response(self, http_request, items: Sequence) -> web.StreamResponse:
+        """Streams a list result as newline-delimited JSON, one item per line,
+        so that large results are not serialized as a single blob.
+        Errors are still returned as regular JSON-RPC responses.
+        """
+        response = web.StreamResponse()
+        response.content_type = 'application/x-ndjson'
+        await response.prepare(http_request)
+        for item in items:
+            await response.write((json.dumps(item) + '\n').encode('utf-8'))
+        await response.write_eof()
+        return response
+
 
 class CommandsServer(AuthenticatedServer):
 
@@ -492,6 +509,8 @@ class Daemon(Logger):
         db = WalletDB(storage.read(), storage=storage, upgrade=upgrade)
         if db.get_action():
             raise WalletUnfinished(db)
+        if config.WALLET_SQLITE_STORAGE and not storage.is_sqlite() and not storage.is_encrypted():
+            db.convert_storage_to_sqlite()
         wallet = Wallet(db, config=config)
         return wallet
 
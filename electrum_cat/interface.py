@@ -29,7 +29,7 @@ import sys
 import traceback
 import asyncio
 import socket
-from typing import Tuple, Union, List, TYPE_CHECKING, Optional, Set, NamedTuple, Any, Sequence, Dict
+from typing import Tuple, Union, List, TYPE_CHECKING, Optional, Set, NamedTuple, Any, Sequence, Dict, Callable
 from collections import defaultdict
 from ipaddress import IPv4Network, IPv6Network, ip_address, IPv6Address, IPv4Address
 import itertools
@@ -129,6 +129,21 @@ def assert_list_or_tuple(val: Any) -> None:
         raise RequestCorrupted(f'{val!r} should be a list or tuple')
 
 
+class _NewlineFramer(NewlineFramer):
+    """NewlineFramer that tells the session about the messages it drops for being over max_size."""
+
+    def __init__(self, *, max_size: int, on_message_dropped: Callable[[], None]):
+        super().__init__(max_size=max_size)
+        self._on_message_dropped = on_message_dropped
+
+    async def receive_message(self):
+        try:
+            return await super().receive_message()
+        except MemoryError:
+            self._on_message_dropped()
+            raise
+
+
 class NotificationSession(RPCSession):
 
     def __init__(self, *args, interface: 'Interface', **kwargs):
@@ -136,6 +151,7 @@ class NotificationSession(RPCSession):
         self.subscriptions = defaultdict(list)
         self.cache = {}
         self._msg_counter = itertools.count(start=1)
+        self._batches_in_flight = set()  # type: Set[asyncio.Future]  # set when a response was dropped
         self.interface = interface
         self.cost_hard_limit = 0  # disable aiorpcx resource limits
 
@@ -181,6 +197,58 @@ class NotificationSession(RPCSession):
             self.maybe_log(f"--> {response} (id: {msg_id})")
             return response
 
+    async def send_batch_request(self, method: str, params_list: Sequence[Sequence], *, timeout=None) -> List[Any]:
+        """Sends a request for each params in params_list, framed as a single JSON-RPC batch.
+        Returns the results in the same order. Error responses are returned, not raised.
+        If the response does not fit in a message, the batch is split in two, down to single requests.
+        """
+        assert params_list
+        try:
+            return await self._send_batch_request(method, params_list, timeout=timeout)
+        except ResponseTooLarge:
+            if len(params_list) == 1:
+                raise
+        self.interface.logger.info(f"response to a batch of {len(params_list)} {method} too large. splitting it")
+        middle = len(params_list) // 2
+        results = await self.send_batch_request(method, params_list[:middle], timeout=timeout)
+        return results + await self.send_batch_request(method, params_list[middle:], timeout=timeout)
+
+    async def _send_batch_request(self, method: str, params_list: Sequence[Sequence], *, timeout=None) -> List[Any]:
+        msg_id = next(self._msg_counter)
+        self.maybe_log(f"<-- batch of {len(params_list)} {method} (id: {msg_id})")
+
+        async def send_batch():
+            async with self.send_batch() as batch:
+                for params in params_list:
+                    batch.add_request(method, params)
+            return list(batch.results)
+        # we cannot tell which response was dropped: all the batches in flight are sent again, smaller
+        dropped = asyncio.get_running_loop().create_future()
+        self._batches_in_flight.add(dropped)
+        task = asyncio.ensure_future(util.wait_for2(send_batch(), timeout))
+        try:
+            await asyncio.wait([task, dropped], return_when=asyncio.FIRST_COMPLETED)
+            if not task.done():
+                raise ResponseTooLarge(f'response to batch request too large: {method} (id: {msg_id})')
+            results = task.result()
+        except (TaskTimeout, asyncio.TimeoutError) as e:
+            self.maybe_log(f"--> batch timed out: {method} (id: {msg_id})")
+            raise RequestTimedOut(f'batch request timed out: {method} (id: {msg_id})') from e
+        except BaseException as e:  # cancellations, etc. are useful for debugging
+            self.maybe_log(f"--> {repr(e)} (id: {msg_id})")
+            raise
+        else:
+            self.maybe_log(f"--> {results} (id: {msg_id})")
+            return results
+        finally:
+            self._batches_in_flight.discard(dropped)
+            task.cancel()
+
+    def _on_message_dropped(self) -> None:
+        for dropped in self._batches_in_flight:
+            if not dropped.done():
+                dropped.set_result(None)
+
     def set_default_timeout(self, timeout):
         assert hasattr(self, "sent_request_timeout")  # in base class
         self.sent_request_timeout = timeout
@@ -199,6 +267,22 @@ class NotificationSession(RPCSession):
             self.cache[key] = result
         await queue.put(params + [result])
 
+    async def subscribe_batch(self, method: str, params_list: Sequence[List], queue: asyncio.Queue):
+        """Like subscribe, for many params. The ones not in the cache are requested in a single batch."""
+        keys = [self.get_hashable_key_for_rpc_call(method, params) for params in params_list]
+        for key in keys:
+            self.subscriptions[key].append(queue)
+        missing = {key: params for key, params in zip(keys, params_list) if key not in self.cache}
+        if missing:
+            results = await self.send_batch_request(method, list(missing.values()))
+            for result in results:
+                if isinstance(result, Exception):
+                    raise result
+            for key, result in zip(missing, results):
+                self.cache.setdefault(key, result)  # a notification might have arrived in the meantime
+        for key, params in zip(keys, params_list):
+            await queue.put(params + [self.cache[key]])
+
     def unsubscribe(self, queue):
         """Unsubscribe a callback to free object references to enable GC."""
         # note: we can't unsubscribe from the server, so we keep receiving
@@ -221,7 +305,7 @@ class NotificationSession(RPCSession):
         # overridden so that max_size can be customized
         max_size = self.interface.network.config.NETWORK_MAX_INCOMING_MSG_SIZE
         assert max_size > 500_000, f"{max_size=} (< 500_000) is too small"
-        return NewlineFramer(max_size=max_size)
+        return _NewlineFramer(max_size=max_size, on_message_dropped=self._on_message_dropped)
 
     async def close(self, *, force_after: int = None):
         """Closes the connection and waits for it to be closed.
@@ -256,6 +340,10 @@ class RequestTimedOut(GracefulDisconnect):
 
 class RequestCorrupted(Exception): pass
 
+
+class ResponseTooLarge(GracefulDisconnect):
+    """The response is over the max incoming message size, and was dropped."""
+
 class ErrorParsingSSLCert(Exception): pass
 class ErrorGettingSSLCertFromServer(Exception): pass
 class ErrorSSLCertFingerprintMismatch(Exception): pass
@@ -637,12 +725,29 @@ class Interface(Logger):
         res = await self.session.send_request('blockchain.block.header', [height], timeout=timeout)
         return blockchain.deserialize_header(bytes.fromhex(res), height)
 
-    async def request_chunk(self, height: int, tip=None, *, can_return_early=False):
+    async def request_chunk(self, height: int, tip=None, *, can_return_early=False,
+                            chunk: Tuple[int, str, Optional[Sequence[bytes]]] = None):
+        """chunk, if given, is the result of _fetch_chunk for the same height
+        (possibly from another interface), used instead of downloading it.
+        """
         if not is_non_negative_integer(height):
             raise Exception(f"{repr(height)} is not a block height")
         index = height // 2016
         if can_return_early and index in self._requested_chunks:
             return
+        if chunk is None:
+            chunk = await self._fetch_chunk(height, tip)
+        count, hexdata, pow_hashes = chunk
+        conn = self.blockchain.connect_chunk(index, hexdata, pow_hashes=pow_hashes)
+        if not conn:
+            return conn, 0
+        return conn, count
+
+    async def _fetch_chunk(self, height: int, tip=None) -> Tuple[int, str, Optional[Sequence[bytes]]]:
+        """Downloads the chunk that contains height, and computes the PoW hashes
+        of its headers in worker processes. Returns (count, hex, pow_hashes).
+        """
+        index = height // 2016
         self.logger.info(f"requesting chunk from height {height}")
         size = 2016
         if tip is not None:
@@ -666,10 +771,10 @@ class Interface(Logger):
             raise RequestCorrupted(f"server uses too low 'max' count for block.headers: {res['max']} < 2016")
         if res['count'] != size:
             raise RequestCorrupted(f"expected {size} headers but only got {res['count']}")
-        conn = self.blockchain.connect_chunk(index, res['hex'])
-        if not conn:
-            return conn, 0
-        return conn, res['count']
+        pow_hashes = None
+        if not constants.net.TESTNET:
+            pow_hashes = await blockchain.pow_hash_raw_headers_in_executor(bfh(res['hex']))
+        return res['count'], res['hex'], pow_hashes
 
     async def request_chunk_before_last_cp(self, height: int, tip=None, *, can_return_early=False):
         if not is_non_negative_integer(height):
@@ -828,27 +933,40 @@ class Interface(Logger):
             return True
 
     async def sync_until(self, height, next_height=None):
+        from .network import HeaderSyncScheduler
         if next_height is None:
             next_height = self.tip
         last = None
-        while last is None or height <= next_height:
-            prev_last, prev_height = last, height
-            if next_height > height + 10:
-                could_connect, num_headers = await self.request_chunk(height, next_height)
-                if not could_connect:
-                    if height <= constants.net.max_checkpoint():
-                        raise GracefulDisconnect('server chain conflicts with checkpoints or genesis')
+        scheduler = None  # type: Optional[HeaderSyncScheduler]
+        try:
+            while last is None or height <= next_height:
+                prev_last, prev_height = last, height
+                if next_height > height + 10:
+                    if scheduler is None:
+                        scheduler = HeaderSyncScheduler(self.network, self, next_height)
+                    chunk, source = await scheduler.get_chunk(height)
+                    could_connect, num_headers = await self.request_chunk(height, next_height, chunk=chunk)
+                    if not could_connect and source != self:
+                        # that server might be on another fork than us. ask ours
+                        await scheduler.on_chunk_rejected(height, source, chunk)
+                        continue
+                    if not could_connect:
+                        if height <= constants.net.max_checkpoint():
+                            raise GracefulDisconnect('server chain conflicts with checkpoints or genesis')
+                        last, height = await self.step(height)
+                        continue
+                    util.trigger_callback('blockchain_updated')
+                    util.trigger_callback('network_updated')
+                    height = (height // 2016 * 2016) + num_headers
+                    assert height <= next_height+1, (height, self.tip)
+                    last = 'catchup'
+                else:
                     last, height = await self.step(height)
-                    continue
-                util.trigger_callback('blockchain_updated')
-                util.trigger_callback('network_updated')
-                height = (height // 2016 * 2016) + num_headers
-                assert height <= next_height+1, (height, self.tip)
-                last = 'catchup'
-            else:
-                last, height = await self.step(height)
-            assert (prev_last, prev_height) != (last, height), 'had to prevent infinite loop in interface.sync_until'
-        return last, height
+                assert (prev_last, prev_height) != (last, height), 'had to prevent infinite loop in interface.sync_until'
+            return last, height
+        finally:
+            if scheduler is not None:
+                await scheduler.close()
 
     async def step(self, height, header=None):
         assert 0 <= height <= self.tip, (height, self.tip)
@@ -1034,6 +1152,27 @@ class Interface(Logger):
         if not is_hash256_str(tx_hash):
             raise Exception(f"{repr(tx_hash)} is not a txid")
         raw = await self.session.send_request('blockchain.transaction.get', [tx_hash], timeout=timeout)
+        self._check_raw_transaction(tx_hash, raw)
+        return raw
+
+    async def get_transactions(self, tx_hashes: Sequence[str]) -> List[Union[str, aiorpcx.RPCError]]:
+        """Like get_transaction, but requests all the transactions in a single batch.
+        Error responses (e.g. tx not found) are returned, not raised.
+        """
+        for tx_hash in tx_hashes:
+            if not is_hash256_str(tx_hash):
+                raise Exception(f"{repr(tx_hash)} is not a txid")
+        results = await self.session.send_batch_request('blockchain.transaction.get', [[h] for h in tx_hashes])
+        for tx_hash, raw in zip(tx_hashes, results):
+            if isinstance(raw, aiorpcx.RPCError):
+                continue
+            if isinstance(raw, Exception):
+                raise raw
+            self._check_raw_transaction(tx_hash, raw)
+        return results
+
+    @classmethod
+    def _check_raw_transaction(cls, tx_hash: str, raw) -> None:
         # validate response
         if not is_hex_str(raw):
             raise RequestCorrupted(f"received garbage (non-hex) as tx data (txid {tx_hash}): {raw!r}")
@@ -1044,13 +1183,30 @@ class Interface(Logger):
             raise RequestCorrupted(f"cannot deserialize received transaction (txid {tx_hash})") from e
         if tx.txid() != tx_hash:
             raise RequestCorrupted(f"received tx does not match expected txid {tx_hash} (got {tx.txid()})")
-        return raw
 
     async def get_history_for_scripthash(self, sh: str) -> List[dict]:
         if not is_hash256_str(sh):
             raise Exception(f"{repr(sh)} is not a scripthash")
         # do request
         res = await self.session.send_request('blockchain.scripthash.get_history', [sh])
+        self._check_history_for_scripthash(sh, res)
+        return res
+
+    async def get_history_for_scripthashes(self, shs: Sequence[str]) -> List[List[dict]]:
+        """Like get_history_for_scripthash, but requests all the histories in a single batch."""
+        for sh in shs:
+            if not is_hash256_str(sh):
+                raise Exception(f"{repr(sh)} is not a scripthash")
+        # do request
+        results = await self.session.send_batch_request('blockchain.scripthash.get_history', [[sh] for sh in shs])
+        for sh, res in zip(shs, results):
+            if isinstance(res, Exception):
+                raise res
+            self._check_history_for_scripthash(sh, res)
+        return results
+
+    @classmethod
+    def _check_history_for_scripthash(cls, sh: str, res) -> None:
         # check response
         assert_list_or_tuple(res)
         prev_height = 1
@@ -1074,7 +1230,6 @@ class Interface(Logger):
             # a recently mined tx could be included in both last block and mempool?
             # Still, it's simplest to just disregard the response.
             raise RequestCorrupted(f"server history has non-unique txids for sh={sh}")
-        return res
 
     async def listunspent_for_scripthash(self, sh: str) -> List[dict]:
         if not is_hash256_str(sh):
@@ -25,7 +25,7 @@
 import threading
 import copy
 import json
-from typing import TYPE_CHECKING, Optional
+from typing import TYPE_CHECKING, Optional, Iterable, Set, Tuple, Sequence
 import jsonpatch
 
 from . import util
@@ -139,7 +139,9 @@ class StoredDict(dict):
             if self.db and json.dumps(v, cls=self.db.encoder) == json.dumps(self[key], cls=self.db.encoder):
                 return
         # recursively set db and path
-        if isinstance(v, StoredDict):
+        if isinstance(v, LazyStoredDict):
+            assert v.db is self.db and v.path == self.path + [key]
+        elif isinstance(v, StoredDict):
             #assert v.db is None
             v.db = self.db
             v.path = self.path + [key]
@@ -190,6 +192,75 @@ class StoredDict(dict):
         return r
 
 
+_LAZY = object()  # placeholder for values that have not been read from the storage yet
+
+
+class LazyStoredDict(StoredDict):
+    """A top-level StoredDict of a db with sqlite storage (see JsonDB.LAZY_KEYS).
+
+    Its values are read from the storage and decoded the first time they are accessed.
+    """
+
+    def __init__(self, keys: Iterable[str], db: 'JsonDB', path):
+        StoredDict.__init__(self, {}, db, path)
+        for key in keys:
+            dict.__setitem__(self, key, _LAZY)
+
+    def _load(self, key):
+        v = dict.__getitem__(self, key)
+        if v is _LAZY:
+            name = self.path[-1]
+            value = json.loads(self.db.storage.sqlite.get(name, key))
+            value = self.db._convert_dict(self.path[:-1], name, {key: value})[key]
+            StoredDict.__setitem__(self, key, value, patch=False)
+            v = dict.__getitem__(self, key)
+        return v
+
+    @locked
+    def __getitem__(self, key):
+        return self._load(key)
+
+    def __iter__(self):
+        # defined so that dict(self) and dict.update(self) go through __getitem__
+        return dict.__iter__(self)
+
+    @locked
+    def get(self, key, default=None):
+        if key not in self:
+            return default
+        return self._load(key)
+
+    @locked
+    def items(self):
+        return [(k, self._load(k)) for k in list(self.keys())]
+
+    @locked
+    def values(self):
+        return [self._load(k) for k in list(self.keys())]
+
+    @locked
+    def pop(self, key, v=_RaiseKeyError):
+        if key in self:
+            self._load(key)
+        return StoredDict.pop(self, key, v)
+
+    @locked
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self._load(key)
+
+    @locked
+    def copy(self) -> dict:
+        return dict(self.items())
+
+    @locked
+    def clear(self):
+        dict.clear(self)
+        if self.db:
+            self.db.add_patch({'op': 'replace', 'path': key_path(self.path, None), 'value': {}})
+
+
 class StoredList(list):
 
     def __init__(self, data, db, path):
@@ -222,6 +293,11 @@ class StoredList(list):
 
 class JsonDB(Logger):
 
+    # Top-level dicts whose items are stored as separate rows with the
+    # sqlite storage, so that they are read lazily and written one by one.
+    # Their keys must be strings.
+    LAZY_KEYS = ()  # type: Sequence[str]
+
     def __init__(
         self,
         s: str,
@@ -235,9 +311,13 @@ class JsonDB(Logger):
         self.storage = storage
         self.encoder = encoder
         self.pending_changes = []
+        self._dirty_rows = set()  # type: Set[Tuple[str, str]]  # sqlite storage: (parent, key) of changed rows
         self._modified = False
         # load data
-        data = self.load_data(s)
+        if self.storage and self.storage.is_sqlite():
+            data = self._load_sqlite_data()
+        else:
+            data = self.load_data(s)
         if upgrader:
             data, was_upgraded = upgrader(data)
             self._modified |= was_upgraded
@@ -245,7 +325,11 @@ class JsonDB(Logger):
         self.data = StoredDict(data, self, [])
         # write file in case there was a db upgrade
         if self.storage and self.storage.file_exists():
-            self.write_and_force_consolidation()
+            if self.storage.is_sqlite() and self.modified():
+                # changes made by the upgrader are not tracked
+                self.convert_storage_to_sqlite()
+            else:
+                self.write_and_force_consolidation()
 
     def load_data(self, s: str) -> dict:
         if s == '':
@@ -304,6 +388,23 @@ class JsonDB(Logger):
                 self.logger.info('found incomplete data {s[i:]}')
                 return self.load_data(s[0:-2])
 
+    def _load_sqlite_data(self) -> dict:
+        sqlite = self.storage.sqlite
+        data = {key: json.loads(value) for key, value in sqlite.get_items('')}
+        lazy = self._can_load_lazily(data)
+        for name in self.LAZY_KEYS:
+            if name not in data:
+                continue
+            if lazy:
+                data[name] = LazyStoredDict(sqlite.get_keys(name), self, [name])
+            else:
+                data[name] = {key: json.loads(value) for key, value in sqlite.get_items(name)}
+        return data
+
+    def _can_load_lazily(self, data: dict) -> bool:
+        """Whether the lazy dicts can be left undecoded, e.g. because the db does not need an upgrade."""
+        return True
+
     def set_modified(self, b):
         with self.lock:
             self._modified = b
@@ -313,7 +414,14 @@ class JsonDB(Logger):
 
     @locked
     def add_patch(self, patch):
-        self.pending_changes.append(json.dumps(patch, cls=self.encoder))
+        if self.storage and self.storage.is_sqlite():
+            keys = patch['path'].split('/')[1:3]
+            if keys[0] in self.LAZY_KEYS and len(keys) == 2:
+                self._dirty_rows.add((keys[0], keys[1]))
+            else:
+                self._dirty_rows.add(('', keys[0]))
+        else:
+            self.pending_changes.append(json.dumps(patch, cls=self.encoder))
         self.set_modified(True)
 
     @locked
@@ -398,10 +506,15 @@ class JsonDB(Logger):
         return v
 
     @locked
-    def write(self):
-        if (not self.storage.file_exists()
-                or self.storage.is_encrypted()
-                or self.storage.needs_consolidation()):
+    def write(self, *, consolidate: bool = False):
+        """Appends the pending changes to the file, or rewrites it.
+        consolidate: rewrite the file if changes were appended to it.
+        """
+        if self._uses_sqlite():
+            self.write_and_force_consolidation()  # only writes the changed rows
+        elif (not self.storage.can_append()
+                or self.storage.needs_consolidation()
+                or (consolidate and self.storage.has_appended_data())):
             self.write_and_force_consolidation()
         else:
             self._append_pending_changes()
@@ -425,7 +538,59 @@ class JsonDB(Logger):
             raise Exception('daemon thread cannot write db')
         if not self.modified():
             return
-        json_str = self.dump(human_readable=not self.storage.is_encrypted())
-        self.storage.write(json_str)
+        if self._uses_sqlite():
+            self._write_dirty_rows()
+        else:
+            json_str = self.dump(human_readable=not self.storage.is_encrypted())
+            self.storage.write(json_str)
+        self.pending_changes = []
+        self._dirty_rows.clear()
+        self.set_modified(False)
+
+    def _uses_sqlite(self) -> bool:
+        # an encrypted storage is written as json (the sqlite format does not support encryption)
+        return self.storage.is_sqlite() and not self.storage.is_encrypted()
+
+    def _get_sqlite_rows(self, name: str, value) -> Iterable[Tuple[str, str, str]]:
+        if name in self.LAZY_KEYS and isinstance(value, dict):
+            yield '', name, '{}'
+            for k, v in value.items():
+                assert isinstance(k, str), f"keys of {name} must be strings"
+                yield name, k, json.dumps(v, cls=self.encoder)
+        else:
+            yield '', name, json.dumps(value, cls=self.encoder)
+
+    def _write_dirty_rows(self):
+        upserts, deletes, delete_parents = [], [], []
+        missing = object()
+        for parent, key in self._dirty_rows:
+            if parent:
+                d = dict.get(self.data, parent)
+                if d is None or ('', parent) in self._dirty_rows:
+                    continue  # whole dict written below
+                v = dict.get(d, key, missing)
+                if v is missing:
+                    deletes.append((parent, key))
+                elif v is not _LAZY:
+                    upserts.append((parent, key, json.dumps(v, cls=self.encoder)))
+            else:
+                v = dict.get(self.data, key, missing)
+                if key in self.LAZY_KEYS:
+                    delete_parents.append(key)
+                if v is missing:
+                    deletes.append(('', key))
+                else:
+                    upserts.extend(self._get_sqlite_rows(key, v))
+        self.logger.info(f'writing {len(upserts)} rows, deleting {len(deletes) + len(delete_parents)}')
+        self.storage.sqlite.update(upserts=upserts, deletes=deletes, delete_parents=delete_parents)
+
+    @locked
+    def convert_storage_to_sqlite(self) -> None:
+        """Rewrites the file in the sqlite format."""
+        rows = []
+        for key, value in self.data.items():
+            rows.extend(self._get_sqlite_rows(key, value))
+        self.storage.write_sqlite(rows)
         self.pending_changes = []
+        self._dirty_rows.clear()
         self.set_modified(False)
@@ -442,6 +442,12 @@ class MasterPublicKeyMixin(ABC):
         """
         pass
 
+    def derive_pubkey_range(self, for_change: int, start: int, stop: int) -> Sequence[bytes]:
+        """Returns the pubkeys at (for_change, n) for n in range(start, stop).
+        May raise CannotDerivePubkey.
+        """
+        return [self.derive_pubkey(for_change, n) for n in range(start, stop)]
+
     def get_pubkey_derivation(
             self,
             pubkey: bytes,
@@ -506,6 +512,7 @@ class Xpub(MasterPublicKeyMixin):
         self.xpub_receive = None
         self.xpub_change = None
         self._xpub_bip32_node = None  # type: Optional[BIP32Node]
+        self._derived_pubkeys = {}  # type: Dict[Tuple[int, int], bytes]  # (for_change, n) -> pubkey
 
         # "key origin" info (subclass should persist these):
         self._derivation_prefix = derivation_prefix  # type: Optional[str]
@@ -609,8 +616,7 @@ class Xpub(MasterPublicKeyMixin):
             self._derivation_prefix = derivation_prefix
         self.is_requesting_to_be_rewritten_to_wallet_file = True
 
-    @lru_cache(maxsize=None)
-    def derive_pubkey(self, for_change: int, n: int) -> bytes:
+    def _get_xpub_for_branch(self, for_change: int) -> str:
         for_change = int(for_change)
         if for_change not in (0, 1):
             raise CannotDerivePubkey("forbidden path")
@@ -622,7 +628,23 @@ class Xpub(MasterPublicKeyMixin):
                 self.xpub_change = xpub
             else:
                 self.xpub_receive = xpub
-        return self.get_pubkey_from_xpub(xpub, (n,))
+        return xpub
+
+    def derive_pubkey(self, for_change: int, n: int) -> bytes:
+        key = (int(for_change), n)
+        if (pubkey := self._derived_pubkeys.get(key)) is None:
+            xpub = self._get_xpub_for_branch(for_change)
+            pubkey = self._derived_pubkeys[key] = self.get_pubkey_from_xpub(xpub, (n,))
+        return pubkey
+
+    def derive_pubkey_range(self, for_change: int, start: int, stop: int) -> Sequence[bytes]:
+        for_change = int(for_change)
+        missing = [n for n in range(start, stop) if (for_change, n) not in self._derived_pubkeys]
+        if missing:
+            xpub = self._get_xpub_for_branch(for_change)
+            for n, pubkey in zip(missing, BIP32Node.from_xkey(xpub).derive_child_pubkeys(missing)):
+                self._derived_pubkeys[(for_change, n)] = pubkey
+        return [self._derived_pubkeys[(for_change, n)] for n in range(start, stop)]
 
     @classmethod
     def get_pubkey_from_xpub(self, xpub: str, sequence) -> bytes:
@@ -23,9 +23,11 @@
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-import queue
-from collections import defaultdict
-from typing import Sequence, Tuple, Optional, Dict, TYPE_CHECKING, Set, Callable
+import heapq
+import itertools
+from array import array
+from collections import defaultdict, OrderedDict
+from typing import Sequence, Tuple, Optional, Dict, TYPE_CHECKING, Set, Callable, List, Iterable
 import time
 import threading
 from threading import RLock
@@ -37,7 +39,7 @@ from .util import profiler, with_lock
 from .logging import Logger
 from .lnutil import (NUM_MAX_EDGES_IN_PAYMENT_PATH, ShortChannelID, LnFeatures,
                      NBLOCK_CLTV_DELTA_TOO_FAR_INTO_FUTURE, PaymentFeeBudget)
-from .channel_db import ChannelDB, Policy, NodeInfo
+from .channel_db import ChannelDB, Policy, NodeInfo, ChannelDBNotLoaded
 
 if TYPE_CHECKING:
     from .lnchannel import Channel
@@ -45,6 +47,9 @@ if TYPE_CHECKING:
 DEFAULT_PENALTY_BASE_MSAT = 500  # how much base fee we apply for unknown sending capability of a channel
 DEFAULT_PENALTY_PROPORTIONAL_MILLIONTH = 100  # how much relative fee we apply for unknown sending capability of a channel
 HINT_DURATION = 3600  # how long (in seconds) a liquidity hint remains valid
+ROUTE_CACHE_MAX_ENTRIES = 1000  # number of (destination, amount bucket, ...) entries kept by the route cache
+ROUTE_CACHE_MAX_PATHS = 8  # how many alternative paths are computed for an entry, before searching from scratch
+ROUTE_CACHE_TTL = 600  # how long (in seconds) cached paths are used
 
 
 class NoChannelPolicy(Exception):
@@ -300,6 +305,7 @@ class LiquidityHintMgr:
     def __init__(self):
         self.lock = RLock()
         self._liquidity_hints: Dict[ShortChannelID, LiquidityHint] = {}
+        self.epoch = 0  # incremented when all hints are reset
 
     @with_lock
     def get_hint(self, channel_id: ShortChannelID) -> LiquidityHint:
@@ -371,6 +377,7 @@ class LiquidityHintMgr:
     def reset_liquidity_hints(self):
         for k, v in self._liquidity_hints.items():
             v.hint_timestamp = 0
+        self.epoch += 1
 
     def __repr__(self):
         string = "liquidity hints:\n"
@@ -380,6 +387,278 @@ class LiquidityHintMgr:
         return string
 
 
+# edges with a larger cltv_delta are never used (the cost function would not work well for extreme cases)
+MAX_EDGE_CLTV_DELTA = 14 * 144
+
+
+class CompiledGraph:
+    """Snapshot of the public channel graph, for path finding.
+
+    Nodes are numbered. The edges that can be used to reach a node are stored
+    in compressed sparse row format: the edges towards node i are at positions
+    offsets[i] to offsets[i+1] of the edge arrays, which hold the other node,
+    the short channel id and the policy of the other node for the channel.
+    Edges that can never be used (missing policy in either direction, disabled,
+    cltv_delta too large, end node without var_onion_optin) are left out.
+    Policy changes are patched into the edge arrays in place, see patch_rows.
+    """
+
+    # fields of the rows given to from_rows, and of the edge arrays
+    EDGE_FIELDS = (
+        'start_nodes', 'short_channel_ids', 'fee_base_msat', 'fee_proportional_millionths',
+        'cltv_delta', 'htlc_minimum_msat', 'htlc_maximum_msat', 'capacity_sat',
+    )
+    __slots__ = ('node_ids', 'node_index', 'offsets') + EDGE_FIELDS
+
+    def __init__(self, *, node_ids: Sequence[bytes], node_index: Dict[bytes, int], offsets: array, **edge_arrays):
+        self.node_ids = tuple(node_ids)
+        self.node_index = node_index
+        self.offsets = offsets
+        for name in self.EDGE_FIELDS:
+            setattr(self, name, edge_arrays[name])
+        # htlc_maximum_msat is -1 if not set, capacity_sat is -1 if unknown
+
+    @classmethod
+    def from_rows(cls, node_ids: Sequence[bytes], rows: Iterable[Sequence[tuple]]) -> 'CompiledGraph':
+        offsets = array('l', [0])
+        edge_arrays = {
+            name: [] if name == 'short_channel_ids' else array('l' if name == 'start_nodes' else 'q')
+            for name in cls.EDGE_FIELDS}
+        columns = [edge_arrays[name] for name in cls.EDGE_FIELDS]
+        for row in rows:
+            offsets.append(offsets[-1] + len(row))
+            for edge in row:
+                for column, value in zip(columns, edge):
+                    column.append(value)
+        return cls(
+            node_ids=node_ids,
+            node_index={node_id: i for i, node_id in enumerate(node_ids)},
+            offsets=offsets,
+            **edge_arrays)
+
+    def get_row(self, i: int) -> List[tuple]:
+        """Returns the edges towards node i, as given to from_rows."""
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return list(zip(*(getattr(self, name)[start:end] for name in self.EDGE_FIELDS)))
+
+    def patch_rows(self, rows: Dict[int, Sequence[tuple]]) -> None:
+        """Replaces the edges towards the given nodes, in place.
+        The new rows must have as many edges as the old ones.
+        """
+        for k, name in enumerate(self.EDGE_FIELDS):
+            column = getattr(self, name)
+            for i, row in rows.items():
+                start = self.offsets[i]
+                assert len(row) == self.offsets[i + 1] - start
+                values = [edge[k] for edge in row]
+                column[start:start + len(row)] = values if name == 'short_channel_ids' else array(column.typecode, values)
+
+    @property
+    def num_nodes(self) -> int:
+        return len(self.node_ids)
+
+    @property
+    def num_edges(self) -> int:
+        return len(self.start_nodes)
+
+
+class GraphCompiler:
+    """Maintains a CompiledGraph of a ChannelDB.
+
+    Only the rows of the nodes reported by ChannelDB.pop_graph_changes are
+    recomputed. If they have the same number of edges as before, they are
+    patched into the graph, otherwise the graph is rebuilt, with the other
+    rows taken from the current one. Node numbers are never reused.
+    """
+
+    def __init__(self, channel_db: ChannelDB):
+        self.channel_db = channel_db
+        self._node_ids = []  # type: List[bytes]
+        self._node_index = {}  # type: Dict[bytes, int]
+        self._graph = None  # type: Optional[CompiledGraph]
+        self._lock = threading.Lock()
+        self.epoch = 0  # incremented each time the graph changes
+
+    def _get_node_index(self, node_id: bytes) -> int:
+        i = self._node_index.get(node_id)
+        if i is None:
+            i = len(self._node_ids)
+            self._node_index[node_id] = i
+            self._node_ids.append(node_id)
+        return i
+
+    def _compile_row(self, node_id: bytes) -> Sequence[tuple]:
+        """Returns the usable public edges towards node_id, see CompiledGraph.EDGE_FIELDS."""
+        db = self.channel_db
+        node_info = db.get_node_info_for_node_id(node_id)
+        # it's ok if we are missing the node_announcement (node_info) for this node,
+        # but if we have it, we enforce that they support var_onion_optin
+        if node_info and not LnFeatures(node_info.features).supports(LnFeatures.VAR_ONION_OPT):
+            return ()
+        with db.lock:
+            scids = list(db._channels_for_node.get(node_id, ()))
+        row = []
+        for scid in scids:
+            channel_info = db._channels.get(scid)
+            if channel_info is None:
+                continue
+            start_node = channel_info.node2_id if channel_info.node1_id == node_id else channel_info.node1_id
+            policy = db._policies.get((start_node, scid))
+            # channels that did not publish both policies often return temporary channel failure
+            if policy is None or (node_id, scid) not in db._policies:
+                continue
+            if policy.is_disabled() or policy.cltv_delta > MAX_EDGE_CLTV_DELTA:
+                continue
+            row.append((
+                self._get_node_index(start_node),
+                scid,
+                policy.fee_base_msat,
+                policy.fee_proportional_millionths,
+                policy.cltv_delta,
+                policy.htlc_minimum_msat,
+                policy.htlc_maximum_msat if policy.htlc_maximum_msat is not None else -1,
+                channel_info.capacity_sat if channel_info.capacity_sat is not None else -1,
+            ))
+        return row
+
+    def get_graph(self) -> CompiledGraph:
+        with self._lock:
+            changes = self.channel_db.pop_graph_changes()
+            graph = self._graph
+            if graph is not None and not changes:
+                return graph
+            rows = {}
+            for node_id in changes:
+                i = self._get_node_index(node_id)
+                rows[i] = self._compile_row(node_id)
+            can_patch = (
+                graph is not None
+                and graph.num_nodes == len(self._node_ids)
+                and all(len(row) == graph.offsets[i + 1] - graph.offsets[i] for i, row in rows.items()))
+            if can_patch:
+                graph.patch_rows(rows)
+            else:
+                num_old_nodes = graph.num_nodes if graph is not None else 0
+                self._graph = CompiledGraph.from_rows(self._node_ids, (
+                    rows[i] if i in rows else graph.get_row(i) if i < num_old_nodes else ()
+                    for i in range(len(self._node_ids))))
+            self.epoch += 1
+            return self._graph
+
+
+@attr.s
+class RouteCacheEntry:
+    """Paths to a destination, in the order found by Yen's k-shortest-paths algorithm."""
+    paths = attr.ib(type=List[LNPaymentPath])  # Yen's A
+    candidates = attr.ib(type=list, factory=list)  # Yen's B, heap of (cost, counter, path)
+    invalid = attr.ib(type=Set[int], factory=set)  # indices of paths through failed channels
+    timestamp = attr.ib(type=int, factory=lambda: int(time.time()))
+
+
+class RouteCache:
+    """LRU cache of the paths found by LNPathFinder.find_route.
+
+    Keys contain the epochs of the public graph and of the liquidity hints,
+    so entries are not used after the graph changed or the hints were reset.
+    Channels that fail or get blacklisted only invalidate the paths that
+    go through them, see invalidate_channel.
+    """
+
+    def __init__(self, max_entries: int = ROUTE_CACHE_MAX_ENTRIES):
+        self.lock = RLock()
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # type: OrderedDict[tuple, RouteCacheEntry]
+        self._keys_for_channel = defaultdict(set)  # type: Dict[ShortChannelID, Set[tuple]]
+        self._hits = 0
+        self._misses = 0
+        self._hit_time = 0.
+        self._miss_time = 0.
+
+    @with_lock
+    def get(self, key: tuple, *, now: int) -> Optional[RouteCacheEntry]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.timestamp + ROUTE_CACHE_TTL < now:
+            self._drop(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    @with_lock
+    def add(self, key: tuple, entry: RouteCacheEntry) -> None:
+        self._drop(key)
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        for path in entry.paths:
+            self._index_path(key, path)
+        while len(self._entries) > self.max_entries:
+            self._drop(next(iter(self._entries)))
+
+    @with_lock
+    def add_path(self, key: tuple, entry: RouteCacheEntry, path: LNPaymentPath) -> None:
+        entry.paths.append(path)
+        if self._entries.get(key) is entry:
+            self._index_path(key, path)
+
+    def _index_path(self, key: tuple, path: LNPaymentPath) -> None:
+        for edge in path:
+            self._keys_for_channel[edge.short_channel_id].add(key)
+
+    def _drop(self, key: tuple) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for path in entry.paths:
+            for edge in path:
+                keys = self._keys_for_channel.get(edge.short_channel_id)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self._keys_for_channel[edge.short_channel_id]
+
+    @with_lock
+    def remove(self, key: tuple) -> None:
+        self._drop(key)
+
+    @with_lock
+    def invalidate_channel(self, short_channel_id: ShortChannelID) -> None:
+        """Marks the cached paths through short_channel_id as invalid."""
+        for key in self._keys_for_channel.pop(short_channel_id, ()):
+            entry = self._entries.get(key)
+            if entry is None:
+                continue
+            for i, path in enumerate(entry.paths):
+                if any(edge.short_channel_id == short_channel_id for edge in path):
+                    entry.invalid.add(i)
+
+    @with_lock
+    def clear(self) -> None:
+        self._entries.clear()
+        self._keys_for_channel.clear()
+
+    @with_lock
+    def record_lookup(self, *, hit: bool, duration: float) -> None:
+        if hit:
+            self._hits += 1
+            self._hit_time += duration
+        else:
+            self._misses += 1
+            self._miss_time += duration
+
+    @with_lock
+    def get_stats(self) -> dict:
+        lookups = self._hits + self._misses
+        return {
+            'entries': len(self._entries),
+            'hits': self._hits,
+            'misses': self._misses,
+            'hit_rate': self._hits / lookups if lookups else None,
+            'avg_hit_ms': 1000 * self._hit_time / self._hits if self._hits else None,
+            'avg_miss_ms': 1000 * self._miss_time / self._misses if self._misses else None,
+        }
+
+
 class LNPathFinder(Logger):
 
     def __init__(self, channel_db: ChannelDB):
@@ -388,6 +667,8 @@ class LNPathFinder(Logger):
         self.liquidity_hints = LiquidityHintMgr()
         self._edge_blacklist = dict()  # type: Dict[ShortChannelID, int]  # scid -> expiration
         self._blacklist_lock = threading.Lock()
+        self._graph_compiler = GraphCompiler(channel_db)
+        self._route_cache = RouteCache()
 
     def _is_edge_blacklisted(self, short_channel_id: ShortChannelID, *, now: int) -> bool:
         blacklist_expiration = self._edge_blacklist.get(short_channel_id)
@@ -410,10 +691,15 @@ class LNPathFinder(Logger):
         with self._blacklist_lock:
             blacklist_expiration = self._edge_blacklist.get(short_channel_id, 0)
             self._edge_blacklist[short_channel_id] = max(blacklist_expiration, now + duration)
+        self._route_cache.invalidate_channel(short_channel_id)
 
     def clear_blacklist(self):
         with self._blacklist_lock:
             self._edge_blacklist = dict()
+        self._route_cache.clear()
+
+    def get_route_cache_stats(self) -> dict:
+        return self._route_cache.get_stats()
 
     def update_liquidity_hints(
             self,
@@ -432,6 +718,7 @@ class LNPathFinder(Logger):
             else:
                 self.logger.info(f"report {r.short_channel_id} to be unable to forward {amount_msat} msat")
                 self.liquidity_hints.update_cannot_send(r.start_node, r.end_node, r.short_channel_id, amount_msat)
+                self._route_cache.invalidate_channel(r.short_channel_id)
                 break
         else:
             assert failing_channel is None
@@ -505,7 +792,7 @@ class LNPathFinder(Logger):
                 end_node=end_node,
                 node_info=node_info)
         # Cap cltv of any given edge at 2 weeks (the cost function would not work well for extreme cases)
-        if route_edge.cltv_delta > 14 * 144:
+        if route_edge.cltv_delta > MAX_EDGE_CLTV_DELTA:
             return float('inf'), 0
         # Distance metric notes:  # TODO constants are ad-hoc
         # ( somewhat based on https://github.com/lightningnetwork/lnd/pull/1358 )
@@ -533,50 +820,181 @@ class LNPathFinder(Logger):
             private_route_edges: Dict[ShortChannelID, RouteEdge] = None,
             node_filter: Optional[Callable[[bytes, NodeInfo], bool]] = None
     ) -> Dict[bytes, PathEdge]:
+        previous_hops, node_ids, _ = self._search_shortest_path(
+            nodeA=nodeA,
+            nodeB=nodeB,
+            invoice_amount_msat=invoice_amount_msat,
+            my_sending_channels=my_sending_channels,
+            private_route_edges=private_route_edges,
+            node_filter=node_filter)
+        return {
+            node_ids[start]: PathEdge(
+                start_node=node_ids[start],
+                end_node=node_ids[end],
+                short_channel_id=ShortChannelID(short_channel_id))
+            for start, (end, short_channel_id) in previous_hops.items()
+        }
+
+    def _search_shortest_path(
+            self,
+            *,
+            nodeA: bytes,
+            nodeB: bytes,
+            invoice_amount_msat: int,
+            my_sending_channels: Dict[ShortChannelID, 'Channel'] = None,
+            private_route_edges: Dict[ShortChannelID, RouteEdge] = None,
+            node_filter: Optional[Callable[[bytes, NodeInfo], bool]] = None,
+            excluded_channel_ids: Set[ShortChannelID] = frozenset(),
+            ignore_first_hop_costs: bool = True,
+    ) -> Tuple[Dict[int, Tuple[int, ShortChannelID]], List[bytes], Optional[int]]:
+        """Runs Dijkstra on the compiled public graph, overlaid with our channels and
+        private route edges. Nodes are numbered.
+        Returns (previous_hops, node_ids, index of nodeA), where previous_hops maps a node
+        to the (end_node, short_channel_id) of the next edge towards nodeB.
+        The fees of the edges leaving nodeA are ignored, unless ignore_first_hop_costs
+        is False (nodeA is not us).
+        """
         # note: we don't lock self.channel_db, so while the path finding runs,
         #       the underlying graph could potentially change... (not good but maybe ~OK?)
-
+        # the public graph is a snapshot, but the overlay edges are read from channel_db.
         # if destination is filtered, there is no route
         if node_filter:
             node_info = self.channel_db.get_node_info_for_node_id(nodeB)
             if not node_filter(nodeB, node_info):
-                return {}
+                return {}, [], None
+        if my_sending_channels is None:
+            my_sending_channels = {}
+        if private_route_edges is None:
+            private_route_edges = {}
+        if not self.channel_db.data_loaded.is_set():
+            raise ChannelDBNotLoaded("channelDB data not loaded yet!")
+        graph = self._graph_compiler.get_graph()
+        node_ids = list(graph.node_ids)
+        extra_node_index = {}  # type: Dict[bytes, int]  # for nodes not in the public graph
+
+        def get_node_index(node_id: bytes) -> int:
+            i = graph.node_index.get(node_id)
+            if i is None:
+                i = extra_node_index.get(node_id)
+                if i is None:
+                    i = extra_node_index[node_id] = len(node_ids)
+                    node_ids.append(node_id)
+            return i
+
+        # Our channels and private route edges are evaluated with _edge_cost, as are
+        # public channels with the same short_channel_id: their policy might come from them.
+        overlay_channel_ids = set(my_sending_channels) | set(private_route_edges)
+        public_overlay_channels_for_node = defaultdict(set)  # type: Dict[int, Set[ShortChannelID]]
+        for short_channel_id in overlay_channel_ids:
+            channel_info = self.channel_db.get_channel_info(short_channel_id)
+            if channel_info is not None:
+                public_overlay_channels_for_node[get_node_index(channel_info.node1_id)].add(short_channel_id)
+                public_overlay_channels_for_node[get_node_index(channel_info.node2_id)].add(short_channel_id)
+        my_channels_for_node = defaultdict(set)  # type: Dict[int, Set[ShortChannelID]]
+        for chan in my_sending_channels.values():
+            for node_id in (chan.node_id, chan.get_local_pubkey()):
+                my_channels_for_node[get_node_index(node_id)].add(chan.short_channel_id)
+        private_channels_for_node = defaultdict(set)  # type: Dict[int, Set[ShortChannelID]]
+        for route_edge in private_route_edges.values():
+            for node_id in (route_edge.start_node, route_edge.end_node):
+                private_channels_for_node[get_node_index(node_id)].add(route_edge.short_channel_id)
+
+        skipped_channel_ids = overlay_channel_ids | excluded_channel_ids
 
         # run Dijkstra
         # The search is run in the REVERSE direction, from nodeB to nodeA,
         # to properly calculate compound routing fees.
-        distance_from_start = defaultdict(lambda: float('inf'))
-        distance_from_start[nodeB] = 0
-        previous_hops = {}  # type: Dict[bytes, PathEdge]
-        nodes_to_explore = queue.PriorityQueue()
-        nodes_to_explore.put((0, invoice_amount_msat, nodeB))  # order of fields (in tuple) matters!
+        a = get_node_index(nodeA)
+        b = get_node_index(nodeB)
+        distance_from_start = {b: 0}  # type: Dict[int, float]
+        previous_hops = {}  # type: Dict[int, Tuple[int, ShortChannelID]]
+        # order of fields (in tuple) matters! node_id breaks ties, as it used to
+        nodes_to_explore = [(0, invoice_amount_msat, nodeB, b)]
         now = int(time.time())
+        edge_blacklist = self._edge_blacklist
+        liquidity_hints = self.liquidity_hints._liquidity_hints
+        penalty = self.liquidity_hints.penalty
+        get_node_info = self.channel_db.get_node_info_for_node_id
+        num_public_nodes = graph.num_nodes
+        offsets = graph.offsets
+        start_nodes = graph.start_nodes
+        short_channel_ids = graph.short_channel_ids
+        fee_base_msat = graph.fee_base_msat
+        fee_proportional_millionths = graph.fee_proportional_millionths
+        cltv_delta = graph.cltv_delta
+        htlc_minimum_msat = graph.htlc_minimum_msat
+        htlc_maximum_msat = graph.htlc_maximum_msat
+        capacity_sat = graph.capacity_sat
 
         # main loop of search
-        while nodes_to_explore.qsize() > 0:
-            dist_to_edge_endnode, amount_msat, edge_endnode = nodes_to_explore.get()
-            if edge_endnode == nodeA and previous_hops:  # previous_hops check for circular paths
+        while nodes_to_explore:
+            dist_to_edge_endnode, amount_msat, edge_endnode, end = heapq.heappop(nodes_to_explore)
+            if end == a and previous_hops:  # previous_hops check for circular paths
                 self.logger.info("found a path")
                 break
-            if dist_to_edge_endnode != distance_from_start[edge_endnode]:
-                # queue.PriorityQueue does not implement decrease_priority,
+            if dist_to_edge_endnode != distance_from_start.get(end, inf):
+                # heapq does not implement decrease_priority,
                 # so instead of decreasing priorities, we add items again into the queue.
                 # so there are duplicates in the queue, that we discard now:
                 continue
 
+            # public channels
+            # penalty of the channels without liquidity hint, see LiquidityHintMgr.penalty
+            default_penalty = DEFAULT_PENALTY_BASE_MSAT + amount_msat * DEFAULT_PENALTY_PROPORTIONAL_MILLIONTH // 1_000_000
+            for j in range(offsets[end], offsets[end + 1]) if end < num_public_nodes else ():
+                start = start_nodes[j]
+                dist_to_edge_startnode = distance_from_start.get(start, inf)
+                if dist_to_edge_startnode <= dist_to_edge_endnode:
+                    continue  # costs are not negative, so this edge cannot improve the distance
+                edge_channel_id = short_channel_ids[j]
+                if skipped_channel_ids and edge_channel_id in skipped_channel_ids:
+                    continue
+                if edge_blacklist:
+                    blacklist_expiration = edge_blacklist.get(edge_channel_id)
+                    if blacklist_expiration is not None and blacklist_expiration >= now:
+                        continue
+                edge_startnode = node_ids[start]
+                if node_filter and not node_filter(edge_startnode, get_node_info(edge_startnode)):
+                    continue
+                if amount_msat < htlc_minimum_msat[j]:
+                    continue  # payment amount too little
+                if 0 <= capacity_sat[j] < amount_msat // 1000:
+                    continue  # payment amount too large
+                if 0 <= htlc_maximum_msat[j] < amount_msat:
+                    continue  # payment amount too large
+                if start == a and ignore_first_hop_costs:
+                    edge_cost, fee_for_edge_msat = DEFAULT_PENALTY_BASE_MSAT, 0
+                else:
+                    # see _edge_cost
+                    fee_for_edge_msat = fee_base_msat[j] + amount_msat * fee_proportional_millionths[j] // 1_000_000
+                    cltv_cost = cltv_delta[j] * amount_msat * 15 / 1_000_000_000
+                    if edge_channel_id in liquidity_hints:
+                        liquidity_penalty = penalty(edge_startnode, edge_endnode, edge_channel_id, amount_msat)
+                    else:
+                        liquidity_penalty = default_penalty
+                    edge_cost = fee_for_edge_msat + cltv_cost + liquidity_penalty
+                alt_dist_to_neighbour = dist_to_edge_endnode + edge_cost
+                if alt_dist_to_neighbour < dist_to_edge_startnode:
+                    distance_from_start[start] = alt_dist_to_neighbour
+                    previous_hops[start] = end, edge_channel_id
+                    amount_to_forward_msat = amount_msat + fee_for_edge_msat
+                    heapq.heappush(nodes_to_explore, (alt_dist_to_neighbour, amount_to_forward_msat, edge_startnode, start))
+
+            # our channels and private route edges
+            channels_for_endnode = set(public_overlay_channels_for_node.get(end, ()))
             if nodeA == nodeB:  # we want circular paths
                 if not previous_hops:  # in the first node exploration step, we only take receiving channels
-                    channels_for_endnode = self.channel_db.get_channels_for_node(
-                        edge_endnode, my_channels={}, private_route_edges=private_route_edges)
+                    channels_for_endnode |= private_channels_for_node.get(end, set())
                 else:  # in the next steps, we only take sending channels
-                    channels_for_endnode = self.channel_db.get_channels_for_node(
-                        edge_endnode, my_channels=my_sending_channels, private_route_edges={})
+                    channels_for_endnode |= my_channels_for_node.get(end, set())
             else:
-                channels_for_endnode = self.channel_db.get_channels_for_node(
-                    edge_endnode, my_channels=my_sending_channels, private_route_edges=private_route_edges)
+                channels_for_endnode |= private_channels_for_node.get(end, set())
+                channels_for_endnode |= my_channels_for_node.get(end, set())
 
             for edge_channel_id in channels_for_endnode:
                 assert isinstance(edge_channel_id, bytes)
+                if edge_channel_id in excluded_channel_ids:
+                    continue
                 if self._is_edge_blacklisted(edge_channel_id, now=now):
                     continue
                 channel_info = self.channel_db.get_channel_info(
@@ -598,26 +1016,24 @@ class LNPathFinder(Logger):
                     start_node=edge_startnode,
                     end_node=edge_endnode,
                     payment_amt_msat=amount_msat,
-                    ignore_costs=(edge_startnode == nodeA),
+                    ignore_costs=(ignore_first_hop_costs and edge_startnode == nodeA),
                     is_mine=is_mine,
                     my_channels=my_sending_channels,
                     private_route_edges=private_route_edges,
                     now=now,
                 )
-                alt_dist_to_neighbour = distance_from_start[edge_endnode] + edge_cost
-                if alt_dist_to_neighbour < distance_from_start[edge_startnode]:
-                    distance_from_start[edge_startnode] = alt_dist_to_neighbour
-                    previous_hops[edge_startnode] = PathEdge(
-                        start_node=edge_startnode,
-                        end_node=edge_endnode,
-                        short_channel_id=ShortChannelID(edge_channel_id))
+                start = get_node_index(edge_startnode)
+                alt_dist_to_neighbour = dist_to_edge_endnode + edge_cost
+                if alt_dist_to_neighbour < distance_from_start.get(start, inf):
+                    distance_from_start[start] = alt_dist_to_neighbour
+                    previous_hops[start] = end, ShortChannelID(edge_channel_id)
                     amount_to_forward_msat = amount_msat + fee_for_edge_msat
-                    nodes_to_explore.put((alt_dist_to_neighbour, amount_to_forward_msat, edge_startnode))
+                    heapq.heappush(nodes_to_explore, (alt_dist_to_neighbour, amount_to_forward_msat, edge_startnode, start))
             # for circular paths, we already explored the end node, but this
             # is also our start node, so set it to unexplored
-            if edge_endnode == nodeB and nodeA == nodeB:
-                distance_from_start[edge_endnode] = float('inf')
-        return previous_hops
+            if end == b and nodeA == nodeB:
+                distance_from_start[end] = inf
+        return previous_hops, node_ids, a
 
     @profiler
     def find_path_for_payment(
@@ -634,10 +1050,7 @@ class LNPathFinder(Logger):
         assert type(nodeA) is bytes
         assert type(nodeB) is bytes
         assert type(invoice_amount_msat) is int
-        if my_sending_channels is None:
-            my_sending_channels = {}
-
-        previous_hops = self.get_shortest_path_hops(
+        return self._search_path(
             nodeA=nodeA,
             nodeB=nodeB,
             invoice_amount_msat=invoice_amount_msat,
@@ -645,17 +1058,42 @@ class LNPathFinder(Logger):
             private_route_edges=private_route_edges,
             node_filter=node_filter)
 
-        if nodeA not in previous_hops:
+    def _search_path(
+            self,
+            *,
+            nodeA: bytes,
+            nodeB: bytes,
+            invoice_amount_msat: int,
+            my_sending_channels: Dict[ShortChannelID, 'Channel'] = None,
+            private_route_edges: Dict[ShortChannelID, RouteEdge] = None,
+            node_filter: Optional[Callable[[bytes, NodeInfo], bool]] = None,
+            excluded_channel_ids: Set[ShortChannelID] = frozenset(),
+            ignore_first_hop_costs: bool = True,
+    ) -> Optional[LNPaymentPath]:
+        previous_hops, node_ids, a = self._search_shortest_path(
+            nodeA=nodeA,
+            nodeB=nodeB,
+            invoice_amount_msat=invoice_amount_msat,
+            my_sending_channels=my_sending_channels,
+            private_route_edges=private_route_edges,
+            node_filter=node_filter,
+            excluded_channel_ids=excluded_channel_ids,
+            ignore_first_hop_costs=ignore_first_hop_costs)
+
+        if a not in previous_hops:
             return None  # no path found
 
         # backtrack from search_end (nodeA) to search_start (nodeB)
         # FIXME paths cannot be longer than 20 edges (onion packet)...
-        edge_startnode = nodeA
+        edge_startnode = a
         path = []
-        while edge_startnode != nodeB or not path:  # second condition for circular paths
-            edge = previous_hops[edge_startnode]
-            path += [edge]
-            edge_startnode = edge.node_id
+        while node_ids[edge_startnode] != nodeB or not path:  # second condition for circular paths
+            edge_endnode, short_channel_id = previous_hops[edge_startnode]
+            path += [PathEdge(
+                start_node=node_ids[edge_startnode],
+                end_node=node_ids[edge_endnode],
+                short_channel_id=ShortChannelID(short_channel_id))]
+            edge_startnode = edge_endnode
         return path
 
     def create_route_from_path(
@@ -697,6 +1135,170 @@ class LNPathFinder(Logger):
             prev_end_node = path_edge.end_node
         return route
 
+    def _path_cost(
+            self,
+            path: LNPaymentPath,
+            *,
+            invoice_amount_msat: int,
+            my_sending_channels: Dict[ShortChannelID, 'Channel'],
+            private_route_edges: Dict[ShortChannelID, RouteEdge],
+            now: int,
+    ) -> float:
+        """Returns the distance of path, as measured by _search_shortest_path."""
+        nodeA = path[0].start_node
+        cost = 0
+        amount_msat = invoice_amount_msat
+        for edge in reversed(path):
+            is_mine = edge.short_channel_id in my_sending_channels
+            if is_mine and edge.start_node == nodeA:
+                if not my_sending_channels[edge.short_channel_id].can_pay(amount_msat, check_frozen=True):
+                    return inf
+            edge_cost, fee_msat = self._edge_cost(
+                short_channel_id=edge.short_channel_id,
+                start_node=edge.start_node,
+                end_node=edge.end_node,
+                payment_amt_msat=amount_msat,
+                ignore_costs=(edge.start_node == nodeA),
+                is_mine=is_mine,
+                my_channels=my_sending_channels,
+                private_route_edges=private_route_edges,
+                now=now,
+            )
+            cost += edge_cost
+            amount_msat += fee_msat
+        return cost
+
+    def _next_shortest_path(
+            self,
+            entry: RouteCacheEntry,
+            *,
+            nodeB: bytes,
+            invoice_amount_msat: int,
+            my_sending_channels: Dict[ShortChannelID, 'Channel'],
+            private_route_edges: Dict[ShortChannelID, RouteEdge],
+            now: int,
+    ) -> Optional[LNPaymentPath]:
+        """One iteration of Yen's algorithm: returns the shortest path
+        to nodeB that is not in entry.paths yet.
+        """
+        found = {tuple(edge.short_channel_id for edge in path) for path in entry.paths}
+        found.update(tuple(edge.short_channel_id for edge in path) for _, _, path in entry.candidates)
+        counter = itertools.count(len(found))
+        last_path = entry.paths[-1]
+        for i in range(len(last_path)):
+            root_path = last_path[:i]
+            root_channel_ids = tuple(edge.short_channel_id for edge in root_path)
+            root_nodes = {edge.start_node for edge in root_path}
+            # the edges leaving the spur node on the paths we already have, with the same root
+            excluded_channel_ids = {
+                path[i].short_channel_id for path in entry.paths
+                if len(path) > i and tuple(edge.short_channel_id for edge in path[:i]) == root_channel_ids}
+            spur_path = self._search_path(
+                nodeA=last_path[i].start_node,
+                nodeB=nodeB,
+                invoice_amount_msat=invoice_amount_msat,
+                my_sending_channels=my_sending_channels,
+                private_route_edges=private_route_edges,
+                node_filter=lambda node_id, node_info: node_id not in root_nodes,
+                excluded_channel_ids=excluded_channel_ids,
+                ignore_first_hop_costs=(i == 0))
+            if not spur_path:
+                continue
+            path = list(root_path) + list(spur_path)
+            channel_ids = tuple(edge.short_channel_id for edge in path)
+            if channel_ids in found:
+                continue
+            found.add(channel_ids)
+            cost = self._path_cost(
+                path,
+                invoice_amount_msat=invoice_amount_msat,
+                my_sending_channels=my_sending_channels,
+                private_route_edges=private_route_edges,
+                now=now)
+            if cost < inf:
+                heapq.heappush(entry.candidates, (cost, next(counter), path))
+        if not entry.candidates:
+            return None
+        return heapq.heappop(entry.candidates)[2]
+
+    def _find_path_cached(
+            self,
+            *,
+            nodeA: bytes,
+            nodeB: bytes,
+            invoice_amount_msat: int,
+            my_sending_channels: Dict[ShortChannelID, 'Channel'] = None,
+            private_route_edges: Dict[ShortChannelID, RouteEdge] = None,
+    ) -> Optional[LNPaymentPath]:
+        """Like find_path_for_payment, but uses the paths cached for the destination.
+        The cached paths are ranked again with the current liquidity hints and channel
+        balances. If none of them is usable, the next shortest path is computed.
+        """
+        if nodeA == nodeB:  # circular paths are not cached
+            return self.find_path_for_payment(
+                nodeA=nodeA,
+                nodeB=nodeB,
+                invoice_amount_msat=invoice_amount_msat,
+                my_sending_channels=my_sending_channels,
+                private_route_edges=private_route_edges)
+        if my_sending_channels is None:
+            my_sending_channels = {}
+        if private_route_edges is None:
+            private_route_edges = {}
+        if not self.channel_db.data_loaded.is_set():
+            raise ChannelDBNotLoaded("channelDB data not loaded yet!")
+        t0 = time.monotonic()
+        now = int(time.time())
+        self._graph_compiler.get_graph()
+        key = (
+            nodeA,
+            nodeB,
+            invoice_amount_msat.bit_length(),  # amount bucket
+            self._graph_compiler.epoch,
+            self.liquidity_hints.epoch,
+            frozenset(my_sending_channels),
+            frozenset(
+                (e.short_channel_id, e.start_node, e.end_node, e.fee_base_msat, e.fee_proportional_millionths, e.cltv_delta)
+                for e in private_route_edges.values()),
+        )
+        kwargs = dict(
+            invoice_amount_msat=invoice_amount_msat,
+            my_sending_channels=my_sending_channels,
+            private_route_edges=private_route_edges,
+            now=now)
+        entry = self._route_cache.get(key, now=now)
+        hit = entry is not None
+        path = None
+        while entry is not None:
+            costs = [
+                (self._path_cost(path, **kwargs), i) for i, path in enumerate(entry.paths)
+                if i not in entry.invalid]
+            cost, i = min(costs, default=(inf, None))
+            if cost < inf:
+                path = entry.paths[i]
+                break
+            hit = False
+            if len(entry.paths) >= ROUTE_CACHE_MAX_PATHS:
+                break
+            next_path = self._next_shortest_path(entry, nodeB=nodeB, **kwargs)
+            if next_path is None:
+                break
+            self._route_cache.add_path(key, entry, next_path)
+        if path is None:
+            # not cached, or none of the cached paths can be used: search from scratch
+            path = self._search_path(
+                nodeA=nodeA,
+                nodeB=nodeB,
+                invoice_amount_msat=invoice_amount_msat,
+                my_sending_channels=my_sending_channels,
+                private_route_edges=private_route_edges)
+            if path:
+                self._route_cache.add(key, RouteCacheEntry(paths=[path], timestamp=now))
+            else:
+                self._route_cache.remove(key)
+        self._route_cache.record_lookup(hit=hit, duration=time.monotonic() - t0)
+        return path
+
     def find_route(
             self,
             *,
@@ -709,7 +1311,7 @@ class LNPathFinder(Logger):
     ) -> Optional[LNPaymentRoute]:
         route = None
         if not path:
-            path = self.find_path_for_payment(
+            path = self._find_path_cached(
                 nodeA=nodeA,
                 nodeB=nodeB,
                 invoice_amount_msat=invoice_amount_msat,
@@ -2,10 +2,12 @@
 # Distributed under the MIT software license, see the accompanying
 # file LICENCE or http://www.opensource.org/licenses/mit-license.php
 
-from typing import NamedTuple, Iterable, TYPE_CHECKING
+from typing import NamedTuple, Iterable, TYPE_CHECKING, Optional, Set, Tuple
 import os
 import copy
 import asyncio
+import heapq
+from collections import defaultdict
 from enum import IntEnum, auto
 from typing import NamedTuple, Dict
 
@@ -50,6 +52,16 @@ class LNWatcher(Logger, EventListener):
         self.adb = adb
         self.config = network.config
         self.callbacks = {} # address -> lambda: coroutine
+        # Only the callbacks in _dirty are run by trigger_callbacks.
+        # A callback becomes dirty when a transaction that it depends on is added, removed or
+        # (un)verified, or when the block height it is waiting for is reached.
+        self._dirty = set()  # type: Set[str]
+        self._callbacks_by_txid = defaultdict(set)  # type: Dict[str, Set[str]]  # txid -> addresses
+        self._txids_by_callback = defaultdict(set)  # type: Dict[str, Set[str]]  # address -> txids
+        self._check_every_block = set()  # type: Set[str]
+        self._next_check_height = {}  # type: Dict[str, int]  # address -> height
+        self._check_heights = []  # heap of (height, address). may contain stale items
+        self._trigger_lock = asyncio.Lock()
         self.network = network
         self.register_callbacks()
         # status gets populated when we run
@@ -62,10 +74,19 @@ class LNWatcher(Logger, EventListener):
         return self.channel_status.get(outpoint, 'unknown')
 
     def add_channel(self, outpoint: str, address: str) -> None:
-        assert isinstance(outpoint, str)
-        assert isinstance(address, str)
-        cb = lambda: self.check_onchain_situation(address, outpoint)
-        self.add_callback(address, cb)
+        self.add_channels([(outpoint, address)])
+
+    def add_channels(self, channels: Iterable[Tuple[str, str]]) -> None:
+        """Watches a batch of (outpoint, address) channels."""
+        addresses = []
+        for outpoint, address in channels:
+            assert isinstance(outpoint, str)
+            assert isinstance(address, str)
+            cb = lambda address=address, outpoint=outpoint: self.check_onchain_situation(address, outpoint)
+            self._set_callback(address, cb, check_every_block=False)
+            self._add_tx_dependency(address, outpoint.split(':')[0])
+            addresses.append(address)
+        self.adb.add_addresses(addresses)
 
     async def unwatch_channel(self, address, funding_outpoint):
         self.logger.info(f'unwatching {funding_outpoint}')
@@ -73,19 +94,117 @@ class LNWatcher(Logger, EventListener):
 
     def remove_callback(self, address):
         self.callbacks.pop(address, None)
-
-    def add_callback(self, address, callback):
+        self._dirty.discard(address)
+        self._check_every_block.discard(address)
+        self._next_check_height.pop(address, None)
+        for txid in self._txids_by_callback.pop(address, ()):
+            addresses = self._callbacks_by_txid[txid]
+            addresses.discard(address)
+            if not addresses:
+                del self._callbacks_by_txid[txid]
+
+    def add_callback(self, address, callback, *, check_every_block: bool = True):
+        """The callback is run when a transaction paying to address, or spending
+        from one of the transactions it depends on, changes.
+        If check_every_block is set, it is also run on every new block.
+        """
+        self._set_callback(address, callback, check_every_block=check_every_block)
         self.adb.add_address(address)
+
+    def _set_callback(self, address, callback, *, check_every_block: bool) -> None:
         self.callbacks[address] = callback
+        if check_every_block:
+            self._check_every_block.add(address)
+        self._dirty.add(address)
+
+    def _add_tx_dependency(self, address: str, txid: str) -> None:
+        self._callbacks_by_txid[txid].add(address)
+        self._txids_by_callback[address].add(txid)
+
+    def _add_spender_dependency(self, prev_txid: str, spender_txid: str) -> None:
+        """The callbacks that depend on prev_txid also depend on its spender."""
+        for address in list(self._callbacks_by_txid.get(prev_txid, ())):
+            self._add_tx_dependency(address, spender_txid)
+
+    def _get_callbacks_for_tx(self, tx_hash: str, tx: Optional[Transaction]) -> Set[str]:
+        addresses = set(self._callbacks_by_txid.get(tx_hash, ()))
+        if tx is not None:
+            for txin in tx.inputs():
+                addresses |= self._callbacks_by_txid.get(txin.prevout.txid.hex(), set())
+            for txout in tx.outputs():
+                if txout.address in self.callbacks:
+                    addresses.add(txout.address)
+            for address in addresses:
+                self._add_tx_dependency(address, tx_hash)
+        return addresses
+
+    def _mark_dirty_for_tx(self, tx_hash: str, tx: Optional[Transaction] = None) -> None:
+        self._dirty |= self._get_callbacks_for_tx(tx_hash, tx)
+
+    def schedule_check(self, address: str, height: Optional[int]) -> None:
+        """Runs the callback of address again once the chain reaches height."""
+        if height is None:
+            self._next_check_height.pop(address, None)
+            return
+        self._next_check_height[address] = height
+        heapq.heappush(self._check_heights, (height, address))
+
+    def _pop_due_checks(self) -> Set[str]:
+        local_height = self.adb.get_local_height()
+        due = set()
+        while self._check_heights and self._check_heights[0][0] <= local_height:
+            height, address = heapq.heappop(self._check_heights)
+            if self._next_check_height.get(address) == height:
+                del self._next_check_height[address]
+                due.add(address)
+        return due
 
     @event_listener
     async def on_event_blockchain_updated(self, *args):
+        self._dirty |= self._pop_due_checks()
+        await self.trigger_callbacks()
+
+    @event_listener
+    async def on_event_adb_added_tx(self, adb, tx_hash, tx):
+        if adb != self.adb:
+            return
+        self._mark_dirty_for_tx(tx_hash, tx)
+        await self.trigger_callbacks()
+
+    @event_listener
+    async def on_event_adb_added_txs(self, adb, txs):
+        if adb != self.adb:
+            return
+        for tx_hash, tx in txs:
+            self._mark_dirty_for_tx(tx_hash, tx)
+        await self.trigger_callbacks()
+
+    @event_listener
+    async def on_event_adb_removed_tx(self, adb, tx_hash, tx):
+        if adb != self.adb:
+            return
+        self._mark_dirty_for_tx(tx_hash, tx)
         await self.trigger_callbacks()
 
     @event_listener
     async def on_event_adb_added_verified_tx(self, adb, tx_hash):
         if adb != self.adb:
             return
+        self._mark_dirty_for_tx(tx_hash)
+        await self.trigger_callbacks()
+
+    @event_listener
+    async def on_event_adb_removed_verified_tx(self, adb, tx_hash):
+        if adb != self.adb:
+            return
+        self._mark_dirty_for_tx(tx_hash)
+        await self.trigger_callbacks()
+
+    @event_listener
+    async def on_event_adb_tx_height_changed(self, adb, tx_hash, old_height, tx_height):
+        if adb != self.adb:
+            return
+        self._mark_dirty_for_tx(tx_hash)
         await self.trigger_callbacks()
 
     @event_listener
@@ -96,11 +215,30 @@ class LNWatcher(Logger, EventListener):
 
     @log_exceptions
     async def trigger_callbacks(self):
+        """Runs the dirty callbacks."""
         if not self.adb.synchronizer:
             self.logger.info("synchronizer not set yet")
             return
-        for address, callback in list(self.callbacks.items()):
-            await callback()
+        async with self._trigger_lock:
+            # callbacks return early if the adb is not up to date. they stay dirty
+            # until the next adb_set_up_to_date event
+            while self._dirty and self.adb.is_up_to_date():
+                address = self._dirty.pop()
+                callback = self.callbacks.get(address)
+                if callback is None:
+                    continue
+                try:
+                    await callback()
+                except Exception:
+                    # it might not have scheduled its next check: run it again on the next block
+                    if address in self.callbacks:
+                        self.schedule_check(address, self.adb.get_local_height() + 1)
+                    raise
+                if not self.adb.is_up_to_date():
+                    # the callback added addresses, run it again once they are synchronized
+                    self._dirty.add(address)
+                elif address in self._check_every_block and address in self.callbacks:
+                    self.schedule_check(address, self.adb.get_local_height() + 1)
 
     async def check_onchain_situation(self, address, funding_outpoint):
         # early return if address has not been added yet
@@ -131,6 +269,18 @@ class LNWatcher(Logger, EventListener):
             keep_watching=keep_watching)
         if not keep_watching:
             await self.unwatch_channel(address, funding_outpoint)
+        else:
+            self.schedule_check(address, self.get_next_check_height(
+                funding_outpoint=funding_outpoint, closing_txid=closing_txid))
+
+    def get_next_check_height(self, *, funding_outpoint: str, closing_txid: Optional[str]) -> Optional[int]:
+        """Returns the height at which the channel must be checked again, even if
+        none of its transactions changed, or None.
+        """
+        if closing_txid:
+            # sweep txs may be waiting for timelocks, or for the closing tx to be deeply mined
+            return self.adb.get_local_height() + 1
+        return None
 
     async def sweep_commitment_transaction(self, funding_outpoint: str, closing_tx: Transaction) -> bool:
         raise NotImplementedError()  # implemented by subclasses
@@ -150,6 +300,7 @@ class LNWatcher(Logger, EventListener):
         spender_txid = self.adb.db.get_spent_outpoint(prev_txid, int(index))
         if not spender_txid:
             return
+        self._add_spender_dependency(prev_txid, spender_txid)
         spender_tx = self.adb.get_transaction(spender_txid)
         for i, o in enumerate(spender_tx.outputs()):
             if o.address is None:
@@ -193,13 +344,22 @@ class LNWalletWatcher(LNWatcher):
     @event_listener
     async def on_event_blockchain_updated(self, *args):
         # overload parent method with cache invalidation
-        # we invalidate the cache on each new block because
+        # we invalidate the cache of the channels we check on a new block because
         # some processes affect the list of sweep transactions
         # (hold invoice preimage revealed, MPP completed, etc)
-        for chan in self.lnworker.channels.values():
-            chan._sweep_info.clear()
+        due = self._pop_due_checks()
+        if due:
+            for chan in self.lnworker.channels.values():
+                if chan.get_funding_address() in due:
+                    chan._sweep_info.clear()
+        self._dirty |= due
         await self.trigger_callbacks()
 
+    def get_next_check_height(self, *, funding_outpoint: str, closing_txid: Optional[str]) -> Optional[int]:
+        # lnworker.handle_onchain_state has things to do on every block for
+        # channels that are not closed (fee updates, expiring htlcs, rebroadcasts)
+        return self.adb.get_local_height() + 1
+
     def diagnostic_name(self):
         return f"{self.lnworker.wallet.diagnostic_name()}-LNW"
 
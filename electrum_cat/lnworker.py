@@ -33,7 +33,7 @@ from .channel_db import UpdateStatus, ChannelDBNotLoaded, get_mychannel_info, ge
 
 from . import constants, util
 from .util import (
-    profiler, OldTaskGroup, ESocksProxy, NetworkRetryManager, JsonRPCClient, NotEnoughFunds, EventListener,
+    profiler, OldTaskGroup, ESocksProxy, NetworkRetryManager, JsonRPCClient, JsonRPCError, NotEnoughFunds, EventListener,
     event_listener, bfh, InvoiceError, resolve_dns_srv, is_ip_address, log_exceptions, ignore_exceptions,
     make_aiohttp_session, timestamp_to_datetime, random_shuffled_copy, is_private_netaddress,
     UnrelatedTransactionException, LightningHistoryItem
@@ -533,10 +533,14 @@ class LNGossip(LNWorker):
 
     async def maintain_db(self):
         await self.channel_db.data_loaded.wait()
+        last_snapshot = time.monotonic()
         while True:
             if len(self.unknown_ids) == 0:
                 self.channel_db.prune_old_policies(self.max_age)
                 self.channel_db.prune_orphaned_channels()
+            if time.monotonic() - last_snapshot > self.channel_db.SNAPSHOT_INTERVAL:
+                await self.channel_db.save_snapshot()
+                last_snapshot = time.monotonic()
             await asyncio.sleep(120)
 
     async def add_new_ids(self, ids: Iterable[bytes]):
@@ -879,6 +883,7 @@ class LNWallet(LNWorker):
                     watchtower = JsonRPCClient(session, watchtower_url)
                     watchtower.add_method('get_ctn')
                     watchtower.add_method('add_sweep_tx')
+                    watchtower.add_method('add_sweep_txs')
                     for chan in self.channels.values():
                         await self.sync_channel_with_watchtower(chan, watchtower)
             except aiohttp.client_exceptions.ClientConnectorError:
@@ -894,8 +899,13 @@ class LNWallet(LNWorker):
         watchtower_ctn = await watchtower.get_ctn(outpoint, addr)
         for ctn in range(watchtower_ctn + 1, current_ctn):
             sweeptxs = chan.create_sweeptxs_for_watchtower(ctn)
-            for tx in sweeptxs:
-                await watchtower.add_sweep_tx(outpoint, ctn, tx.inputs()[0].prevout.to_str(), tx.serialize())
+            sweep_txs = [(tx.inputs()[0].prevout.to_str(), tx.serialize()) for tx in sweeptxs]
+            try:
+                await watchtower.add_sweep_txs(outpoint, ctn, sweep_txs)
+            except JsonRPCError:
+                # older towers do not have add_sweep_txs
+                for prevout, raw_tx in sweep_txs:
+                    await watchtower.add_sweep_tx(outpoint, ctn, prevout, raw_tx)
             self.watchtower_ctns[outpoint] = ctn
 
     def start_network(self, network: 'Network'):
@@ -55,6 +55,7 @@ from . import blockchain
 from . import bitcoin
 from . import dns_hacks
 from .transaction import Transaction
+from .tx_cache import RawTxCache
 from .blockchain import Blockchain, HEADER_SIZE
 from .interface import (Interface, PREFERRED_NETWORK_PROTOCOL,
                         RequestTimedOut, NetworkTimeout, BUCKET_NAME_OF_ONION_SERVERS,
@@ -72,6 +73,7 @@ if TYPE_CHECKING:
     #from .lnwatcher import WatchTower
     from .daemon import Daemon
     from .simple_config import SimpleConfig
+    from .wallet import Abstract_Wallet
 
 
 _logger = get_logger(__name__)
@@ -271,6 +273,136 @@ class UntrustedServerReturnedError(NetworkException):
         return f"<UntrustedServerReturnedError {str(self)!r}>"
 
 
+class HeaderSyncScheduler(Logger):
+    """Downloads chunks of headers ahead of an interface that is catching up
+    (see Interface.sync_until), spreading the requests over all connected
+    interfaces whose tip is high enough, one chunk at a time per interface.
+
+    Chunks can arrive in any order. At most max_chunks are buffered, and
+    they are handed out by height. A chunk from another server that does not
+    connect is downloaded again from the interface we sync with. The other
+    server is disconnected if its chunk is invalid; if the chunk is valid on
+    its own, that server is probably on another branch, and is no longer used.
+    """
+
+    def __init__(self, network: 'Network', iface: Interface, next_height: int,
+                 *, max_chunks: int = NUM_TARGET_CONNECTED_SERVERS):
+        self.network = network
+        self.iface = iface
+        self.next_height = next_height
+        self.max_chunks = max_chunks
+        Logger.__init__(self)
+        self._downloads = {}  # type: Dict[int, Tuple[asyncio.Task, Interface]]  # chunk index -> (download, source)
+        self._bad_ifaces = set()  # type: Set[Interface]
+
+    def diagnostic_name(self):
+        return self.iface.diagnostic_name()
+
+    def _wants_chunk(self, index: int) -> bool:
+        # same criterion as sync_until uses to request a chunk instead of single headers
+        return self.next_height > index * 2016 + 10
+
+    def _get_idle_interfaces(self, index: int) -> List[Interface]:
+        last_height = min(index * 2016 + 2015, self.next_height)
+        busy = {source for _, source in self._downloads.values()}
+        with self.network.interfaces_lock:
+            ifaces = list(self.network.interfaces.values())
+        if self.iface not in ifaces:
+            ifaces.append(self.iface)
+        return [iface for iface in ifaces
+                if iface not in busy
+                and iface not in self._bad_ifaces
+                and iface.is_connected_and_ready()
+                and iface.tip >= last_height]
+
+    def _start_download(self, index: int, source: Interface) -> None:
+        self._cancel_download(index)
+        task = asyncio.create_task(source._fetch_chunk(index * 2016, self.next_height))
+        self._downloads[index] = task, source
+
+    def _cancel_download(self, index: int) -> None:
+        task, _ = self._downloads.pop(index, (None, None))
+        if task is not None:
+            task.cancel()
+
+    def _schedule(self, first_index: int) -> None:
+        """Starts downloads for the chunks from first_index on, while there are idle interfaces."""
+        index = first_index
+        while len(self._downloads) < self.max_chunks and self._wants_chunk(index):
+            if index not in self._downloads:
+                ifaces = self._get_idle_interfaces(index)
+                if not ifaces:
+                    break
+                # prefer the interface we sync with, as it will have to serve the failed chunks anyway
+                source = self.iface if self.iface in ifaces else random.choice(ifaces)
+                self._start_download(index, source)
+            index += 1
+
+    async def get_chunk(self, height: int) -> Tuple[Tuple[int, str, Optional[Sequence[bytes]]], Interface]:
+        """Returns the chunk that contains height, as returned by Interface._fetch_chunk,
+        and the interface that served it.
+        """
+        index = height // 2016
+        for i in [i for i in self._downloads if i < index]:  # we went past these
+            self._cancel_download(i)
+        if index not in self._downloads:
+            self._start_download(index, self.iface)
+        task, source = self._downloads.pop(index)
+        # keep downloading the following chunks while this one gets verified
+        self._schedule(index + 1)
+        try:
+            return await task, source
+        except Exception as e:
+            if source == self.iface:
+                raise
+            if isinstance(e, RequestCorrupted):
+                await self._penalize(source, f"served a corrupted chunk {index}: {e!r}")
+            else:
+                self.logger.info(f"could not get chunk {index} from {source.server}: {e!r}")
+                self._stop_using(source)
+            self._start_download(index, self.iface)
+            return await self.get_chunk(height)
+
+    async def on_chunk_rejected(self, height: int, source: Interface,
+                                chunk: Tuple[int, str, Optional[Sequence[bytes]]]) -> None:
+        """The chunk that contains height, from source, does not connect to our chain.
+        This is expected if source is on another branch: unless the chunk is invalid
+        on its own, we just stop asking source for chunks. Either way, the chunk is
+        downloaded again from the interface we sync with.
+        """
+        assert source != self.iface
+        index = height // 2016
+        _, hexdata, pow_hashes = chunk
+        try:
+            Blockchain.verify_chunk_headers(index, bfh(hexdata), pow_hashes=pow_hashes)
+        except Exception as e:
+            await self._penalize(source, f"served an invalid chunk {index}: {e!r}")
+        else:
+            self.logger.info(f"chunk {index} from {source.server} does not connect to our chain. "
+                             f"it might be on another branch")
+            self._stop_using(source)
+        self._start_download(index, self.iface)
+
+    def _stop_using(self, source: Interface) -> None:
+        """No more chunks from source. The ones it is downloading will be requested again."""
+        self._bad_ifaces.add(source)
+        for index in [i for i, (_, s) in self._downloads.items() if s == source]:
+            self._cancel_download(index)
+
+    async def _penalize(self, source: Interface, reason: str) -> None:
+        self.logger.warning(f"{source.server} {reason}. disconnecting")
+        self._stop_using(source)
+        if self.network.taskgroup:
+            await self.network.taskgroup.spawn(self.network.connection_down(source))
+
+    async def close(self) -> None:
+        tasks = [task for task, _ in self._downloads.values()]
+        self._downloads.clear()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
 _INSTANCE = None
 
 
@@ -345,6 +477,12 @@ class Network(Logger, NetworkRetryManager[ServerAddr]):
         dir_path = os.path.join(self.config.path, 'certs')
         util.make_dir(dir_path)
 
+        # shared by all wallets, so that the same tx is only downloaded once
+        tx_cache_size = self.config.NETWORK_TX_CACHE_SIZE_MB * 1_000_000
+        self.tx_cache = RawTxCache(
+            os.path.join(self.config.path, 'tx_cache') if tx_cache_size > 0 else None,
+            max_disk_size=tx_cache_size)
+
         # the main server we are currently communicating with
         self.interface = None
         self.default_server_changed_event = asyncio.Event()
@@ -1209,9 +1347,14 @@ class Network(Logger, NetworkRetryManager[ServerAddr]):
     @best_effort_reliable
     @catch_server_exceptions
     async def get_transaction(self, tx_hash: str, *, timeout=None) -> str:
+        if (raw_tx := self.tx_cache.get(tx_hash)) is not None:
+            return raw_tx
         if self.interface is None:  # handled by best_effort_reliable
             raise RequestTimedOut()
-        return await self.interface.get_transaction(tx_hash=tx_hash, timeout=timeout)
+        raw_tx = await self.interface.get_transaction(tx_hash=tx_hash, timeout=timeout)
+        # we don't know which wallet this is for, it might be encrypted: only keep it in memory
+        self.tx_cache.put(tx_hash, raw_tx, persist=False, check_txid=False)
+        return raw_tx
 
     @best_effort_reliable
     @catch_server_exceptions
@@ -1316,6 +1459,18 @@ class Network(Logger, NetworkRetryManager[ServerAddr]):
         with open(path, 'w', encoding='utf-8') as f:
             f.write(json.dumps(cp, indent=4))
 
+    def export_headers_snapshot(self, path, *, wallet: 'Abstract_Wallet' = None, address: str = None, password=None):
+        """Run manually to generate a headers snapshot, for new installs to import
+        instead of syncing the headers after the last checkpoint. If address is given,
+        the snapshot is signed with its key in wallet. Kept for console use only.
+        """
+        snapshot = self.blockchain().get_headers_snapshot()
+        if address is not None:
+            signature = wallet.sign_message(address, snapshot.message_to_sign(), password)
+            snapshot = snapshot._replace(signer=address, signature=signature)
+        with open(path, 'wb') as f:
+            f.write(snapshot.serialize())
+
     async def _start(self):
         assert not self.taskgroup
         self.taskgroup = taskgroup = OldTaskGroup()
@@ -1366,6 +1521,8 @@ class Network(Logger, NetworkRetryManager[ServerAddr]):
                 await group.spawn(self.taskgroup.cancel_remaining())
                 if full_shutdown:
                     await group.spawn(self.stop_gossip(full_shutdown=full_shutdown))
+        if full_shutdown:
+            util.shutdown_worker_pool()
         self.taskgroup = None
         self.interface = None
         self.interfaces = {}
@@ -30,6 +30,7 @@ class WatchTowerServer(AuthenticatedServer):
         self.app.router.add_post("/", self.handle)
         self.register_method(self.get_ctn)
         self.register_method(self.add_sweep_tx)
+        self.register_method(self.add_sweep_txs)
 
     async def run(self):
         self.runner = web.AppRunner(self.app)
@@ -43,3 +44,6 @@ class WatchTowerServer(AuthenticatedServer):
 
     async def add_sweep_tx(self, *args):
         return await self.lnwatcher.sweepstore.add_sweep_tx(*args)
+
+    async def add_sweep_txs(self, *args):
+        return await self.lnwatcher.sweepstore.add_sweep_txs(*args)
@@ -26,7 +26,7 @@
 
 import asyncio, os
 from typing import TYPE_CHECKING
-from typing import NamedTuple, Dict
+from typing import NamedTuple, Dict, List, Optional, Sequence, Tuple
 
 from electrum_cat.util import log_exceptions, random_shuffled_copy
 from electrum_cat.plugin import BasePlugin, hook
@@ -63,6 +63,7 @@ class WatchtowerPlugin(BasePlugin):
 class WatchTower(LNWatcher):
 
     LOGGING_SHORTCUT = 'W'
+    STARTUP_PAGE_SIZE = 1000
 
     def __init__(self, network: 'Network'):
         adb = AddressSynchronizer(WalletDB('', storage=None, upgrade=True), network.config, name=self.diagnostic_name())
@@ -83,10 +84,17 @@ class WatchTower(LNWatcher):
 
     @log_exceptions
     async def start_watching(self):
-        # I need to watch the addresses from sweepstore
-        lst = await self.sweepstore.list_channels()
-        for outpoint, address in random_shuffled_copy(lst):
-            self.add_channel(outpoint, address)
+        # I need to watch the addresses from sweepstore.
+        # channels are read in pages, so that we do not hold them all in memory,
+        # and do not block the event loop with a large tower
+        after = None
+        while True:
+            lst = await self.sweepstore.list_channels_page(after=after, limit=self.STARTUP_PAGE_SIZE)
+            if not lst:
+                break
+            self.add_channels(random_shuffled_copy(lst))
+            after = lst[-1][0]
+            await asyncio.sleep(0)
 
     def inspect_tx_candidate(self, outpoint, n: int) -> Dict[str, str]:
         """
@@ -99,6 +107,8 @@ class WatchTower(LNWatcher):
         prev_txid, index = outpoint.split(':')
         spender_txid = self.adb.db.get_spent_outpoint(prev_txid, int(index))
         result = {outpoint:spender_txid}
+        if spender_txid is not None:
+            self._add_spender_dependency(prev_txid, spender_txid)
         if n == 0:
             if spender_txid is None:
                 self.channel_status[outpoint] = 'open'
@@ -143,12 +153,16 @@ class WatchTower(LNWatcher):
     async def sweep_commitment_transaction(self, funding_outpoint, closing_tx):
         spenders = self.inspect_tx_candidate(funding_outpoint, 0)
         keep_watching = False
+        unspent = []
         for prevout, spender in spenders.items():
             if spender is not None:
                 keep_watching |= not self.is_deeply_mined(spender)
-                continue
-            sweep_txns = await self.sweepstore.get_sweep_tx(funding_outpoint, prevout)
-            for tx in sweep_txns:
+            else:
+                unspent.append(prevout)
+        # match all the unspent outputs against the sweepstore at once
+        sweep_txs = await self.sweepstore.get_sweep_txs(funding_outpoint, unspent)
+        for prevout in unspent:
+            for tx in sweep_txs.get(prevout, []):
                 await self.broadcast_or_log(funding_outpoint, tx)
                 keep_watching = True
         return keep_watching
@@ -208,6 +222,12 @@ prevout VARCHAR(34),
 tx VARCHAR
 )"""
 
+# sweep txs are looked up by the outputs they spend (prevout is 'commitment_txid:index')
+create_sweep_txs_indexes = [
+    "CREATE INDEX IF NOT EXISTS sweep_txs_prevout ON sweep_txs (prevout)",
+    "CREATE INDEX IF NOT EXISTS sweep_txs_funding_outpoint ON sweep_txs (funding_outpoint, ctn)",
+]
+
 create_channel_info="""
 CREATE TABLE IF NOT EXISTS channel_info (
 outpoint VARCHAR(34) NOT NULL,
@@ -218,13 +238,21 @@ PRIMARY KEY(outpoint)
 
 class SweepStore(SqlDB):
 
+    # max number of host parameters in a query, for old versions of sqlite
+    MAX_QUERY_PARAMS = 900
+
     def __init__(self, path, network):
         super().__init__(network.asyncio_loop, path)
 
     def create_database(self):
         c = self.conn.cursor()
+        # every add_sweep_tx is committed. With a write-ahead log, commits only append to it.
+        c.execute("PRAGMA journal_mode=WAL")
+        c.execute("PRAGMA synchronous=FULL")
         c.execute(create_channel_info)
         c.execute(create_sweep_txs)
+        for create_index in create_sweep_txs_indexes:
+            c.execute(create_index)
         self.conn.commit()
 
     @sql
@@ -233,6 +261,22 @@ class SweepStore(SqlDB):
         c.execute("SELECT tx FROM sweep_txs WHERE funding_outpoint=? AND prevout=?", (funding_outpoint, prevout))
         return [Transaction(r[0].hex()) for r in c.fetchall()]
 
+    @sql
+    def get_sweep_txs(self, funding_outpoint: str, prevouts: Sequence[str]) -> Dict[str, List[Transaction]]:
+        """Returns the sweep txs of a channel spending prevouts, grouped by prevout."""
+        result = {}
+        c = self.conn.cursor()
+        prevouts = list(prevouts)
+        chunk_size = self.MAX_QUERY_PARAMS - 1
+        for i in range(0, len(prevouts), chunk_size):
+            chunk = prevouts[i:i+chunk_size]
+            c.execute(
+                "SELECT prevout, tx FROM sweep_txs WHERE funding_outpoint=? AND prevout IN (%s)" % ','.join('?' * len(chunk)),
+                (funding_outpoint, *chunk))
+            for prevout, raw_tx in c.fetchall():
+                result.setdefault(prevout, []).append(Transaction(raw_tx.hex()))
+        return result
+
     @sql
     def list_sweep_tx(self):
         c = self.conn.cursor()
@@ -241,9 +285,20 @@ class SweepStore(SqlDB):
 
     @sql
     def add_sweep_tx(self, funding_outpoint, ctn, prevout, raw_tx):
+        self._add_sweep_txs(funding_outpoint, ctn, [(prevout, raw_tx)])
+
+    @sql
+    def add_sweep_txs(self, funding_outpoint: str, ctn: int, sweep_txs: Sequence[Tuple[str, str]]):
+        """Adds the (prevout, raw_tx) sweep txs of a ctn, in a single sqlite transaction."""
+        self._add_sweep_txs(funding_outpoint, ctn, sweep_txs)
+
+    def _add_sweep_txs(self, funding_outpoint, ctn, sweep_txs):
+        rows = []
+        for prevout, raw_tx in sweep_txs:
+            assert Transaction(raw_tx).is_complete()
+            rows.append((funding_outpoint, ctn, prevout, bytes.fromhex(raw_tx)))
         c = self.conn.cursor()
-        assert Transaction(raw_tx).is_complete()
-        c.execute("""INSERT INTO sweep_txs (funding_outpoint, ctn, prevout, tx) VALUES (?,?,?,?)""", (funding_outpoint, ctn, prevout, bytes.fromhex(raw_tx)))
+        c.executemany("""INSERT INTO sweep_txs (funding_outpoint, ctn, prevout, tx) VALUES (?,?,?,?)""", rows)
         self.conn.commit()
 
     @sql
@@ -295,3 +350,10 @@ class SweepStore(SqlDB):
         c = self.conn.cursor()
         c.execute("SELECT outpoint, address FROM channel_info")
         return [(r[0], r[1]) for r in c.fetchall()]
+
+    @sql
+    def list_channels_page(self, *, after: Optional[str], limit: int) -> List[Tuple[str, str]]:
+        """Returns up to limit channels, ordered by outpoint, starting after the given outpoint."""
+        c = self.conn.cursor()
+        c.execute("SELECT outpoint, address FROM channel_info WHERE outpoint > ? ORDER BY outpoint LIMIT ?", (after or '', limit))
+        return [(r[0], r[1]) for r in c.fetchall()]
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+# Builds a random channel graph of the size of the public lightning network,
+# and measures LNPathFinder.find_path_for_payment between random nodes,
+# and LNPathFinder.find_route for repeated payments to a few destinations.
+#
+# usage: bench_pathfinding.py [num_nodes] [num_channels] [num_payments]
+
+import asyncio
+import random
+import sys
+import tempfile
+import time
+
+from electrum_cat import constants
+from electrum_cat.channel_db import ChannelDB
+from electrum_cat.lnrouter import LNPathFinder
+from electrum_cat.lnutil import ShortChannelID
+from electrum_cat.simple_config import SimpleConfig
+from electrum_cat.util import print_msg, create_and_start_event_loop
+
+num_nodes = int(sys.argv[1]) if len(sys.argv) > 1 else 15_000
+num_channels = int(sys.argv[2]) if len(sys.argv) > 2 else 60_000
+num_payments = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+
+rand = random.Random(0)  # the same graph and payments on every run
+
+
+def make_node_id() -> bytes:
+    return bytes([2]) + rand.randbytes(32)
+
+
+def make_channel_update(short_channel_id: bytes, direction: int) -> dict:
+    return {
+        'short_channel_id': short_channel_id,
+        'message_flags': b'\x00',
+        'channel_flags': bytes([direction]),
+        'cltv_expiry_delta': rand.choice([40, 80, 144]),
+        'htlc_minimum_msat': 1000,
+        'htlc_maximum_msat': None,
+        'fee_base_msat': rand.choice([0, 1000]),
+        'fee_proportional_millionths': rand.randint(1, 500),
+        'chain_hash': constants.net.rev_genesis_bytes(),
+        'timestamp': int(time.time()),
+    }
+
+
+class Network:
+    interface = None
+
+    def __init__(self, config, asyncio_loop):
+        self.config = config
+        self.asyncio_loop = asyncio_loop
+
+
+async def main(tmpdir):
+    config = SimpleConfig({'electrum_path': tmpdir})
+    channel_db = ChannelDB(Network(config, asyncio.get_running_loop()))
+    channel_db.data_loaded.set()
+    # preferential attachment, so that a few nodes have many channels
+    nodes = [make_node_id() for i in range(num_nodes)]
+    endpoints = list(nodes)
+    announcements = []
+    t0 = time.time()
+    for i in range(num_channels):
+        node1, node2 = sorted(rand.sample(endpoints, 2))
+        if node1 == node2:
+            continue
+        endpoints += [node1, node2]
+        announcements.append({
+            'node_id_1': node1, 'node_id_2': node2,
+            'bitcoin_key_1': node1, 'bitcoin_key_2': node2,
+            'short_channel_id': ShortChannelID.from_components(100_000 + i, 1, 0),
+            'chain_hash': constants.net.rev_genesis_bytes(),
+            'len': 0, 'features': b'',
+        })
+    channel_db.add_channel_announcements(announcements, trusted=True)
+    for announcement in announcements:
+        for direction in (0, 1):
+            channel_db.add_channel_update(
+                make_channel_update(announcement['short_channel_id'], direction), verify=False, verbose=False)
+    print_msg(f"{channel_db.num_channels} channels, {len(channel_db.get_node_policies())} policies: {time.time() - t0:.1f} s")
+
+    path_finder = LNPathFinder(channel_db)
+    payments = [(rand.choice(nodes), rand.choice(nodes), rand.randint(10_000, 10_000_000)) for i in range(num_payments)]
+    t0 = time.time()
+    nodeA, nodeB, amount_msat = payments[0]
+    path_finder.find_path_for_payment(nodeA=nodeA, nodeB=nodeB, invoice_amount_msat=amount_msat)
+    print_msg(f"first path: {time.time() - t0:.2f} s")
+    t0 = time.time()
+    total_hops = 0
+    for nodeA, nodeB, amount_msat in payments:
+        path = path_finder.find_path_for_payment(nodeA=nodeA, nodeB=nodeB, invoice_amount_msat=amount_msat)
+        total_hops += len(path) if path else 0
+    dt = time.time() - t0
+    print_msg(f"{num_payments} paths, {total_hops} hops: {dt:.2f} s ({1000 * dt / num_payments:.1f} ms per path)")
+
+    # the same sender pays a few destinations again and again
+    sender = payments[0][0]
+    destinations = [nodeB for nodeA, nodeB, amount_msat in payments[:5]]
+    t0 = time.time()
+    for i in range(num_payments * 5):
+        path_finder.find_route(
+            nodeA=sender, nodeB=rand.choice(destinations), invoice_amount_msat=rand.randint(1_000_000, 1_500_000))
+    dt = time.time() - t0
+    print_msg(f"{num_payments * 5} routes to {len(destinations)} destinations: {dt:.2f} s")
+    print_msg(f"route cache: {path_finder.get_route_cache_stats()}")
+    channel_db.stop()
+    await channel_db.stopped_event.wait()
+
+
+loop, stopping_fut, loop_thread = create_and_start_event_loop()
+try:
+    with tempfile.TemporaryDirectory() as tmpdir:
+        asyncio.run_coroutine_threadsafe(main(tmpdir), loop).result()
+finally:
+    loop.call_soon_threadsafe(stopping_fut.set_result, 1)
+    loop_thread.join(timeout=1)
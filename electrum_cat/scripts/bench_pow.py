@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+# Benchmarks the available scrypt PoW backends on chunks of headers taken
+# from the headers file of an already synced datadir.
+#
+# usage: bench_pow.py [num_chunks]
+
+import os
+import sys
+import time
+
+from electrum_cat import blockchain
+from electrum_cat.blockchain import HEADER_SIZE
+from electrum_cat.util import print_msg, get_headers_dir
+from electrum_cat.simple_config import SimpleConfig
+
+# the pure-python implementation takes minutes per chunk; only hash a sample and extrapolate
+PYTHON_SAMPLE_SIZE = 16
+
+try:
+    num_chunks = int(sys.argv[1])
+except IndexError:
+    num_chunks = 3
+
+config = SimpleConfig()
+filename = os.path.join(get_headers_dir(config), 'blockchain_headers')
+if not os.path.exists(filename):
+    sys.exit(f"headers file not found at {filename}. Sync the headers first.")
+
+with open(filename, 'rb') as f:
+    data = f.read()
+chunk_size = 2016 * HEADER_SIZE
+# take the chunks from the tip, the beginning of the file is sparse (checkpoint region)
+last_full_chunk = len(data) // chunk_size
+chunks = [data[i * chunk_size:(i + 1) * chunk_size]
+          for i in range(max(0, last_full_chunk - num_chunks), last_full_chunk)]
+chunks = [c for c in chunks if c[:HEADER_SIZE] != bytes(HEADER_SIZE)]
+if not chunks:
+    sys.exit("no full chunk of headers available in headers file")
+
+raw_chunks = [[c[i:i + HEADER_SIZE] for i in range(0, len(c), HEADER_SIZE)] for c in chunks]
+reference = None
+for name in ('scrypt', 'hashlib', 'python'):
+    pow_hashes = blockchain.POW_HASH_BACKENDS.get(name)
+    if pow_hashes is None:
+        print_msg(f"{name:>8}: not available")
+        continue
+    if name == 'python':
+        t0 = time.monotonic()
+        hashes = pow_hashes(raw_chunks[0][:PYTHON_SAMPLE_SIZE])
+        dt = (time.monotonic() - t0) * 2016 / PYTHON_SAMPLE_SIZE
+        assert reference is None or hashes == reference[:PYTHON_SAMPLE_SIZE]
+        print_msg(f"{name:>8}: {dt:.2f} s/chunk (extrapolated from {PYTHON_SAMPLE_SIZE} headers)")
+        continue
+    t0 = time.monotonic()
+    hashes = []
+    for raw_headers in raw_chunks:
+        hashes += pow_hashes(raw_headers)
+    dt = (time.monotonic() - t0) / len(chunks)
+    assert reference is None or hashes == reference
+    reference = reference or hashes
+    print_msg(f"{name:>8}: {dt:.2f} s/chunk ({len(chunks)} chunks)")
+print_msg(f"used for syncing: {blockchain.get_pow_hash_backend()}")
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+# Measures the memory used by the coins of a wallet with many UTXOs,
+# as returned by get_addr_utxo (PartialTxInput) and kept in the coin
+# index of AddressSynchronizer (TxOutpoint keys), and by TxOutputs.
+#
+# usage: bench_tx_memory.py [num_utxos]
+
+import os
+import sys
+import tracemalloc
+
+from electrum_cat.transaction import TxOutpoint, TxOutput, PartialTxInput
+from electrum_cat.util import print_msg
+
+try:
+    num_utxos = int(sys.argv[1])
+except IndexError:
+    num_utxos = 100_000
+
+# a few outputs per tx, as in a real wallet
+OUTPUTS_PER_TX = 4
+txids = [os.urandom(32) for i in range(num_utxos // OUTPUTS_PER_TX + 1)]
+address = 'cc1qw508d6qejxtdg4y5r3zarvary0c5xw7kz4f5u5'
+scriptpubkey = bytes.fromhex('0014751e76e8199196d454941c45d1b3a323f1433bd6')
+
+
+def measure(name, make_objects):
+    tracemalloc.start()
+    objects = make_objects()
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print_msg(f"{name:>14}: {size / 2**20:7.1f} MiB, {size / len(objects):6.0f} bytes each")
+    del objects
+
+
+def make_index():
+    # outpoint -> (address, value, is_coinbase)
+    return {TxOutpoint(txid=txids[i // OUTPUTS_PER_TX], out_idx=i % OUTPUTS_PER_TX): (address, 1000 + i, False)
+            for i in range(num_utxos)}
+
+
+def make_coins():
+    coins = []
+    for i in range(num_utxos):
+        prevout = TxOutpoint(txid=txids[i // OUTPUTS_PER_TX], out_idx=i % OUTPUTS_PER_TX)
+        utxo = PartialTxInput(prevout=prevout, is_coinbase_output=False)
+        utxo._trusted_address = address
+        utxo._trusted_value_sats = 1000 + i
+        utxo.block_height = 100_000 + i
+        utxo.block_txpos = 1
+        coins.append(utxo)
+    return coins
+
+
+def make_outputs():
+    return [TxOutput(scriptpubkey=scriptpubkey, value=1000 + i) for i in range(num_utxos)]
+
+
+print_msg(f"{num_utxos} utxos")
+measure('coin index', make_index)
+measure('PartialTxInput', make_coins)
+measure('TxOutput', make_outputs)
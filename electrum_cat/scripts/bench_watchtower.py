@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+
+# Loads a watchtower sweepstore with synthetic channels and sweep txs,
+# and measures the operations a large tower does: adding sweep txs,
+# listing the channels at startup, and matching closing txs.
+#
+# usage: bench_watchtower.py [num_channels]
+
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+from electrum_cat import bitcoin
+from electrum_cat.plugins.watchtower.watchtower import SweepStore
+from electrum_cat.util import print_msg
+
+try:
+    num_channels = int(sys.argv[1])
+except IndexError:
+    num_channels = 100_000
+
+# to_local and a few htlc outputs per revoked commitment
+SWEEPS_PER_CHANNEL = 4
+NUM_LOOKUPS = 1000
+
+
+def make_sweep_tx(prevout: str) -> str:
+    txid, index = prevout.split(':')
+    raw = (2).to_bytes(4, 'little') + bitcoin.var_int(1)
+    raw += bytes.fromhex(txid)[::-1] + int(index).to_bytes(4, 'little')
+    raw += bitcoin.var_int(72) + os.urandom(72) + b'\xff' * 4
+    raw += bitcoin.var_int(1) + (10_000).to_bytes(8, 'little') + bitcoin.var_int(22) + b'\x00\x14' + os.urandom(20)
+    raw += bytes(4)
+    return raw.hex()
+
+
+class Network:
+    def __init__(self, asyncio_loop):
+        self.asyncio_loop = asyncio_loop
+
+
+async def main(path):
+    store = SweepStore(path, Network(asyncio.get_running_loop()))
+    channels = []
+    t0 = time.time()
+    for i in range(num_channels):
+        outpoint = os.urandom(32).hex() + ':0'
+        address = bitcoin.redeem_script_to_address('p2wsh', os.urandom(71))
+        commitment_txid = os.urandom(32).hex()
+        prevouts = [f'{commitment_txid}:{j}' for j in range(SWEEPS_PER_CHANNEL)]
+        await store.get_ctn(outpoint, address)
+        await store.add_sweep_txs(outpoint, 1, [(prevout, make_sweep_tx(prevout)) for prevout in prevouts])
+        channels.append((outpoint, prevouts))
+    dt = time.time() - t0
+    print_msg(f"add {num_channels} channels: {dt:.1f} s ({num_channels / dt:.0f} channels/s)")
+    print_msg(f"db size: {store.filesize() / 2**20:.1f} MiB")
+
+    t0 = time.time()
+    n = 0
+    after = None
+    while lst := await store.list_channels_page(after=after, limit=1000):
+        n += len(lst)
+        after = lst[-1][0]
+    print_msg(f"list {n} channels by page: {time.time() - t0:.2f} s")
+
+    sample = random.sample(channels, min(NUM_LOOKUPS, len(channels)))
+    t0 = time.time()
+    for outpoint, prevouts in sample:
+        for prevout in prevouts:
+            assert await store.get_sweep_tx(outpoint, prevout)
+    print_msg(f"match {len(sample)} closings, one query per prevout: {time.time() - t0:.2f} s")
+    t0 = time.time()
+    for outpoint, prevouts in sample:
+        assert len(await store.get_sweep_txs(outpoint, prevouts)) == len(prevouts)
+    print_msg(f"match {len(sample)} closings, one query per closing: {time.time() - t0:.2f} s")
+
+    store.stop()
+    await store.stopped_event.wait()
+
+
+with tempfile.TemporaryDirectory() as tmpdir:
+    asyncio.run(main(os.path.join(tmpdir, 'watchtower_db')))
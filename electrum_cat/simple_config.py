@@ -965,6 +965,8 @@ class SimpleConfig(Logger):
     NETWORK_SERVERFINGERPRINT = ConfigVar('serverfingerprint', default=None, type_=str)
     NETWORK_MAX_INCOMING_MSG_SIZE = ConfigVar('network_max_incoming_msg_size', default=1_000_000, type_=int)  # in bytes
     NETWORK_TIMEOUT = ConfigVar('network_timeout', default=None, type_=int)
+    NETWORK_SYNC_BATCH_SIZE = ConfigVar('network_sync_batch_size', default=100, type_=int)  # max requests per JSON-RPC batch
+    NETWORK_TX_CACHE_SIZE_MB = ConfigVar('tx_cache_size_mb', default=100, type_=int)  # on disk, for unencrypted wallets only. 0 to keep txs in memory only
     NETWORK_BOOKMARKED_SERVERS = ConfigVar('network_bookmarked_servers', default=None)
 
     WALLET_BATCH_RBF = ConfigVar(
@@ -1006,6 +1008,8 @@ class SimpleConfig(Logger):
     )
     WALLET_PAYREQ_EXPIRY_SECONDS = ConfigVar('request_expiry', default=invoices.PR_DEFAULT_EXPIRATION_WHEN_CREATING, type_=int)
     WALLET_USE_SINGLE_PASSWORD = ConfigVar('single_password', default=False, type_=bool)
+    WALLET_HISTORY_SANITY_CHECK = ConfigVar('history_sanity_check', default=False, type_=bool)  # debug: check history against get_balance
+    WALLET_SQLITE_STORAGE = ConfigVar('wallet_sqlite_storage', default=False, type_=bool)  # store unencrypted wallet files in the sqlite format
     # note: 'use_change' and 'multiple_change' are per-wallet settings
     WALLET_SEND_CHANGE_TO_LIGHTNING = ConfigVar(
         'send_change_to_lightning', default=False, type_=bool,
@@ -1205,6 +1209,7 @@ Warning: setting this to too low will result in lots of payment failures."""),
         long_desc=lambda: _("Select which language is used in the GUI (after restart)."),
     )
     BLOCKCHAIN_PREFERRED_BLOCK = ConfigVar('blockchain_preferred_block', default=None)
+    HEADERS_SNAPSHOT_SIGNERS = ConfigVar('headers_snapshot_signers', default=None)  # in addition to the ones in constants
     SHOW_CRASH_REPORTER = ConfigVar('show_crash_reporter', default=True, type_=bool)
     DONT_SHOW_TESTNET_WARNING = ConfigVar('dont_show_testnet_warning', default=False, type_=bool)
     RECENTLY_OPEN_WALLET_FILES = ConfigVar('recently_open', default=None)
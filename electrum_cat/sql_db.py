@@ -65,12 +65,18 @@ class SqlDB(Logger):
                 i = (i + 1) % self.commit_interval
                 if i == 0:
                     self.conn.commit()
-        # write
-        self.conn.commit()
-        self.conn.close()
-
-        self.logger.info("SQL thread terminated")
-        self.asyncio_loop.call_soon_threadsafe(self.stopped_event.set)
+        try:
+            # write
+            self.conn.commit()
+            self.close_database()
+        finally:
+            self.conn.close()
+            self.logger.info("SQL thread terminated")
+            self.asyncio_loop.call_soon_threadsafe(self.stopped_event.set)
 
     def create_database(self):
         raise NotImplementedError()
+
+    def close_database(self):
+        """Called in the sql thread, before the connection is closed."""
+        pass
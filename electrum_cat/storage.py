@@ -27,9 +27,10 @@ import threading
 import stat
 import hashlib
 import base64
+import sqlite3
 import zlib
 from enum import IntEnum
-from typing import Optional
+from typing import Optional, Sequence, Iterable, Tuple, List
 
 import electrum_ecc as ecc
 
@@ -59,6 +60,55 @@ class StorageReadWriteError(Exception): pass
 class StorageOnDiskUnexpectedlyChanged(Exception): pass
 
 
+SQLITE_MAGIC = b'SQLite format 3\x00'
+
+
+class WalletSqlite:
+    """Key-value store for the SQLite wallet file format.
+
+    Rows are (parent, key, value), value being json.
+    Top-level keys of the db have parent ''. The items of some large
+    top-level dicts (see JsonDB.LAZY_KEYS) are stored as separate rows,
+    with the name of the dict as parent, so that they can be read and
+    written one by one.
+    Not thread-safe: callers hold the lock of the db.
+    """
+
+    def __init__(self, path: str):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA synchronous=FULL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS data ("
+            "parent TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, PRIMARY KEY (parent, key))")
+        self.conn.commit()
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def get(self, parent: str, key: str) -> Optional[str]:
+        row = self.conn.execute("SELECT value FROM data WHERE parent=? AND key=?", (parent, key)).fetchone()
+        return row[0] if row else None
+
+    def get_items(self, parent: str) -> List[Tuple[str, str]]:
+        return self.conn.execute("SELECT key, value FROM data WHERE parent=?", (parent,)).fetchall()
+
+    def get_keys(self, parent: str) -> List[str]:
+        return [row[0] for row in self.conn.execute("SELECT key FROM data WHERE parent=?", (parent,))]
+
+    def update(
+            self,
+            *,
+            upserts: Iterable[Tuple[str, str, str]] = (),
+            deletes: Iterable[Tuple[str, str]] = (),
+            delete_parents: Iterable[str] = (),
+    ) -> None:
+        """Applies the changes in a single transaction."""
+        with self.conn:
+            self.conn.executemany("DELETE FROM data WHERE parent=?", [(x,) for x in delete_parents])
+            self.conn.executemany("DELETE FROM data WHERE parent=? AND key=?", deletes)
+            self.conn.executemany("INSERT OR REPLACE INTO data (parent, key, value) VALUES (?,?,?)", upserts)
+
+
 # TODO: Rename to Storage
 class WalletStorage(Logger):
 
@@ -71,16 +121,28 @@ class WalletStorage(Logger):
         self.logger.info(f"wallet path {self.path}")
         self.pubkey = None
         self.decrypted = ''
+        # (encryption version, pubkey) of the data on disk. Appended records must use the same key.
+        self._key_on_disk = None
+        self._has_incomplete_record = False
         try:
             test_read_write_permissions(self.path)
         except IOError as e:
             raise StorageReadWriteError(e) from e
+        self.sqlite = None  # type: Optional[WalletSqlite]
         if self.file_exists():
             with open(self.path, "rb") as f:
-                self.raw = f.read().decode("utf-8")
+                if f.read(len(SQLITE_MAGIC)) == SQLITE_MAGIC:
+                    self.sqlite = WalletSqlite(self.path)
+                    f.seek(0)
+                    self.raw = ''
+                else:
+                    f.seek(0)
+                    self.raw = f.read().decode("utf-8")
                 self.pos = f.seek(0, os.SEEK_END)
                 self.init_pos = self.pos
             self._encryption_version = self._init_encryption_version()
+            if not self.is_encrypted():
+                self._key_on_disk = StorageEncryptionVersion.PLAINTEXT, None
         else:
             self.raw = ''
             self._encryption_version = StorageEncryptionVersion.PLAINTEXT
@@ -90,6 +152,14 @@ class WalletStorage(Logger):
     def read(self):
         return self.decrypted if self.is_encrypted() else self.raw
 
+    def is_sqlite(self) -> bool:
+        return self.sqlite is not None
+
+    def close(self) -> None:
+        """Closes the sqlite connection, if any. The storage cannot be read afterwards."""
+        if self.sqlite:
+            self.sqlite.close()
+
     def write(self, data: str) -> None:
         try:
             mode = os.stat(self.path).st_mode
@@ -106,25 +176,76 @@ class WalletStorage(Logger):
         # assert that wallet file does not exist, to prevent wallet corruption (see issue #5082)
         if not self.file_exists():
             assert not os.path.exists(self.path)
+        if self.sqlite:
+            # converting back to json (e.g. to encrypt the file)
+            self.sqlite.close()
+            self.sqlite = None
         os.replace(temp_path, self.path)
         self._file_exists = True
+        self._key_on_disk = self._encryption_version, self.pubkey
+        self._has_incomplete_record = False
+        self.init_pos = self.pos
         self.logger.info(f"saved {self.path}")
 
     def append(self, data: str) -> None:
-        """ append data to file. for the moment, only non-encrypted file"""
-        assert not self.is_encrypted()
+        """Appends data to the file.
+        If the file is encrypted, data is encrypted on its own and appended
+        as a separate record, on a new line (see _decrypt_records).
+        """
+        assert self.can_append()
+        s = data
+        if self.is_encrypted():
+            s = '\n' + self.encrypt_before_writing(data, is_record=True)
         with open(self.path, "rb+") as f:
             pos = f.seek(0, os.SEEK_END)
             if pos != self.pos:
                 raise StorageOnDiskUnexpectedlyChanged(f"expected size {self.pos}, found {pos}")
-            f.write(data.encode("utf-8"))
+            f.write(s.encode("utf-8"))
             self.pos = f.seek(0, os.SEEK_END)
             f.flush()
             os.fsync(f.fileno())
+        if self.is_encrypted():
+            self.decrypted += data
+
+    def can_append(self) -> bool:
+        """Whether data can be appended to the file, or it needs to be rewritten."""
+        return (self.file_exists()
+                and not self._has_incomplete_record
+                and self._key_on_disk == (self._encryption_version, self.pubkey))
 
     def needs_consolidation(self):
         return self.pos > 2 * self.init_pos
 
+    def has_appended_data(self) -> bool:
+        return self.pos != self.init_pos
+
+    def write_sqlite(self, rows: Iterable[Tuple[str, str, str]]) -> None:
+        """Replaces the file with a sqlite file containing rows (see WalletSqlite)."""
+        assert not self.is_encrypted(), "the sqlite format does not support storage encryption"
+        try:
+            mode = os.stat(self.path).st_mode
+        except FileNotFoundError:
+            mode = stat.S_IREAD | stat.S_IWRITE
+        temp_path = "%s.tmp.%s" % (self.path, os.getpid())
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        with open(temp_path, "wb"):
+            os_chmod(temp_path, mode)  # set restrictive perms *before* we write data
+        sqlite = WalletSqlite(temp_path)
+        sqlite.update(upserts=rows)
+        sqlite.close()
+        if not self.file_exists():
+            assert not os.path.exists(self.path)
+        if self.sqlite:
+            self.sqlite.close()
+        os.replace(temp_path, self.path)
+        self.sqlite = WalletSqlite(self.path)
+        self.raw = ''
+        self._file_exists = True
+        self._key_on_disk = StorageEncryptionVersion.PLAINTEXT, None
+        self.pos = self.init_pos = os.path.getsize(self.path)
+        self.logger.info(f"saved {self.path} (sqlite)")
+
     def file_exists(self) -> bool:
         return self._file_exists
 
@@ -160,7 +281,8 @@ class WalletStorage(Logger):
 
     def _init_encryption_version(self):
         try:
-            magic = base64.b64decode(self.raw)[0:4]
+            # encrypted files may have appended records, on separate lines
+            magic = base64.b64decode(self.raw.split('\n', 1)[0])[0:4]
             if magic == b'BIE1':
                 return StorageEncryptionVersion.USER_PASSWORD
             elif magic == b'BIE2':
@@ -194,17 +316,41 @@ class WalletStorage(Logger):
         ec_key = self.get_eckey_from_password(password)
         if self.raw:
             enc_magic = self._get_encryption_magic()
-            s = zlib.decompress(crypto.ecies_decrypt_message(ec_key, self.raw, magic=enc_magic))
+            blob, *records = self.raw.split('\n')
+            s = zlib.decompress(crypto.ecies_decrypt_message(ec_key, blob, magic=enc_magic))
             s = s.decode('utf8')
+            s += self._decrypt_records(ec_key, records)
         else:
             s = ''
         self.pubkey = ec_key.get_public_key_hex()
+        self._key_on_disk = self._encryption_version, self.pubkey
         self.decrypted = s
 
-    def encrypt_before_writing(self, plaintext: str) -> str:
+    def _decrypt_records(self, ec_key: ecc.ECPrivkey, records: Sequence[str]) -> str:
+        """Decrypts the records appended to an encrypted file.
+        Each record is authenticated (ECIES mac). If the last record is
+        incomplete (e.g. we crashed while appending it), it is dropped
+        and the file will be rewritten on the next write.
+        """
+        enc_magic = self._get_encryption_magic()
+        out = []
+        for i, record in enumerate(records):
+            try:
+                s = zlib.decompress(crypto.ecies_decrypt_message(ec_key, record, magic=enc_magic))
+            except Exception as e:
+                if i == len(records) - 1:
+                    self.logger.info(f"dropping incomplete record at the end of the wallet file: {e!r}")
+                    self._has_incomplete_record = True
+                    break
+                raise WalletFileException(f"Cannot decrypt wallet file. (invalid record {i}: {e!r})") from e
+            out.append(s.decode('utf8'))
+        return ''.join(out)
+
+    def encrypt_before_writing(self, plaintext: str, *, is_record: bool = False) -> str:
         s = plaintext
         if self.pubkey:
-            self.decrypted = plaintext
+            if not is_record:
+                self.decrypted = plaintext
             s = bytes(s, 'utf8')
             c = zlib.compress(s, level=zlib.Z_BEST_SPEED)
             enc_magic = self._get_encryption_magic()
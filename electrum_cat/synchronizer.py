@@ -24,7 +24,7 @@
 # SOFTWARE.
 import asyncio
 import hashlib
-from typing import Dict, List, TYPE_CHECKING, Tuple, Set
+from typing import Dict, List, TYPE_CHECKING, Tuple, Set, Sequence, Callable, Awaitable, Optional, Any
 from collections import defaultdict
 import logging
 
@@ -45,6 +45,12 @@ if TYPE_CHECKING:
 class SynchronizerFailure(Exception): pass
 
 
+# Rough sizes of JSON-RPC responses, so that batched responses fit in an incoming message.
+STATUS_RESPONSE_SIZE = 150
+HISTORY_ITEM_RESPONSE_SIZE = 120
+TX_RESPONSE_SIZE = 10_000  # the hex of a 5 kB tx: most are smaller. larger ones make the batch split
+
+
 def history_status(h):
     if not h:
         return None
@@ -60,6 +66,11 @@ class SynchronizerBase(NetworkJobOnDefaultServer):
     """
     def __init__(self, network: 'Network'):
         self.asyncio_loop = network.asyncio_loop
+        # Requests made while others are in flight are coalesced into JSON-RPC batches of up to this size.
+        # With a size of 1, every request is sent on its own.
+        self.batch_size = max(1, network.config.NETWORK_SYNC_BATCH_SIZE)
+        # Batches are also capped by the expected size of their response. Estimates are rough: leave a margin.
+        self.max_batch_response_size = network.config.NETWORK_MAX_INCOMING_MSG_SIZE // 2
 
         NetworkJobOnDefaultServer.__init__(self, network)
 
@@ -72,12 +83,56 @@ class SynchronizerBase(NetworkJobOnDefaultServer):
         self._processed_some_notifications = False  # so that we don't miss them
         # Queues
         self.status_queue = asyncio.Queue()
+        self._subscription_queue = asyncio.Queue()  # type: asyncio.Queue[str]
+
+    def reset_request_counters(self):
+        super().reset_request_counters()
+        self._batches_sent = 0
+        self._batched_requests_sent = 0
+
+    def num_batches_and_batched_requests_sent(self) -> Tuple[int, int]:
+        return self._batches_sent, self._batched_requests_sent
+
+    def _count_batch(self, num_requests: int) -> None:
+        self._requests_sent += num_requests
+        self._batches_sent += 1
+        self._batched_requests_sent += num_requests
+
+    def _get_batched_requests(self) -> Sequence[Tuple[asyncio.Queue, Callable[[Sequence], Awaitable],
+                                                      Optional[Callable[[Any], int]]]]:
+        """Queues of requests sent in batches, with the coroutine that sends a batch,
+        and the function that estimates the size of the response to an item, if any.
+        """
+        return [(self._subscription_queue, self._subscribe_to_addresses, lambda addr: STATUS_RESPONSE_SIZE)]
+
+    async def _send_in_batches(self, queue: asyncio.Queue, send_batch, response_size=None) -> None:
+        """Sends the items of queue with send_batch, taking all the queued ones (up to batch_size) at once.
+        There is a single batch in flight per queue: items queued meanwhile go in the next one.
+        If response_size is given, batches are also cut so that their responses fit in max_batch_response_size.
+        """
+        next_items = []
+        while True:
+            items = next_items or [await queue.get()]
+            next_items = []
+            size = response_size(items[0]) if response_size else 0
+            while len(items) < self.batch_size and not queue.empty():
+                item = queue.get_nowait()
+                if response_size:
+                    size += response_size(item)
+                    if size > self.max_batch_response_size:
+                        next_items = [item]
+                        break
+                items.append(item)
+            await send_batch(items)
 
     async def _run_tasks(self, *, taskgroup):
         await super()._run_tasks(taskgroup=taskgroup)
         try:
             async with taskgroup as group:
                 await group.spawn(self.handle_status())
+                if self.batch_size > 1:
+                    for queue, send_batch, response_size in self._get_batched_requests():
+                        await group.spawn(self._send_in_batches(queue, send_batch, response_size))
                 await group.spawn(self.main())
         finally:
             # we are being cancelled now
@@ -86,13 +141,17 @@ class SynchronizerBase(NetworkJobOnDefaultServer):
     def add(self, addr):
         if not is_address(addr): raise ValueError(f"invalid catcoin address {addr}")
         self._adding_addrs.add(addr)  # this lets is_up_to_date already know about addr
+        self.wakeup()
 
     async def _add_address(self, addr: str):
         try:
             if not is_address(addr): raise ValueError(f"invalid catcoin address {addr}")
             if addr in self.requested_addrs: return
             self.requested_addrs.add(addr)
-            await self.taskgroup.spawn(self._subscribe_to_address, addr)
+            if self.batch_size > 1:
+                self._subscription_queue.put_nowait(addr)
+            else:
+                await self.taskgroup.spawn(self._subscribe_to_address, addr)
         finally:
             self._adding_addrs.discard(addr)  # ok for addr not to be present
 
@@ -102,8 +161,11 @@ class SynchronizerBase(NetworkJobOnDefaultServer):
         """
         raise NotImplementedError()  # implemented by subclasses
 
+    def _address_to_scripthash(self, addr: str) -> str:
+        return address_to_scripthash(addr)
+
     async def _subscribe_to_address(self, addr):
-        h = address_to_scripthash(addr)
+        h = self._address_to_scripthash(addr)
         self.scripthash_to_address[h] = addr
         self._requests_sent += 1
         try:
@@ -115,6 +177,21 @@ class SynchronizerBase(NetworkJobOnDefaultServer):
             raise
         self._requests_answered += 1
 
+    async def _subscribe_to_addresses(self, addrs: Sequence[str]):
+        hs = [self._address_to_scripthash(addr) for addr in addrs]
+        for h, addr in zip(hs, addrs):
+            self.scripthash_to_address[h] = addr
+        self._count_batch(len(hs))
+        try:
+            async with self._network_request_semaphore:
+                await self.session.subscribe_batch(
+                    'blockchain.scripthash.subscribe', [[h] for h in hs], self.status_queue)
+        except RPCError as e:
+            if e.message == 'history too large':  # no unique error code
+                raise GracefulDisconnect(e, log_level=logging.ERROR) from e
+            raise
+        self._requests_answered += len(hs)
+
     async def handle_status(self):
         while True:
             h, status = await self.status_queue.get()
@@ -123,6 +200,7 @@ class SynchronizerBase(NetworkJobOnDefaultServer):
             self.requested_addrs.discard(addr)  # ok for addr not to be present
             await self.taskgroup.spawn(self._on_address_status, addr, status)
             self._processed_some_notifications = True
+            self.wakeup()
 
     async def main(self):
         raise NotImplementedError()  # implemented by subclasses
@@ -146,10 +224,28 @@ class Synchronizer(SynchronizerBase):
         self.requested_tx = {}
         self.requested_histories = set()
         self._stale_histories = dict()  # type: Dict[str, asyncio.Task]
+        self._history_queue = asyncio.Queue()  # type: asyncio.Queue[Tuple[str, asyncio.Future]]
+        self._tx_queue = asyncio.Queue()  # type: asyncio.Queue[Tuple[str, asyncio.Future]]
+
+    def _get_batched_requests(self):
+        return list(super()._get_batched_requests()) + [
+            (self._history_queue, self._get_histories, self._get_history_response_size),
+            (self._tx_queue, self._get_transactions, lambda item: TX_RESPONSE_SIZE),
+        ]
 
     def diagnostic_name(self):
         return self.adb.diagnostic_name()
 
+    def _can_persist_txs(self) -> bool:
+        """Whether the txs of the wallet can be written to the disk cache of the network.
+        They are not, for encrypted wallets and wallets that are not stored.
+        """
+        storage = self.adb.db.storage
+        return storage is not None and not storage.is_encrypted()
+
+    def _address_to_scripthash(self, addr: str) -> str:
+        return self.adb.db.get_address_scripthash(addr)
+
     def is_up_to_date(self):
         return (self._init_done
                 and not self._adding_addrs
@@ -174,11 +270,15 @@ class Synchronizer(SynchronizerBase):
             self._stale_histories.pop(addr, asyncio.Future()).cancel()
         finally:
             self._handling_addr_statuses.discard(addr)
-        h = address_to_scripthash(addr)
-        self._requests_sent += 1
-        async with self._network_request_semaphore:
-            result = await self.interface.get_history_for_scripthash(h)
-        self._requests_answered += 1
+            self.wakeup()
+        h = self._address_to_scripthash(addr)
+        if self.batch_size > 1:
+            result = await self._get_history_batched(h)
+        else:
+            self._requests_sent += 1
+            async with self._network_request_semaphore:
+                result = await self.interface.get_history_for_scripthash(h)
+            self._requests_answered += 1
         self.logger.info(f"receiving history {addr} {len(result)}")
         hist = list(map(lambda item: (item['tx_hash'], item['height']), result))
         # tx_fees
@@ -204,6 +304,31 @@ class Synchronizer(SynchronizerBase):
 
         # Remove request; this allows up_to_date to be True
         self.requested_histories.discard((addr, status))
+        self.wakeup()
+
+    async def _get_history_batched(self, h: str) -> List[dict]:
+        fut = self.asyncio_loop.create_future()
+        self._history_queue.put_nowait((h, fut))
+        return await fut
+
+    def _get_history_response_size(self, item: Tuple[str, asyncio.Future]) -> int:
+        # the history we have is a good guess of the size of the new one
+        addr = self.scripthash_to_address[item[0]]
+        return (len(self.adb.db.get_addr_history(addr)) + 1) * HISTORY_ITEM_RESPONSE_SIZE
+
+    async def _get_histories(self, items: Sequence[Tuple[str, asyncio.Future]]):
+        self._count_batch(len(items))
+        try:
+            async with self._network_request_semaphore:
+                results = await self.interface.get_history_for_scripthashes([h for h, fut in items])
+        except Exception as e:
+            # fail the waiting _on_address_status tasks, which fails the taskgroup
+            for h, fut in items:
+                fut.set_exception(e)
+            return
+        self._requests_answered += len(items)
+        for (h, fut), result in zip(items, results):
+            fut.set_result(result)
 
     async def _request_missing_txs(self, hist, *, allow_server_not_finding_tx=False):
         # "hist" is a list of [tx_hash, tx_height] lists
@@ -218,30 +343,77 @@ class Synchronizer(SynchronizerBase):
             self.requested_tx[tx_hash] = tx_height
 
         if not transaction_hashes: return
+        # another wallet of the daemon might have downloaded them already
+        tx_cache = self.network.tx_cache
+        raw_txs = []  # type: List[Tuple[str, str]]
+        for tx_hash in list(transaction_hashes):
+            if (raw_tx := tx_cache.get(tx_hash)) is not None:
+                raw_txs.append((tx_hash, raw_tx))
+                transaction_hashes.remove(tx_hash)
         async with OldTaskGroup() as group:
-            for tx_hash in transaction_hashes:
-                await group.spawn(self._get_transaction(tx_hash, allow_server_not_finding_tx=allow_server_not_finding_tx))
-
-    async def _get_transaction(self, tx_hash, *, allow_server_not_finding_tx=False):
-        self._requests_sent += 1
+            tasks = [await group.spawn(self._get_transaction(tx_hash, allow_server_not_finding_tx=allow_server_not_finding_tx))
+                     for tx_hash in transaction_hashes]
+        for tx_hash, task in zip(transaction_hashes, tasks):
+            if (raw_tx := task.result()) is not None:
+                raw_txs.append((tx_hash, raw_tx))
+        # the txs of the history are added in a single batch
+        self._on_transactions(raw_txs)
+
+    async def _get_transaction(self, tx_hash, *, allow_server_not_finding_tx=False) -> Optional[str]:
         try:
-            async with self._network_request_semaphore:
-                raw_tx = await self.interface.get_transaction(tx_hash)
+            if self.batch_size > 1:
+                fut = self.asyncio_loop.create_future()
+                self._tx_queue.put_nowait((tx_hash, fut))
+                raw_tx = await fut
+            else:
+                self._requests_sent += 1
+                try:
+                    async with self._network_request_semaphore:
+                        raw_tx = await self.interface.get_transaction(tx_hash)
+                finally:
+                    self._requests_answered += 1
         except RPCError as e:
             # most likely, "No such mempool or blockchain transaction"
             if allow_server_not_finding_tx:
                 self.requested_tx.pop(tx_hash)
-                return
+                self.wakeup()
+                return None
             else:
                 raise
+        # the interface has checked raw_tx against tx_hash
+        self.network.tx_cache.put(tx_hash, raw_tx, persist=self._can_persist_txs(), check_txid=False)
+        return raw_tx
+
+    async def _get_transactions(self, items: Sequence[Tuple[str, asyncio.Future]]):
+        self._count_batch(len(items))
+        try:
+            async with self._network_request_semaphore:
+                results = await self.interface.get_transactions([tx_hash for tx_hash, fut in items])
+        except Exception as e:
+            for tx_hash, fut in items:
+                fut.set_exception(e)
+            return
         finally:
-            self._requests_answered += 1
-        tx = Transaction(raw_tx)
-        if tx_hash != tx.txid():
-            raise SynchronizerFailure(f"received tx does not match expected txid ({tx_hash} != {tx.txid()})")
-        tx_height = self.requested_tx.pop(tx_hash)
-        self.adb.receive_tx_callback(tx, tx_height)
-        self.logger.info(f"received tx {tx_hash} height: {tx_height} bytes: {len(raw_tx)}")
+            self._requests_answered += len(items)
+        for (tx_hash, fut), result in zip(items, results):
+            if isinstance(result, Exception):
+                fut.set_exception(result)
+            else:
+                fut.set_result(result)
+
+    def _on_transactions(self, raw_txs: Sequence[Tuple[str, str]]) -> None:
+        txs = []
+        for tx_hash, raw_tx in raw_txs:
+            tx = Transaction(raw_tx)
+            if tx_hash != tx.txid():
+                raise SynchronizerFailure(f"received tx does not match expected txid ({tx_hash} != {tx.txid()})")
+            txs.append((tx, self.requested_tx[tx_hash]))
+        if txs:
+            self.adb.receive_txs_callback(txs)
+        for tx_hash, raw_tx in raw_txs:
+            tx_height = self.requested_tx.pop(tx_hash)
+            self.logger.info(f"received tx {tx_hash} height: {tx_height} bytes: {len(raw_tx)}")
+        self.wakeup()
 
     async def main(self):
         self.adb.up_to_date_changed()
@@ -259,7 +431,6 @@ class Synchronizer(SynchronizerBase):
         self._init_done = True
         prev_uptodate = False
         while True:
-            await asyncio.sleep(0.1)
             for addr in self._adding_addrs.copy(): # copy set to ensure iterator stability
                 await self._add_address(addr)
             up_to_date = self.adb.is_up_to_date()
@@ -268,7 +439,12 @@ class Synchronizer(SynchronizerBase):
                     or up_to_date and self._processed_some_notifications):
                 self._processed_some_notifications = False
                 self.adb.up_to_date_changed()
+                if up_to_date and self._batches_sent:
+                    self.logger.info(f"sent {self._batched_requests_sent} requests in {self._batches_sent} batches "
+                                     f"(avg size: {self._batched_requests_sent / self._batches_sent:.1f})")
             prev_uptodate = up_to_date
+            # woken up by new addresses, and whenever is_up_to_date might have changed
+            await self._wait_for_wakeup()
 
 
 class Notifier(SynchronizerBase):
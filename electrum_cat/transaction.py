@@ -137,6 +137,8 @@ class TxOutput:
     scriptpubkey: bytes
     value: Union[int, str]
 
+    __slots__ = ('_scriptpubkey', '_address', 'value')
+
     def __init__(self, *, scriptpubkey: bytes, value: Union[int, str]):
         self.scriptpubkey = scriptpubkey
         if not (isinstance(value, int) or parse_max_spend(value) is not None):
@@ -327,6 +329,12 @@ class TxInput:
     witness: Optional[bytes]
     _is_coinbase_output: bool
 
+    __slots__ = (
+        'prevout', 'script_sig', 'nsequence', 'witness', '_is_coinbase_output',
+        'block_height', 'block_txpos', 'spent_height', 'spent_txid', '_utxo',
+        '__scriptpubkey', '__address', '__value_sats',
+    )
+
     def __init__(self, *,
                  prevout: TxOutpoint,
                  script_sig: bytes = None,
@@ -1389,6 +1397,22 @@ def deser_compact_size(f) -> Optional[int]:
     return nit
 
 
+class _LazyDict:
+    """Class attribute standing for a dict attribute of the instances,
+    which is only allocated when first accessed.
+    (non-data descriptor: the instance attribute then shadows it)
+    """
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        d = obj.__dict__[self.name] = {}
+        return d
+
+
 class PSBTSection:
 
     def _populate_psbt_fields_from_fd(self, fd=None):
@@ -1454,27 +1478,30 @@ class PSBTSection:
 
 
 class PartialTxInput(TxInput, PSBTSection):
+    # The PSBT fields are class attributes holding the default values,
+    # so that instances (e.g. the coins of a wallet) only store the fields that were set.
+    _witness_utxo = None  # type: Optional[TxOutput]
+    sigs_ecdsa = _LazyDict()  # type: Dict[bytes, bytes]  # pubkey -> sig
+    tap_key_sig = None  # type: Optional[bytes]  # sig for taproot key-path-spending
+    sighash = None  # type: Optional[int]
+    bip32_paths = _LazyDict()  # type: Dict[bytes, Tuple[bytes, Sequence[int]]]  # pubkey -> (xpub_fingerprint, path)
+    redeem_script = None  # type: Optional[bytes]
+    witness_script = None  # type: Optional[bytes]
+    tap_merkle_root = None  # type: Optional[bytes]
+    slip_19_ownership_proof = None  # type: Optional[bytes]
+    _unknown = _LazyDict()  # type: Dict[bytes, bytes]
+
+    _script_descriptor = None  # type: Optional[Descriptor]
+    is_mine = False  # type: bool  # whether the wallet considers the input to be ismine
+    _trusted_value_sats = None  # type: Optional[int]
+    _trusted_address = None  # type: Optional[str]
+    _is_p2sh_segwit = None  # type: Optional[bool]  # None means unknown
+    _is_native_segwit = None  # type: Optional[bool]  # None means unknown
+    _is_taproot = None  # type: Optional[bool]  # None means unknown
+    witness_sizehint = None  # type: Optional[int]  # byte size of serialized complete witness, for tx size est
+
     def __init__(self, *args, **kwargs):
         TxInput.__init__(self, *args, **kwargs)
-        self._witness_utxo = None  # type: Optional[TxOutput]
-        self.sigs_ecdsa = {}  # type: Dict[bytes, bytes]  # pubkey -> sig
-        self.tap_key_sig = None  # type: Optional[bytes]  # sig for taproot key-path-spending
-        self.sighash = None  # type: Optional[int]
-        self.bip32_paths = {}  # type: Dict[bytes, Tuple[bytes, Sequence[int]]]  # pubkey -> (xpub_fingerprint, path)
-        self.redeem_script = None  # type: Optional[bytes]
-        self.witness_script = None  # type: Optional[bytes]
-        self.tap_merkle_root = None  # type: Optional[bytes]
-        self.slip_19_ownership_proof = None  # type: Optional[bytes]
-        self._unknown = {}  # type: Dict[bytes, bytes]
-
-        self._script_descriptor = None  # type: Optional[Descriptor]
-        self.is_mine = False  # type: bool  # whether the wallet considers the input to be ismine
-        self._trusted_value_sats = None  # type: Optional[int]
-        self._trusted_address = None  # type: Optional[str]
-        self._is_p2sh_segwit = None  # type: Optional[bool]  # None means unknown
-        self._is_native_segwit = None  # type: Optional[bool]  # None means unknown
-        self._is_taproot = None  # type: Optional[bool]  # None means unknown
-        self.witness_sizehint = None  # type: Optional[int]  # byte size of serialized complete witness, for tx size est
 
     @property
     def witness_utxo(self):
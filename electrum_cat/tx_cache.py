@@ -0,0 +1,124 @@
+"""Raw transactions cache, shared by the wallets of a daemon."""
+
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from .logging import Logger
+from .transaction import Transaction
+from .util import LRUCache, make_dir, is_hash256_str
+
+
+def _is_raw_tx_for_txid(raw_tx: bytes, txid: str) -> bool:
+    try:
+        return Transaction(raw_tx).txid() == txid
+    except Exception:
+        return False
+
+
+class RawTxCache(Logger):
+    """Cache of raw transactions, shared by all the wallets of the daemon.
+
+    Transactions are keyed by txid, kept in memory (LRU) and, if path is
+    given, in one file per transaction under path, up to max_disk_size
+    bytes. The least recently used files are deleted first.
+    Files are checked against their txid when read.
+    Only transactions put with persist=True are written to disk: the txs of
+    encrypted wallets must not end up in plaintext files.
+    """
+
+    def __init__(self, path: Optional[str], *, max_disk_size: int, max_mem_items: int = 2000):
+        Logger.__init__(self)
+        self.path = path
+        self.max_disk_size = max_disk_size
+        self._lock = threading.Lock()
+        self._mem_cache = LRUCache(maxsize=max_mem_items)  # type: LRUCache[str, bytes]
+        self._disk_index = OrderedDict()  # type: OrderedDict[str, int]  # txid -> size. least recently used first
+        self._disk_size = 0
+        if self.path:
+            make_dir(self.path)
+            self._load_disk_index()
+
+    def _filename(self, txid: str) -> str:
+        return os.path.join(self.path, txid[:2], txid)
+
+    def _load_disk_index(self) -> None:
+        files = []
+        for subdir in os.scandir(self.path):
+            if not subdir.is_dir():
+                continue
+            for entry in os.scandir(subdir.path):
+                if not is_hash256_str(entry.name) or not entry.is_file():
+                    continue
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, txid, size in sorted(files):
+            self._disk_index[txid] = size
+            self._disk_size += size
+        self._evict_from_disk()
+
+    def _evict_from_disk(self) -> None:
+        while self._disk_size > self.max_disk_size and self._disk_index:
+            txid, size = self._disk_index.popitem(last=False)
+            self._disk_size -= size
+            self._delete_file(txid)
+
+    def _delete_file(self, txid: str) -> None:
+        try:
+            os.unlink(self._filename(txid))
+        except FileNotFoundError:
+            pass
+
+    def get(self, txid: str) -> Optional[str]:
+        """Returns the raw tx (hex) with the given txid, if cached."""
+        with self._lock:
+            raw_tx = self._mem_cache.get(txid)
+            if raw_tx is not None:
+                return raw_tx.hex()
+            if txid not in self._disk_index:
+                return None
+            self._disk_index.move_to_end(txid)
+        filename = self._filename(txid)
+        try:
+            with open(filename, 'rb') as f:
+                raw_tx = f.read()
+            os.utime(filename)  # so that the order survives restarts
+        except OSError as e:
+            self.logger.info(f"cannot read cached tx {txid}: {e!r}")
+            raw_tx = None
+        with self._lock:
+            if raw_tx is None or not _is_raw_tx_for_txid(raw_tx, txid):
+                if raw_tx is not None:
+                    self.logger.warning(f"cached tx does not match its txid. deleting it. {txid}")
+                self._disk_size -= self._disk_index.pop(txid, 0)
+                self._delete_file(txid)
+                return None
+            self._mem_cache[txid] = raw_tx
+        return raw_tx.hex()
+
+    def put(self, txid: str, raw_tx: str, *, persist: bool = True, check_txid: bool = True) -> None:
+        """Adds a raw tx (hex) to the cache. It is written to disk only if persist is True.
+        check_txid can be set to False if raw_tx was already checked against txid,
+        e.g. by the Interface.
+        """
+        raw_tx = bytes.fromhex(raw_tx)
+        if check_txid and not _is_raw_tx_for_txid(raw_tx, txid):
+            raise ValueError(f"raw tx does not match txid {txid}")
+        with self._lock:
+            self._mem_cache[txid] = raw_tx
+            if not persist or not self.path or txid in self._disk_index or len(raw_tx) > self.max_disk_size:
+                return
+            filename = self._filename(txid)
+            make_dir(os.path.dirname(filename))
+            tmp_filename = filename + '.tmp'
+            with open(tmp_filename, 'wb') as f:
+                f.write(raw_tx)
+            os.replace(tmp_filename, filename)
+            self._disk_index[txid] = len(raw_tx)
+            self._disk_size += len(raw_tx)
+            self._evict_from_disk()
+
+    def __contains__(self, txid: str) -> bool:
+        with self._lock:
+            return txid in self._mem_cache or txid in self._disk_index
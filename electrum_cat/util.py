@@ -1456,6 +1456,7 @@ class NetworkJobOnDefaultServer(Logger, ABC):
         server connection changes.
         """
         self.taskgroup = OldTaskGroup()
+        self._wakeup_event = asyncio.Event()
         self.reset_request_counters()
 
     async def _start(self, interface: 'Interface'):
@@ -1501,6 +1502,14 @@ class NetworkJobOnDefaultServer(Logger, ABC):
             self._reset()
             await self._start(interface)
 
+    def wakeup(self) -> None:
+        """Tells the job there might be something new for it to do. Can be called from any thread."""
+        self.network.asyncio_loop.call_soon_threadsafe(self._wakeup_event.set)
+
+    async def _wait_for_wakeup(self) -> None:
+        await self._wakeup_event.wait()
+        self._wakeup_event.clear()
+
     def reset_request_counters(self):
         self._requests_sent = 0
         self._requests_answered = 0
@@ -1619,6 +1628,34 @@ def create_and_start_event_loop() -> Tuple[asyncio.AbstractEventLoop,
     return loop, stopping_fut, loop_thread
 
 
+class LRUCache(OrderedDict):
+    """A dict that holds at most maxsize items.
+    When full, the least recently used (get or set) item is evicted.
+    """
+
+    def __init__(self, *, maxsize: int):
+        assert maxsize > 0, maxsize
+        super().__init__()
+        self.maxsize = maxsize
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        self.move_to_end(key)
+        return value
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.move_to_end(key)
+        while len(self) > self.maxsize:
+            self.popitem(last=False)
+
+
 class OrderedDictWithIndex(OrderedDict):
     """An OrderedDict that keeps track of the positions of keys.
 
@@ -2088,6 +2125,54 @@ def truncate_text(text: str, *, max_len: Optional[int]) -> str:
         return text[:max_len] + f"... (truncated. orig_len={len(text)})"
 
 
+_worker_processes_enabled = False
+_worker_pool = None  # type: Optional[ProcessPoolExecutor]
+_worker_pool_num_workers = 0  # 0 until the pool is set up
+_worker_pool_lock = threading.Lock()
+
+
+def enable_worker_processes() -> None:
+    """Lets get_worker_pool use processes. To be called by the entry point of the application,
+    under `if __name__ == '__main__'`: spawned workers import the main module again.
+    Frozen builds must also call multiprocessing.freeze_support() there.
+    """
+    global _worker_processes_enabled
+    _worker_processes_enabled = True
+
+
+def get_worker_pool() -> Tuple[Optional[ProcessPoolExecutor], int]:
+    """Returns the pool of worker processes shared by CPU-bound jobs (e.g. PoW hashing),
+    and its number of workers. The pool is None if processes are not enabled (see
+    enable_worker_processes), or cannot be used, e.g. on Android.
+    Workers are spawned, not forked, as forking a process that runs threads is unsafe.
+    """
+    global _worker_pool, _worker_pool_num_workers
+    if not _worker_processes_enabled:
+        return None, 1
+    with _worker_pool_lock:
+        if _worker_pool_num_workers == 0:
+            try:
+                import multiprocessing  # not available on Android, so we import it here
+                num_workers = max(multiprocessing.cpu_count() - 1, 1)  # use all but one CPU
+                _worker_pool = ProcessPoolExecutor(
+                    max_workers=num_workers, mp_context=multiprocessing.get_context('spawn'))
+            except (ImportError, NotImplementedError, OSError, ValueError) as e:
+                _logger.info(f"cannot use worker processes: {e!r}")
+                num_workers = 1
+            _worker_pool_num_workers = num_workers
+        return _worker_pool, _worker_pool_num_workers
+
+
+def shutdown_worker_pool() -> None:
+    """Stops the worker processes. The pool is set up again if needed."""
+    global _worker_pool, _worker_pool_num_workers
+    with _worker_pool_lock:
+        if _worker_pool is not None:
+            _worker_pool.shutdown(wait=False, cancel_futures=True)
+            _worker_pool = None
+        _worker_pool_num_workers = 0
+
+
 def nostr_pow_worker(nonce, nostr_pubk, target_bits, hash_function, hash_len_bits, shutdown):
     """Function to generate PoW for Nostr, to be spawned in a ProcessPoolExecutor."""
     hash_preimage = b'electrum-' + nostr_pubk
@@ -70,7 +70,13 @@ class SPV(NetworkJobOnDefaultServer):
         while True:
             await self._maybe_undo_verifications()
             await self._request_proofs()
-            await asyncio.sleep(0.1)
+            # woken up by new unverified txs, and new headers
+            await self._wait_for_wakeup()
+
+    def _sync_state_changed(self):
+        # the wallet might have become up to date
+        if synchronizer := self.wallet.synchronizer:
+            synchronizer.wakeup()
 
     async def _request_proofs(self):
         local_height = self.blockchain.height()
@@ -88,13 +94,17 @@ class SPV(NetworkJobOnDefaultServer):
             if header is None:
                 if tx_height < constants.net.max_checkpoint():
                     # FIXME these requests are not counted (self._requests_sent += 1)
-                    await self.taskgroup.spawn(self.interface.request_chunk(tx_height, None, can_return_early=True))
+                    await self.taskgroup.spawn(self._request_chunk(tx_height))
                 continue
             # request now
             self.logger.info(f'requested merkle {tx_hash}')
             self.requested_merkle.add(tx_hash)
             await self.taskgroup.spawn(self._request_and_verify_single_proof, tx_hash, tx_height)
 
+    async def _request_chunk(self, height):
+        await self.interface.request_chunk(height, None, can_return_early=True)
+        self.wakeup()
+
     async def _request_and_verify_single_proof(self, tx_hash, tx_height):
         try:
             self._requests_sent += 1
@@ -104,6 +114,7 @@ class SPV(NetworkJobOnDefaultServer):
             self.logger.info(f'tx {tx_hash} not at height {tx_height}')
             self.wallet.remove_unverified_tx(tx_hash, tx_height)
             self.requested_merkle.discard(tx_hash)
+            self._sync_state_changed()
             return
         finally:
             self._requests_answered += 1
@@ -136,6 +147,7 @@ class SPV(NetworkJobOnDefaultServer):
                               txpos=pos,
                               header_hash=header_hash)
         self.wallet.add_verified_tx(tx_hash, tx_info)
+        self._sync_state_changed()
 
     @classmethod
     def hash_merkle_root(cls, merkle_branch: Sequence[str], tx_hash: str, leaf_pos_in_tree: int):
@@ -189,6 +201,7 @@ class SPV(NetworkJobOnDefaultServer):
     def remove_spv_proof_for_tx(self, tx_hash):
         self.merkle_roots.pop(tx_hash, None)
         self.requested_merkle.discard(tx_hash)
+        self.wakeup()
 
     def is_up_to_date(self):
         return (not self.requested_merkle
@@ -489,9 +489,9 @@ class Abstract_Wallet(ABC, Logger, EventListener):
             #       have history that are mined and SPV-verified.
             await run_in_thread(self.synchronize)
 
-    def save_db(self):
+    def save_db(self, *, consolidate: bool = False):
         if self.db.storage:
-            self.db.write()
+            self.db.write(consolidate=consolidate)
 
     def save_backup(self, backup_dir):
         new_path = os.path.join(backup_dir, self.basename() + '.backup')
@@ -566,7 +566,9 @@ class Abstract_Wallet(ABC, Logger, EventListener):
         finally:  # even if we get cancelled
             if any([ks.is_requesting_to_be_rewritten_to_wallet_file for ks in self.get_keystores()]):
                 self.save_keystore()
-            self.save_db()
+            self.save_db(consolidate=True)
+            if self.storage:
+                self.storage.close()
 
     def is_up_to_date(self) -> bool:
         if self.taskgroup.joined:  # either stop() was called, or the taskgroup died
@@ -607,13 +609,24 @@ class Abstract_Wallet(ABC, Logger, EventListener):
     def on_event_adb_added_tx(self, adb, tx_hash: str, tx: Transaction):
         if self.adb != adb:
             return
-        if not self.tx_is_related(tx):
+        self._on_txs_added([(tx_hash, tx)])
+
+    @event_listener
+    def on_event_adb_added_txs(self, adb, txs: Sequence[Tuple[str, Transaction]]):
+        if self.adb != adb:
+            return
+        self._on_txs_added(txs)
+
+    def _on_txs_added(self, txs: Sequence[Tuple[str, Transaction]]) -> None:
+        txs = [(tx_hash, tx) for tx_hash, tx in txs if self.tx_is_related(tx)]
+        if not txs:
             return
         self.clear_tx_parents_cache()
-        if self.lnworker:
-            self.lnworker.maybe_add_backup_from_tx(tx)
-        self._update_invoices_and_reqs_touched_by_tx(tx_hash)
-        util.trigger_callback('new_transaction', self, tx)
+        for tx_hash, tx in txs:
+            if self.lnworker:
+                self.lnworker.maybe_add_backup_from_tx(tx)
+            self._update_invoices_and_reqs_touched_by_tx(tx_hash)
+            util.trigger_callback('new_transaction', self, tx)
 
     @event_listener
     def on_event_adb_removed_tx(self, adb, txid: str, tx: Transaction):
@@ -749,7 +762,7 @@ class Abstract_Wallet(ABC, Logger, EventListener):
         write_json_file(path, self.get_all_labels())
 
     def set_fiat_value(self, txid, ccy, text, fx, value_sat):
-        if not self.db.get_transaction(txid):
+        if not self.db.has_transaction(txid):
             return
         # since fx is inserting the thousands separator,
         # and not util, also have fx remove it
@@ -1139,16 +1152,7 @@ class Abstract_Wallet(ABC, Logger, EventListener):
         return cc, uu, xx, frozen, lightning - f_lightning, f_lightning
 
     def balance_at_timestamp(self, domain, target_timestamp):
-        # we assume that get_history returns items ordered by block height
-        # we also assume that block timestamps are monotonic (which is false...!)
-        h = self.adb.get_history(domain=domain)
-        balance = 0
-        for hist_item in h:
-            balance = hist_item.balance
-            if hist_item.tx_mined_status.timestamp is None or hist_item.tx_mined_status.timestamp > target_timestamp:
-                return balance - hist_item.delta
-        # return last balance
-        return balance
+        return self.adb.get_balance_at_timestamp(domain, target_timestamp)
 
     def get_onchain_history(
             self, *,
@@ -1156,7 +1160,12 @@ class Abstract_Wallet(ABC, Logger, EventListener):
             from_timestamp=None,
             to_timestamp=None,
             from_height=None,
-            to_height=None) -> Dict[str, OnchainHistoryItem]:
+            to_height=None,
+            after_txid=None,
+            limit=None) -> Dict[str, OnchainHistoryItem]:
+        """after_txid and limit can be used to get the history page by page,
+        in O(limit) instead of O(size of the history).
+        """
         # sanity check
         if (from_timestamp is not None or to_timestamp is not None) \
                 and (from_height is not None or to_height is not None):
@@ -1168,19 +1177,24 @@ class Abstract_Wallet(ABC, Logger, EventListener):
 
         now = time.time()
         transactions = OrderedDictWithIndex()
-        monotonic_timestamp = 0
-        for hist_item in self.adb.get_history(domain=domain):
+        filter_by_timestamp = from_timestamp is not None or to_timestamp is not None
+        try:
+            history = self.adb.get_history(
+                domain=domain,
+                from_height=from_height,
+                to_height=to_height,
+                after_txid=after_txid,
+                limit=None if filter_by_timestamp else limit)
+        except KeyError:
+            raise UserFacingException(f'unknown txid: {after_txid}') from None
+        for hist_item in history:
             timestamp = (hist_item.tx_mined_status.timestamp or TX_TIMESTAMP_INF)
-            height = hist_item.tx_mined_status
             if from_timestamp and (timestamp or now) < from_timestamp:
                 continue
             if to_timestamp and (timestamp or now) >= to_timestamp:
                 continue
-            if from_height is not None and from_height > height > 0:
-                continue
-            if to_height is not None and (height >= to_height or height <= 0):
-                continue
-            monotonic_timestamp = max(monotonic_timestamp, timestamp)
+            if limit is not None and len(transactions) >= limit:
+                break
             txid = hist_item.txid
             group_id = groups.get(txid)
             label = self.get_label_for_txid(txid)
@@ -1191,7 +1205,7 @@ class Abstract_Wallet(ABC, Logger, EventListener):
                 balance_sat=hist_item.balance,
                 tx_mined_status=hist_item.tx_mined_status,
                 label=label,
-                monotonic_timestamp=monotonic_timestamp,
+                monotonic_timestamp=hist_item.monotonic_timestamp,
                 group_id=group_id,
             )
             transactions[hist_item.txid] = tx_item
@@ -3700,6 +3714,7 @@ class Deterministic_Wallet(Abstract_Wallet):
         if value >= self.min_acceptable_gap():
             self.gap_limit = value
             self.db.put('gap_limit', self.gap_limit)
+            self.synchronize()
             self.save_db()
             return True
         else:
@@ -3731,11 +3746,19 @@ class Deterministic_Wallet(Abstract_Wallet):
     def derive_pubkeys(self, c: int, i: int) -> Sequence[str]:
         pass
 
+    def derive_pubkeys_range(self, c: int, start: int, stop: int) -> Sequence[Sequence[str]]:
+        return [self.derive_pubkeys(c, i) for i in range(start, stop)]
+
     def derive_address(self, for_change: int, n: int) -> str:
         for_change = int(for_change)
         pubkeys = self.derive_pubkeys(for_change, n)
         return self.pubkeys_to_address(pubkeys)
 
+    def derive_addresses(self, for_change: int, start: int, stop: int) -> Sequence[str]:
+        for_change = int(for_change)
+        return [self.pubkeys_to_address(pubkeys)
+                for pubkeys in self.derive_pubkeys_range(for_change, start, stop)]
+
     def export_private_key_for_path(self, path: Union[Sequence[int], str], password: Optional[str]) -> str:
         if isinstance(path, str):
             path = convert_bip32_strpath_to_intpath(path)
@@ -3760,16 +3783,20 @@ class Deterministic_Wallet(Abstract_Wallet):
             txinout.bip32_paths[pubkey] = (fp_bytes, der_full)
 
     def create_new_address(self, for_change: bool = False):
+        return self.create_new_addresses(for_change, 1)[0]
+
+    def create_new_addresses(self, for_change: bool, num_addresses: int) -> Sequence[str]:
         assert type(for_change) is bool
         with self.lock:
             n = self.db.num_change_addresses() if for_change else self.db.num_receiving_addresses()
-            address = self.derive_address(int(for_change), n)
-            self.db.add_change_address(address) if for_change else self.db.add_receiving_address(address)
-            self.adb.add_address(address)
-            if for_change:
-                # note: if it's actually "old", it will get filtered later
-                self._not_old_change_addresses.append(address)
-            return address
+            addresses = self.derive_addresses(int(for_change), n, n + num_addresses)
+            for address in addresses:
+                self.db.add_change_address(address) if for_change else self.db.add_receiving_address(address)
+                self.adb.add_address(address)
+                if for_change:
+                    # note: if it's actually "old", it will get filtered later
+                    self._not_old_change_addresses.append(address)
+            return addresses
 
     def synchronize_sequence(self, for_change: bool) -> int:
         count = 0  # num new addresses we generated
@@ -3777,18 +3804,19 @@ class Deterministic_Wallet(Abstract_Wallet):
         while True:
             num_addr = self.db.num_change_addresses() if for_change else self.db.num_receiving_addresses()
             if num_addr < limit:
-                count += 1
-                self.create_new_address(for_change)
-                continue
-            if for_change:
-                last_few_addresses = self.get_change_addresses(slice_start=-limit)
-            else:
-                last_few_addresses = self.get_receiving_addresses(slice_start=-limit)
-            if any(map(self.adb.address_is_old, last_few_addresses)):
-                count += 1
-                self.create_new_address(for_change)
+                num_new = limit - num_addr
             else:
-                break
+                if for_change:
+                    last_few_addresses = self.get_change_addresses(slice_start=-limit)
+                else:
+                    last_few_addresses = self.get_receiving_addresses(slice_start=-limit)
+                # we need limit unused addresses after the last old one
+                num_new = next((limit - i for i, addr in enumerate(reversed(last_few_addresses))
+                                if self.adb.address_is_old(addr)), 0)
+                if not num_new:
+                    break
+            count += num_new
+            self.create_new_addresses(for_change, num_new)
         return count
 
     def synchronize(self):
@@ -3877,6 +3905,9 @@ class Standard_Wallet(Simple_Wallet, Deterministic_Wallet):
     def derive_pubkeys(self, c, i):
         return [self.keystore.derive_pubkey(c, i).hex()]
 
+    def derive_pubkeys_range(self, c, start, stop):
+        return [[pubkey.hex()] for pubkey in self.keystore.derive_pubkey_range(c, start, stop)]
+
     def pubkeys_to_address(self, pubkeys):
         pubkey = pubkeys[0]
         return bitcoin.pubkey_to_address(self.txin_type, pubkey)
@@ -3919,6 +3950,10 @@ class Multisig_Wallet(Deterministic_Wallet):
     def derive_pubkeys(self, c, i):
         return [k.derive_pubkey(c, i).hex() for k in self.get_keystores()]
 
+    def derive_pubkeys_range(self, c, start, stop):
+        pubkeys_per_keystore = [k.derive_pubkey_range(c, start, stop) for k in self.get_keystores()]
+        return [[pubkey.hex() for pubkey in pubkeys] for pubkeys in zip(*pubkeys_per_keystore)]
+
     def load_keystore(self):
         self.keystores = {}
         for i in range(self.n):
@@ -37,7 +37,7 @@ from functools import partial
 import attr
 
 from . import util, bitcoin
-from .util import profiler, WalletFileException, multisig_type, TxMinedInfo, bfh, MyEncoder
+from .util import profiler, WalletFileException, multisig_type, TxMinedInfo, bfh, MyEncoder, LRUCache
 from .invoices import Invoice, Request
 from .keystore import bip44_derivation
 from .transaction import Transaction, TxOutpoint, tx_from_any, PartialTransaction, PartialTxOutput, BadHeaderMagic
@@ -98,6 +98,57 @@ class DBMetadata(StoredObject):
         return f"using {ver}, on {date_str}"
 
 
+class StoredTx:
+    """A transaction, as kept in WalletDB.transactions.
+
+    Complete transactions are kept as raw bytes, PSBTs as text.
+    The txid and the outputs are kept next to it once computed, so that
+    the transaction does not need to be deserialized to read them (the
+    number of inputs is kept in tx_fees). Transaction objects are created on
+    demand, see WalletDB.get_transaction.
+    """
+
+    __slots__ = ('raw', '_txid', '_outputs')
+
+    def __init__(self, raw: Union[str, bytes], *, tx: Transaction = None):
+        if isinstance(raw, str):
+            try:
+                raw = bytes.fromhex(raw)
+            except ValueError:
+                pass  # base64 psbt
+        self.raw = raw  # type: Union[str, bytes]
+        self._txid = None  # type: Optional[str]
+        self._outputs = None  # type: Optional[Tuple[Tuple[bytes, int], ...]]
+        if tx is not None:
+            self._set_fields(tx)
+
+    def _set_fields(self, tx: Transaction) -> None:
+        self._txid = tx.txid()
+        self._outputs = tuple((o.scriptpubkey, o.value) for o in tx.outputs())
+
+    def _load_fields(self) -> None:
+        if self._outputs is None:
+            self._set_fields(self.to_tx())
+
+    def to_tx(self) -> Transaction:
+        return tx_from_any(self.raw, deserialize=False)
+
+    def is_partial(self) -> bool:
+        return isinstance(self.raw, str) or self.raw[0:5] == b'psbt\xff'
+
+    def txid(self) -> Optional[str]:
+        self._load_fields()
+        return self._txid
+
+    def outputs(self) -> Sequence[Tuple[bytes, int]]:
+        """Returns the (scriptpubkey, value) of the outputs."""
+        self._load_fields()
+        return self._outputs
+
+    def to_json(self) -> str:
+        return self.raw.hex() if isinstance(self.raw, bytes) else self.raw
+
+
 # note: subclassing WalletFileException for some specific cases
 #       allows the crash reporter to distinguish them and open
 #       separate tracking issues
@@ -105,7 +156,7 @@ class WalletFileExceptionVersion51(WalletFileException): pass
 
 
 # register dicts that require value conversions not handled by constructor
-json_db.register_dict('transactions', lambda x: tx_from_any(x, deserialize=False), None)
+json_db.register_dict('transactions', StoredTx, None)
 json_db.register_dict('data_loss_protect_remote_pcp', lambda x: bytes.fromhex(x), None)
 json_db.register_dict('contacts', tuple, None)
 # register dicts that require key conversion
@@ -1281,6 +1332,13 @@ def upgrade_wallet_db(data: dict, do_upgrade: bool) -> Tuple[dict, bool]:
 
 class WalletDB(JsonDB):
 
+    LAZY_KEYS = (
+        'transactions', 'txi', 'txo', 'spent_outpoints', 'prevouts_by_scripthash',
+        'verified_tx3', 'tx_fees', 'addr_history', 'channels',
+    )
+    # max number of deserialized transactions kept in memory
+    TX_CACHE_SIZE = 1000
+
     def __init__(
         self,
         s: str,
@@ -1288,6 +1346,10 @@ class WalletDB(JsonDB):
         storage: Optional['WalletStorage'] = None,
         upgrade: bool = False,
     ):
+        self._tx_cache = LRUCache(maxsize=self.TX_CACHE_SIZE)  # type: LRUCache[str, Transaction]
+        # address table, not persisted: filled when addresses are created, and lazily for loaded ones
+        self._address_scripts = {}  # type: Dict[str, Tuple[bytes, str]]  # address -> (scriptpubkey, scripthash)
+        self._script_to_address = {}  # type: Dict[bytes, str]
         JsonDB.__init__(self, s, storage=storage, encoder=MyEncoder, upgrader=partial(upgrade_wallet_db, do_upgrade=upgrade))
         # create pointers
         self.load_transactions()
@@ -1440,28 +1502,55 @@ class WalletDB(JsonDB):
         assert isinstance(tx_hash, str)
         assert isinstance(tx, Transaction), tx
         # note that tx might be a PartialTransaction
-        # serialize and de-serialize tx now. this might e.g. convert a complete PartialTx to a Tx
-        tx = tx_from_any(str(tx))
+        # serialize and de-serialize it now. this might e.g. convert a complete PartialTx to a Tx
+        if isinstance(tx, PartialTransaction):
+            tx = tx_from_any(str(tx))
         if not tx_hash:
             raise Exception("trying to add tx to db without txid")
         if tx_hash != tx.txid():
             raise Exception(f"trying to add tx to db with inconsistent txid: {tx_hash} != {tx.txid()}")
         # don't allow overwriting complete tx with partial tx
         tx_we_already_have = self.transactions.get(tx_hash, None)
-        if tx_we_already_have is None or isinstance(tx_we_already_have, PartialTransaction):
-            self.transactions[tx_hash] = tx
+        if tx_we_already_have is None or tx_we_already_have.is_partial():
+            self.transactions[tx_hash] = StoredTx(tx.serialize(), tx=tx)
+            self._tx_cache.pop(tx_hash, None)  # tx might be modified by the caller
 
     @modifier
     def remove_transaction(self, tx_hash: str) -> Optional[Transaction]:
         assert isinstance(tx_hash, str)
-        return self.transactions.pop(tx_hash, None)
+        stored_tx = self.transactions.pop(tx_hash, None)
+        tx = self._tx_cache.pop(tx_hash, None)
+        if stored_tx is None:
+            return None
+        return tx or stored_tx.to_tx()
 
     @locked
     def get_transaction(self, tx_hash: Optional[str]) -> Optional[Transaction]:
         if tx_hash is None:
             return None
         assert isinstance(tx_hash, str)
-        return self.transactions.get(tx_hash)
+        tx = self._tx_cache.get(tx_hash)
+        if tx is None:
+            stored_tx = self.transactions.get(tx_hash)
+            if stored_tx is None:
+                return None
+            tx = stored_tx.to_tx()
+            self._tx_cache[tx_hash] = tx
+        return tx
+
+    @locked
+    def has_transaction(self, tx_hash: str) -> bool:
+        assert isinstance(tx_hash, str)
+        return tx_hash in self.transactions
+
+    @locked
+    def get_tx_outputs(self, tx_hash: str) -> Optional[Sequence[Tuple[bytes, int]]]:
+        """Returns the (scriptpubkey, value) of the outputs of a tx, without deserializing it."""
+        assert isinstance(tx_hash, str)
+        stored_tx = self.transactions.get(tx_hash)
+        if stored_tx is None:
+            return None
+        return stored_tx.outputs()
 
     @locked
     def list_transactions(self) -> Sequence[str]:
@@ -1604,12 +1693,14 @@ class WalletDB(JsonDB):
         assert isinstance(addr, str)
         self._addr_to_addr_index[addr] = (1, len(self.change_addresses))
         self.change_addresses.append(addr)
+        self._add_to_address_table(addr)
 
     @modifier
     def add_receiving_address(self, addr: str) -> None:
         assert isinstance(addr, str)
         self._addr_to_addr_index[addr] = (0, len(self.receiving_addresses))
         self.receiving_addresses.append(addr)
+        self._add_to_address_table(addr)
 
     @locked
     def get_address_index(self, address: str) -> Optional[Sequence[int]]:
@@ -1620,11 +1711,49 @@ class WalletDB(JsonDB):
     def add_imported_address(self, addr: str, d: dict) -> None:
         assert isinstance(addr, str)
         self.imported_addresses[addr] = d
+        self._add_to_address_table(addr)
 
     @modifier
     def remove_imported_address(self, addr: str) -> None:
         assert isinstance(addr, str)
         self.imported_addresses.pop(addr)
+        self._remove_from_address_table(addr)
+
+    def _add_to_address_table(self, addr: str) -> Tuple[bytes, str]:
+        scriptpubkey = bitcoin.address_to_script(addr)
+        scripthash = bitcoin.script_to_scripthash(scriptpubkey)
+        self._address_scripts[addr] = scriptpubkey, scripthash
+        self._script_to_address[scriptpubkey] = addr
+        return scriptpubkey, scripthash
+
+    def _remove_from_address_table(self, addr: str) -> None:
+        item = self._address_scripts.pop(addr, None)
+        if item is not None:
+            scriptpubkey, scripthash = item
+            self._script_to_address.pop(scriptpubkey, None)
+
+    @locked
+    def get_address_scripthash(self, addr: str) -> str:
+        """Returns the scripthash of addr, hashing it only the first time."""
+        assert isinstance(addr, str)
+        item = self._address_scripts.get(addr)
+        if item is None:
+            item = self._add_to_address_table(addr)
+        return item[1]
+
+    @locked
+    def get_scripthashes_for_scripts(self, scriptpubkeys: Sequence[bytes]) -> List[str]:
+        """Returns the scripthashes of scriptpubkeys, e.g. of the outputs of a tx.
+        The ones of known addresses are not hashed again.
+        """
+        scripthashes = []
+        for scriptpubkey in scriptpubkeys:
+            addr = self._script_to_address.get(scriptpubkey)
+            if addr is not None:
+                scripthashes.append(self._address_scripts[addr][1])
+            else:
+                scripthashes.append(bitcoin.script_to_scripthash(scriptpubkey))
+        return scripthashes
 
     @locked
     def has_imported_address(self, addr: str) -> bool:
@@ -1665,7 +1794,7 @@ class WalletDB(JsonDB):
         self.txi = self.get_dict('txi')                          # type: Dict[str, Dict[str, Dict[str, int]]]
         # txid -> address -> output_index -> (value, is_coinbase)
         self.txo = self.get_dict('txo')                          # type: Dict[str, Dict[str, Dict[str, Tuple[int, bool]]]]
-        self.transactions = self.get_dict('transactions')        # type: Dict[str, Transaction]
+        self.transactions = self.get_dict('transactions')        # type: Dict[str, StoredTx]
         self.spent_outpoints = self.get_dict('spent_outpoints')  # txid -> output_index -> next_txid
         self.history = self.get_dict('addr_history')             # address -> list of (txid, height)
         self.verified_tx = self.get_dict('verified_tx3')         # txid -> (height, timestamp, txpos, header_hash)
@@ -1691,11 +1820,16 @@ class WalletDB(JsonDB):
         self.txo.clear()
         self.spent_outpoints.clear()
         self.transactions.clear()
+        self._tx_cache.clear()
         self.history.clear()
         self.verified_tx.clear()
         self.tx_fees.clear()
         self._prevouts_by_scripthash.clear()
 
+    def _can_load_lazily(self, data: dict) -> bool:
+        # the upgrader needs the decoded data
+        return data.get('seed_version') == FINAL_SEED_VERSION
+
     def _should_convert_to_stored_dict(self, key) -> bool:
         if key == 'keystore':
             return False
@@ -28,6 +28,7 @@ from electrum_cat.crypto import sha256d, SUPPORTED_PW_HASH_VERSIONS
 from electrum_cat import crypto, constants, bitcoin
 from electrum_cat.util import bfh, InvalidPassword, randrange
 from electrum_cat.storage import WalletStorage
+from electrum_cat import keystore
 from electrum_cat.keystore import xtype_from_derivation
 
 from . import ElectrumTestCase
@@ -745,6 +746,25 @@ class Test_xprv_xpub(ElectrumTestCase):
         self.assertEqual("xpub6BJA1jSqiukeaesWfxe6sNK9CCGaujFFSJLomWHprUL9DePQ4JDkM5d88n49sMGJxrhpjazuXYWdMf17C9T5XnxkopaeS7jGk1GyyVziaMt", xpub)
         self.assertEqual("xprv9xJocDuwtYCMNAo3Zw76WENQeAS6WGXQ55RCy7tDJ8oALr4FWkuVoHJeHVAcAqiZLE7Je3vZJHxspZdFHfnBEjHqU5hG1Jaj32dVoS6XLT1", xprv)
 
+    def test_derive_child_pubkeys(self):
+        node = BIP32Node.from_rootseed(bfh("000102030405060708090a0b0c0d0e0f"), xtype='standard')
+        node = node.subkey_at_private_derivation("m/0h").convert_to_public()
+        expected = [node.subkey_at_public_derivation([n]).eckey.get_public_key_bytes() for n in range(100, 130)]
+        self.assertEqual(expected, node.derive_child_pubkeys(range(100, 130)))
+        with self.assertRaises(Exception):
+            node.derive_child_pubkeys([bip32.BIP32_PRIME])
+
+    def test_keystore_derive_pubkey_range(self):
+        node = BIP32Node.from_rootseed(bfh("000102030405060708090a0b0c0d0e0f"), xtype='standard')
+        ks = keystore.from_xpub(node.subkey_at_private_derivation("m/0h").to_xpub())
+        pubkey5 = ks.derive_pubkey(1, 5)
+        pubkeys = ks.derive_pubkey_range(1, 0, 10)
+        self.assertEqual([ks.get_pubkey_from_xpub(ks.xpub_change, (n,)) for n in range(10)], pubkeys)
+        self.assertIs(pubkey5, pubkeys[5])
+        # derived once, shared with derive_pubkey
+        self.assertIs(pubkeys[7], ks.derive_pubkey(1, 7))
+        self.assertNotEqual(pubkeys, ks.derive_pubkey_range(0, 0, 10))
+
     def test_xpub_from_xprv(self):
         """We can derive the xpub key from a xprv."""
         for xprv_details in self.xprv_xpub:
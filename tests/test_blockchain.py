@@ -1,8 +1,12 @@
+import random
 import shutil
 import tempfile
 import os
+from unittest import mock
 
-from electrum_cat import constants, blockchain
+from electrum_ecc import ECPrivkey
+
+from electrum_cat import constants, blockchain, bitcoin, util
 from electrum_cat.simple_config import SimpleConfig
 from electrum_cat.blockchain import Blockchain, deserialize_header, hash_header, InvalidHeader
 from electrum_cat.util import bfh, make_dir
@@ -384,6 +388,32 @@ class TestBlockchain(ElectrumTestCase):
         self.assertEqual([chain_u], self.get_chains_that_contain_header_helper(self.HEADERS['O']))
         self.assertEqual([chain_z, chain_l], self.get_chains_that_contain_header_helper(self.HEADERS['I']))
 
+    def test_read_header_after_writes(self):
+        blockchain.blockchains[constants.net.GENESIS] = chain_u = Blockchain(
+            config=self.config, forkpoint=0, parent=None,
+            forkpoint_hash=constants.net.GENESIS, prev_hash=None)
+        open(chain_u.path(), 'w+').close()
+        self.assertEqual(None, chain_u.read_header(0))
+        for name in 'ABCDEF':
+            chain_u.save_header(self.HEADERS[name])
+        for name in 'ABCDEF':
+            self.assertEqual(self.HEADERS[name], chain_u.read_header(self.HEADERS[name]['block_height']))
+        # modifying a returned header must not affect later reads
+        chain_u.read_header(5)['nonce'] = 42
+        self.assertEqual(self.HEADERS['F'], chain_u.read_header(5))
+        # overwrite the tip, and truncate
+        chain_u.write(blockchain.serialize_header(self.HEADERS['G']), 5 * blockchain.HEADER_SIZE)
+        self.assertEqual(5, chain_u.height())
+        self.assertEqual(dict(self.HEADERS['G'], block_height=5), chain_u.read_header(5))
+        chain_u.write(b'', 3 * blockchain.HEADER_SIZE)
+        self.assertEqual(2, chain_u.height())
+        self.assertEqual(None, chain_u.read_header(3))
+        self.assertEqual(self.HEADERS['C'], chain_u.read_header(2))
+        chain_u.close_headers_file()
+        os.unlink(chain_u.path())
+        chain_u.update_size()
+        self.assertEqual(-1, chain_u.height())
+
     def test_target_to_bits(self):
         # https://github.com/bitcoin/bitcoin/blob/7fcf53f7b4524572d1d0c9a5fdc388e87eb02416/src/arith_uint256.h#L269
         self.assertEqual(0x05123456, Blockchain.target_to_bits(0x1234560000))
@@ -426,6 +456,195 @@ class TestBlockchain(ElectrumTestCase):
             Blockchain.bits_to_target(0xff123456)
 
 
+class TestChainworkIndex(ElectrumTestCase):
+
+    def setUp(self):
+        super().setUp()
+        make_dir(os.path.join(self.electrum_path, 'forks'))
+        self.config = SimpleConfig({'electrum_path': self.electrum_path})
+        blockchain.blockchains = {}
+
+    @staticmethod
+    def _make_headers(first_height: int, prev_hash: str, bits: int, count: int, *, nonce: int = 0) -> list:
+        headers = []
+        for height in range(first_height, first_height + count):
+            header = {'version': 1, 'prev_block_hash': prev_hash, 'merkle_root': '00' * 32,
+                      'timestamp': 1_700_000_000 + height, 'bits': bits, 'nonce': nonce, 'block_height': height}
+            prev_hash = hash_header(header)
+            headers.append(header)
+        return headers
+
+    def test_chainwork_follows_appends_and_swaps(self):
+        cp = constants.net.max_checkpoint()
+        base = blockchain._chainwork_in_checkpoint_region(cp)
+        work = blockchain.chainwork_of_target(Blockchain.bits_to_target(0x1d00ffff))
+        blockchain.blockchains[constants.net.GENESIS] = chain_u = Blockchain(
+            config=self.config, forkpoint=0, parent=None,
+            forkpoint_hash=constants.net.GENESIS, prev_hash=None)
+        blockchain.init_headers_file_for_best_chain()
+        headers_u = self._make_headers(cp + 1, chain_u.get_hash(cp), 0x1d00ffff, 5)
+        for header in headers_u:
+            chain_u.save_header(header)
+        self.assertEqual(base, chain_u.get_chainwork(cp))
+        self.assertEqual(base + 5 * work, chain_u.get_chainwork())
+        self.assertEqual(base + 2 * work, chain_u.get_chainwork(cp + 2))
+        # fork that becomes stronger than its parent
+        headers_f = self._make_headers(cp + 3, hash_header(headers_u[1]), 0x1d00ffff, 4, nonce=1)
+        chain_f = Blockchain(config=self.config, forkpoint=cp + 3, parent=chain_u,
+                             forkpoint_hash=hash_header(headers_f[0]), prev_hash=hash_header(headers_u[1]))
+        open(chain_f.path(), 'w+').close()
+        for header in headers_f[:3]:
+            chain_f.save_header(header)
+        self.assertEqual(chain_u, chain_f.parent)
+        self.assertEqual(base + 5 * work, chain_f.get_chainwork())
+        chain_f.save_header(headers_f[3])
+        self.assertEqual(chain_f, chain_u.parent)
+        self.assertEqual(base + 6 * work, chain_f.get_chainwork())
+        self.assertEqual(base + 5 * work, chain_u.get_chainwork())
+        # the index files stay open
+        with mock.patch.object(blockchain, 'open', side_effect=AssertionError, create=True):
+            self.assertEqual(base + 6 * work, chain_f.get_chainwork())
+            self.assertEqual(base + 2 * work, chain_u.get_chainwork(cp + 2))
+        # rebuilding the indexes from scratch gives the same results
+        for chain in (chain_u, chain_f):
+            chain.close_headers_file()
+            os.unlink(chain.chainwork_index_path())
+        self.assertEqual(base + 6 * work, chain_f.get_chainwork())
+        self.assertEqual(base + 5 * work, chain_u.get_chainwork())
+        self.assertEqual(work, chain_u.chainwork_of_header_at_height(cp + 4))
+
+
+class TestLWMAState(ElectrumTestCase):
+
+    @staticmethod
+    def _lwma_reference(window: list) -> int:
+        # straightforward LWMA, over the N+1 headers of the window
+        T = constants.net.POW_TARGET_SPACING
+        N = constants.net.LWMA_AVERAGING_WINDOW
+        k = N * (N + 1) * T // 2
+        sum_weighted_solvetimes = 0
+        avg_target = 0
+        previous_timestamp = window[0]['timestamp']
+        for j, block in enumerate(window[1:], start=1):
+            this_timestamp = block['timestamp'] if block['timestamp'] > previous_timestamp else previous_timestamp + 1
+            solvetime = min(6 * T, this_timestamp - previous_timestamp)
+            previous_timestamp = this_timestamp
+            sum_weighted_solvetimes += solvetime * j
+            avg_target += Blockchain.bits_to_target(block['bits']) // N // k
+        return min(blockchain.MAX_TARGET, avg_target * sum_weighted_solvetimes)
+
+    def test_append_matches_full_calculation(self):
+        N = constants.net.LWMA_AVERAGING_WINDOW
+        rng = random.Random(42)
+        headers = []
+        prev_hash = '00' * 32
+        timestamp = 1_600_000_000
+        for height in range(3 * N):
+            # mostly increasing timestamps, with some going backwards
+            timestamp += rng.randint(-300, 2400)
+            bits = Blockchain.target_to_bits(rng.randint(blockchain.MAX_TARGET // 1000, blockchain.MAX_TARGET))
+            header = {'version': 1, 'prev_block_hash': prev_hash, 'merkle_root': '00' * 32,
+                      'timestamp': timestamp, 'bits': bits, 'nonce': 0, 'block_height': height}
+            prev_hash = hash_header(header)
+            headers.append(header)
+        state = blockchain.LWMAState(headers[:N + 1])
+        self.assertEqual(self._lwma_reference(headers[:N + 1]), state.get_next_target())
+        for height in range(N + 1, len(headers)):
+            state.append(headers[height])
+            self.assertEqual(height, state.height)
+            self.assertEqual(self._lwma_reference(headers[height - N:height + 1]), state.get_next_target())
+        with self.assertRaises(AssertionError):
+            state.append(headers[5])
+
+
+class TestHeadersSnapshot(ElectrumTestCase):
+
+    EASY_BITS = 0x207fffff  # about every other nonce is a valid PoW
+    NUM_HEADERS_AFTER_CP = 20
+
+    def setUp(self):
+        super().setUp()
+        make_dir(os.path.join(self.electrum_path, 'forks'))
+        blockchain.blockchains = {}
+        max_target = Blockchain.bits_to_target(self.EASY_BITS)
+        patcher = mock.patch.object(blockchain, 'MAX_TARGET', max_target)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # one checkpointed chunk, followed by headers retargeted with LWMA
+        headers = []
+        prev_hash = '00' * 32
+        for height in range(2016 + self.NUM_HEADERS_AFTER_CP):
+            header = {'version': 1, 'prev_block_hash': prev_hash, 'merkle_root': '00' * 32,
+                      'timestamp': 1_700_000_000 + 600 * height, 'bits': self.EASY_BITS, 'nonce': 0,
+                      'block_height': height}
+            if height >= 2016:
+                window = headers[height - constants.net.LWMA_AVERAGING_WINDOW - 1:]
+                target = blockchain.LWMAState(window).get_next_target()
+                header['bits'] = Blockchain.target_to_bits(target)
+                target = Blockchain.bits_to_target(header['bits'])
+                while int.from_bytes(blockchain.getPoWHash(blockchain.serialize_header(header)), 'little') > target:
+                    header['nonce'] += 1
+            prev_hash = hash_header(header)
+            headers.append(header)
+        self.headers = headers
+
+        class SnapshotNet(constants.BitcoinMainnet):
+            GENESIS = hash_header(headers[0])
+            CHECKPOINTS = [[hash_header(headers[2015]), max_target, headers[2015]['timestamp']]]
+            TARGET_DISRUPTION_HEIGHT1 = TARGET_DISRUPTION_HEIGHT3 = TARGET_DISRUPTION_HEIGHT4 = 0
+            TARGET_DISRUPTION_HEIGHT5 = TARGET_DISRUPTION_14_TO_36_END = 0
+        SnapshotNet.set_as_network()
+        self.addCleanup(constants.BitcoinMainnet.set_as_network)
+
+        self.privkey = ECPrivkey(bytes([1] * 32))
+        self.signer = bitcoin.pubkey_to_address('p2pkh', self.privkey.get_public_key_hex(compressed=True))
+        self.chainwork = 2016 * blockchain.chainwork_of_target(max_target) + sum(
+            blockchain.chainwork_of_target(Blockchain.bits_to_target(h['bits'])) for h in headers[2016:])
+
+    def _make_snapshot(self, headers: list, *, chainwork: int = None) -> blockchain.HeadersSnapshot:
+        snapshot = blockchain.HeadersSnapshot(
+            first_height=0, data=b''.join(map(blockchain.serialize_header, headers)),
+            chainwork=chainwork or self.chainwork, max_checkpoint=constants.net.max_checkpoint())
+        signature = bitcoin.ecdsa_sign_usermessage(self.privkey, snapshot.message_to_sign(), is_compressed=True)
+        return snapshot._replace(signer=self.signer, signature=signature)
+
+    def _init_best_chain(self, snapshot: blockchain.HeadersSnapshot, *, trusted_signers: list) -> Blockchain:
+        config = SimpleConfig({'electrum_path': self.electrum_path, 'headers_snapshot_signers': trusted_signers})
+        with open(os.path.join(self.electrum_path, blockchain.HEADERS_SNAPSHOT_FILENAME), 'wb') as f:
+            f.write(snapshot.serialize())
+        blockchain.blockchains[constants.net.GENESIS] = chain = Blockchain(
+            config=config, forkpoint=0, parent=None, forkpoint_hash=constants.net.GENESIS, prev_hash=None)
+        blockchain.init_headers_file_for_best_chain()
+        return chain
+
+    def test_import_on_first_start(self):
+        snapshot = self._make_snapshot(self.headers)
+        self.assertEqual(snapshot, blockchain.HeadersSnapshot.deserialize(snapshot.serialize()))
+        chain = self._init_best_chain(snapshot, trusted_signers=[self.signer])
+        tip = len(self.headers) - 1
+        self.assertEqual(tip, chain.height())
+        self.assertEqual(hash_header(self.headers[tip]), chain.get_hash(tip))
+        self.assertEqual(self.chainwork, chain.get_chainwork())
+        self.assertEqual(snapshot._replace(signer=None, signature=None), chain.get_headers_snapshot())
+        # retargets continue from the imported headers
+        self.assertTrue(chain.can_connect(self.headers[tip], check_height=False))
+
+    def test_rejected_snapshots_are_not_imported(self):
+        snapshot = self._make_snapshot(self.headers)
+        chain = self._init_best_chain(snapshot, trusted_signers=[])
+        self.assertEqual(constants.net.max_checkpoint(), chain.height())
+        with self.assertRaises(blockchain.HeadersSnapshotError):  # invalid signature
+            chain.import_headers_snapshot(snapshot._replace(signature=bytes(65)), trusted_signers=[self.signer])
+        with self.assertRaises(blockchain.HeadersSnapshotError):  # wrong chainwork
+            chain.import_headers_snapshot(self._make_snapshot(self.headers, chainwork=self.chainwork + 1),
+                                          trusted_signers=[self.signer])
+        bad_headers = [dict(h) for h in self.headers]
+        bad_headers[-1]['bits'] = self.EASY_BITS
+        with self.assertRaises(InvalidHeader):  # wrong retarget
+            chain.import_headers_snapshot(self._make_snapshot(bad_headers), trusted_signers=[self.signer])
+        self.assertEqual(constants.net.max_checkpoint(), chain.height())
+
+
 class TestVerifyHeader(ElectrumTestCase):
 
     # Data for Bitcoin block header #100.
@@ -458,3 +677,28 @@ class TestVerifyHeader(ElectrumTestCase):
         with self.assertRaises(InvalidHeader):
             self.header["nonce"] = 42
             Blockchain.verify_header(self.header, self.prev_hash, self.target)
+
+    def test_pow_hash_raw_headers_all_implementations(self):
+        data = 2 * bfh(self.valid_header)
+        expected_pow_hash = bfh("cb1cb048098b9b732d0785e7b8d91a6547da7acd170b01d02fa79d8ef4d2bbb4")[::-1]
+        self.assertIn('python', blockchain.POW_HASH_BACKENDS)
+        for backend in blockchain.POW_HASH_BACKENDS:
+            with self.subTest(backend=backend), mock.patch.object(blockchain, '_pow_hash_backend', backend):
+                self.assertEqual(backend, blockchain.get_pow_hash_backend())
+                self.assertEqual([expected_pow_hash, expected_pow_hash], blockchain.pow_hash_raw_headers(data))
+        with self.assertRaises(InvalidHeader):
+            blockchain.pow_hash_raw_headers(data[:-1])
+
+    async def test_pow_hash_raw_headers_in_executor(self):
+        data = 5 * bfh(self.valid_header)
+        expected = blockchain.pow_hash_raw_headers(data)
+        # in a thread
+        self.assertEqual((None, 1), util.get_worker_pool())
+        self.assertEqual(expected, await blockchain.pow_hash_raw_headers_in_executor(data))
+        # in worker processes
+        with mock.patch.object(util, '_worker_processes_enabled', True):
+            try:
+                self.assertIsNotNone(util.get_worker_pool()[0])
+                self.assertEqual(expected, await blockchain.pow_hash_raw_headers_in_executor(data))
+            finally:
+                util.shutdown_worker_pool()
@@ -0,0 +1,173 @@
+import asyncio
+import os
+import sqlite3
+from unittest import mock
+
+from electrum_cat import util
+from electrum_cat.channel_db import ChannelDB
+from electrum_cat.constants import BitcoinTestnet
+from electrum_cat.lnmsg import decode_msg, encode_msg
+from electrum_cat.lnutil import ShortChannelID, LnFeatures
+from electrum_cat.simple_config import SimpleConfig
+
+from . import ElectrumTestCase
+
+
+def node(character: str) -> bytes:
+    return b'\x02' + f'{character}'.encode() * 32
+
+
+def channel(number: int) -> ShortChannelID:
+    return ShortChannelID.from_components(100, number, 0)
+
+
+def decode(raw: bytes) -> dict:
+    payload = decode_msg(raw)[1]
+    payload['raw'] = raw
+    return payload
+
+
+class TestGossipSnapshot(ElectrumTestCase):
+    TESTNET = True
+
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.config = SimpleConfig({'electrum_path': self.electrum_path})
+        self.cdb = None
+
+    async def asyncTearDown(self):
+        if self.cdb:
+            await self.stop_db()
+        await super().asyncTearDown()
+
+    async def open_db(self, *, load: bool = True) -> ChannelDB:
+        class fake_network:
+            config = self.config
+            asyncio_loop = util.get_asyncio_loop()
+            interface = None
+        self.cdb = ChannelDB(fake_network())
+        if load:
+            await self.cdb.load_data()
+            await self.cdb.data_loaded.wait()
+        else:
+            self.cdb.data_loaded.set()
+        return self.cdb
+
+    async def stop_db(self):
+        self.cdb.stop()
+        await self.cdb.stopped_event.wait()
+        self.cdb = None
+
+    def add_channel(self, number: int, node1: bytes, node2: bytes):
+        self.cdb.add_channel_announcements(decode(encode_msg(
+            'channel_announcement',
+            node_signature_1=bytes(64), node_signature_2=bytes(64),
+            bitcoin_signature_1=bytes(64), bitcoin_signature_2=bytes(64),
+            len=0, features=b'',
+            chain_hash=BitcoinTestnet.rev_genesis_bytes(),
+            short_channel_id=channel(number),
+            node_id_1=node1, node_id_2=node2,
+            bitcoin_key_1=node1, bitcoin_key_2=node2)))
+
+    def add_node(self, node_id: bytes, alias: str, timestamp: int = 1):
+        features = LnFeatures.VAR_ONION_OPT.to_bytes(8, 'big')
+        self.cdb.add_node_announcements(decode(encode_msg(
+            'node_announcement',
+            signature=bytes(64), flen=len(features), features=features,
+            timestamp=timestamp, node_id=node_id, rgb_color=bytes(3),
+            alias=alias.encode().ljust(32, b'\x00'), addrlen=0, addresses=b'')))
+
+    def add_channel_update(self, number: int, direction: int, fee_base_msat: int, timestamp: int = 1):
+        self.cdb.add_channel_update(decode(encode_msg(
+            'channel_update',
+            signature=bytes(64), chain_hash=BitcoinTestnet.rev_genesis_bytes(),
+            short_channel_id=channel(number), timestamp=timestamp,
+            message_flags=b'\x01', channel_flags=bytes([direction]),
+            cltv_expiry_delta=40, htlc_minimum_msat=1000, fee_base_msat=fee_base_msat,
+            fee_proportional_millionths=10, htlc_maximum_msat=10**9)), verify=False)
+
+    def get_tables(self):
+        return dict(self.cdb._channels), dict(self.cdb._nodes), dict(self.cdb._policies)
+
+    async def create_gossip(self):
+        await self.open_db(load=False)
+        self.add_channel(1, node('a'), node('b'))
+        self.add_channel(2, node('b'), node('c'))
+        for i, node_id in enumerate((node('a'), node('b'), node('c'))):
+            self.add_node(node_id, f'node{i}')
+        for number in (1, 2):
+            for direction in (0, 1):
+                self.add_channel_update(number, direction, fee_base_msat=1000 + number)
+        tables = self.get_tables()
+        await self.cdb.save_snapshot()
+        await self.stop_db()
+        self.assertTrue(os.path.exists(ChannelDB.get_file_path(self.config) + '_snapshot'))
+        return tables
+
+    async def test_load_from_snapshot(self):
+        tables = await self.create_gossip()
+        cdb = await self.open_db()
+        self.assertEqual(tables, self.get_tables())
+        self.assertFalse(cdb._snapshot_dirty)  # nothing was decoded
+        self.assertEqual(2, len(tables[0]))
+        self.assertEqual(3, len(tables[1]))
+        self.assertEqual(4, len(tables[2]))
+
+    async def test_rows_newer_than_snapshot_are_decoded(self):
+        await self.create_gossip()
+        snapshot_path = ChannelDB.get_file_path(self.config) + '_snapshot'
+        with open(snapshot_path, 'rb') as f:
+            snapshot = f.read()
+        await self.open_db()
+        self.add_channel(3, node('a'), node('c'))
+        self.add_channel_update(1, 0, fee_base_msat=5000, timestamp=1000)
+        self.cdb.remove_channel(channel(2))
+        tables = self.get_tables()
+        await self.cdb.save_snapshot()
+        await self.stop_db()
+        # as if we had not shut down cleanly, after the snapshot was written
+        with open(snapshot_path, 'wb') as f:
+            f.write(snapshot)
+        cdb = await self.open_db()
+        self.assertTrue(cdb._snapshot_dirty)
+        channels, nodes, policies = self.get_tables()
+        self.assertEqual(tables[0], channels)
+        self.assertEqual(5000, policies[(node('a'), channel(1))].fee_base_msat)
+        self.assertEqual(tables[2], policies)
+
+    async def test_corrupt_snapshot(self):
+        tables = await self.create_gossip()
+        snapshot_path = ChannelDB.get_file_path(self.config) + '_snapshot'
+        with open(snapshot_path, 'rb') as f:
+            snapshot = bytearray(f.read())
+        snapshot[-1] ^= 1
+        with open(snapshot_path, 'wb') as f:
+            f.write(snapshot)
+        cdb = await self.open_db()
+        self.assertEqual(tables, self.get_tables())
+        self.assertTrue(cdb._snapshot_dirty)
+
+    async def test_records_not_stored_yet_are_not_in_snapshot(self):
+        await self.create_gossip()
+        await self.open_db()
+        # the sql row is not written yet when the snapshot is encoded
+        with mock.patch.object(self.cdb, '_db_save_policy'), mock.patch.object(self.cdb, '_db_save_node_info'):
+            self.add_channel_update(1, 0, fee_base_msat=5000, timestamp=1000)
+            self.add_node(node('a'), 'renamed', timestamp=1000)
+        self.cdb._snapshot_dirty = True
+        await self.cdb.save_snapshot()
+        await self.stop_db()
+        cdb = await self.open_db()
+        self.assertTrue(cdb._snapshot_dirty)
+        channels, nodes, policies = self.get_tables()
+        self.assertEqual(1001, policies[(node('a'), channel(1))].fee_base_msat)
+        self.assertEqual('node0', nodes[node('a')].alias)
+
+    async def test_stopped_if_snapshot_fails(self):
+        await self.create_gossip()
+        await self.open_db()
+        self.cdb._snapshot_dirty = True
+        with mock.patch.object(self.cdb, '_encode_snapshot', side_effect=sqlite3.OperationalError('disk I/O error')):
+            self.cdb.stop()
+            await asyncio.wait_for(self.cdb.stopped_event.wait(), timeout=5)
+        self.cdb = None
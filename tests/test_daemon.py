@@ -1,8 +1,12 @@
+import json
 import os
 from typing import Optional, Iterable
 
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
 from electrum_cat.commands import Commands
-from electrum_cat.daemon import Daemon
+from electrum_cat.daemon import Daemon, AuthenticatedServer
 from electrum_cat.simple_config import SimpleConfig
 from electrum_cat.wallet import restore_wallet_from_text, Abstract_Wallet
 from electrum_cat import util
@@ -236,3 +240,37 @@ class TestCommandsWithDaemon(DaemonTestCase):
         # in unit tests or custom code, the "wallet" param is often an Abstract_Wallet:
         self.assertEqual("bitter grass shiver impose acquire brush forget axis eager alone wine silver",
                          await cmds.getseed(wallet=wallet))
+
+
+class TestAuthenticatedServer(ElectrumTestCase):
+
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.server = AuthenticatedServer(rpc_user='user', rpc_password='')  # no auth
+        async def listitems(n):
+            return [{'n': i} for i in range(n)]
+        self.server.register_method(listitems)
+        app = web.Application()
+        app.router.add_post("/", self.server.handle)
+        self.client = TestClient(TestServer(app))
+        await self.client.start_server()
+
+    async def asyncTearDown(self):
+        await self.client.close()
+        await super().asyncTearDown()
+
+    async def test_json_response(self):
+        resp = await self.client.post("/", json={'id': 1, 'method': 'listitems', 'params': [2]})
+        self.assertEqual({'id': 1, 'jsonrpc': '2.0', 'result': [{'n': 0}, {'n': 1}]}, await resp.json())
+
+    async def test_ndjson_response(self):
+        resp = await self.client.post("/", json={'id': 1, 'method': 'listitems', 'params': [3]},
+                                      headers={'Accept': 'application/x-ndjson'})
+        self.assertEqual('application/x-ndjson', resp.content_type)
+        lines = [json.loads(line) async for line in resp.content]
+        self.assertEqual([{'n': 0}, {'n': 1}, {'n': 2}], lines)
+        # errors are not streamed
+        resp = await self.client.post("/", json={'id': 2, 'method': 'listitems', 'params': ['x']},
+                                      headers={'Accept': 'application/x-ndjson'})
+        self.assertEqual('application/json', resp.content_type)
+        self.assertIn('error', await resp.json())
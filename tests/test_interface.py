@@ -1,4 +1,12 @@
-from electrum_cat.interface import ServerAddr
+import asyncio
+import json
+from types import SimpleNamespace
+
+import aiorpcx
+from aiorpcx import NewlineFramer, RPCError
+
+from electrum_cat.interface import ServerAddr, NotificationSession, ResponseTooLarge
+from electrum_cat.logging import get_logger
 
 from . import ElectrumTestCase
 
@@ -46,3 +54,80 @@ class TestServerAddr(ElectrumTestCase):
                          ServerAddr(host="2400:6180:0:d1::86b:e001", port=50002, protocol="s").to_friendly_name())
         self.assertEqual("[2400:6180:0:d1::86b:e001]:50001:t",
                          ServerAddr(host="2400:6180:0:d1::86b:e001", port=50001, protocol="t").to_friendly_name())
+
+
+class _RecordingFramer(NewlineFramer):
+
+    def __init__(self, frames: list):
+        super().__init__()
+        self.frames = frames
+
+    async def receive_message(self):
+        message = await super().receive_message()
+        self.frames.append(json.loads(message))
+        return message
+
+
+class _MockServerSession(aiorpcx.RPCSession):
+
+    frames = []
+
+    def default_framer(self):
+        return _RecordingFramer(self.frames)
+
+    async def handle_request(self, request):
+        if request.method == 'blockchain.scripthash.subscribe':
+            return 'status_' + request.args[0]
+        if request.method == 'large':
+            return request.args[0] * 300_000
+        raise RPCError(1, 'unknown method')
+
+
+class TestNotificationSession(ElectrumTestCase):
+
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        _MockServerSession.frames = self.frames = []
+        self.server = await aiorpcx.serve_rs(_MockServerSession, '127.0.0.1', 0)
+        port = self.server.sockets[0].getsockname()[1]
+        interface = SimpleNamespace(
+            debug=False, logger=get_logger(__name__),
+            network=SimpleNamespace(debug=False, config=SimpleNamespace(NETWORK_MAX_INCOMING_MSG_SIZE=1_000_000)))
+        self.connector = aiorpcx.connect_rs(
+            '127.0.0.1', port, session_factory=lambda *args, **kwargs: NotificationSession(
+                *args, interface=interface, **kwargs))
+        self.session = await self.connector.__aenter__()
+
+    async def asyncTearDown(self):
+        await self.connector.__aexit__(None, None, None)
+        self.server.close()
+        await self.server.wait_closed()
+        await super().asyncTearDown()
+
+    async def test_send_batch_request(self):
+        results = await self.session.send_batch_request('blockchain.scripthash.subscribe', [['a'], ['b']])
+        self.assertEqual(['status_a', 'status_b'], results)
+        self.assertEqual(1, len(self.frames))
+        self.assertEqual(2, len(self.frames[0]))  # a single JSON-RPC batch
+        results = await self.session.send_batch_request('unknown', [[], []])
+        self.assertTrue(all(isinstance(result, RPCError) for result in results))
+
+    async def test_subscribe_batch(self):
+        queue = asyncio.Queue()
+        await self.session.subscribe('blockchain.scripthash.subscribe', ['a'], queue)
+        await self.session.subscribe_batch('blockchain.scripthash.subscribe', [['a'], ['b'], ['c']], queue)
+        self.assertEqual(2, len(self.frames))
+        self.assertEqual(['b', 'c'], [request['params'][0] for request in self.frames[1]])  # 'a' is cached
+        items = [queue.get_nowait() for _ in range(queue.qsize())]
+        self.assertEqual([['a', 'status_a'], ['a', 'status_a'], ['b', 'status_b'], ['c', 'status_c']], items)
+        with self.assertRaises(RPCError):
+            await self.session.subscribe_batch('unknown', [['d']], queue)
+
+    async def test_batch_with_too_large_response_is_split(self):
+        # 4 responses of 300 kB do not fit in a message of 1 MB, 2 of them do
+        results = await self.session.send_batch_request('large', [['a'], ['b'], ['c'], ['d']])
+        self.assertEqual([c * 300_000 for c in 'abcd'], results)
+        self.assertEqual([4, 2, 2], [len(frame) for frame in self.frames])
+        # a single response that is too large cannot be split
+        with self.assertRaises(ResponseTooLarge):
+            await self.session.send_batch_request('large', [['abcd']])
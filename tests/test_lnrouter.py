@@ -211,6 +211,70 @@ class Test_LNRouter(ElectrumTestCase):
         self.assertEqual(node('b'), route[0].node_id)
         self.assertEqual(channel(3), route[0].short_channel_id)
 
+    async def test_find_path_after_graph_updates(self):
+        self.prepare_graph()
+        amount_to_send = 100000
+
+        def find_path():
+            path = self.path_finder.find_path_for_payment(
+                nodeA=node('a'),
+                nodeB=node('e'),
+                invoice_amount_msat=amount_to_send)
+            return [edge.short_channel_id for edge in path]
+
+        def add_chan_upd(short_channel_id, channel_flags, fee_base_msat, timestamp):
+            self.cdb.add_channel_update({'short_channel_id': short_channel_id, 'message_flags': b'\x00', 'channel_flags': channel_flags, 'cltv_expiry_delta': 10, 'htlc_minimum_msat': 250, 'fee_base_msat': fee_base_msat, 'fee_proportional_millionths': 150, 'chain_hash': BitcoinTestnet.rev_genesis_bytes(), 'timestamp': timestamp}, verify=False)
+
+        self.assertEqual([channel(3), channel(2)], find_path())
+        graph = self.path_finder._graph_compiler.get_graph()
+        # B -2-> E becomes expensive
+        add_chan_upd(channel(2), b'\x00', 100_000, timestamp=100)
+        self.assertEqual([channel(6), channel(5)], find_path())
+        self.assertIs(graph, self.path_finder._graph_compiler.get_graph())  # patched in place
+        add_chan_upd(channel(2), b'\x00', 100, timestamp=200)
+        self.assertEqual([channel(3), channel(2)], find_path())
+        # B -2-> E gets disabled
+        add_chan_upd(channel(2), b'\x02', 100, timestamp=300)
+        self.assertEqual([channel(6), channel(5)], find_path())
+        self.assertIsNot(graph, self.path_finder._graph_compiler.get_graph())  # rebuilt without the edge
+        self.cdb.remove_channel(channel(6))
+        self.assertEqual([channel(3), channel(1), channel(7)], find_path())
+
+    async def test_find_route_cache(self):
+        self.prepare_graph()
+        amount_to_send = 100000
+
+        def find_route():
+            route = self.path_finder.find_route(
+                nodeA=node('a'),
+                nodeB=node('e'),
+                invoice_amount_msat=amount_to_send)
+            return route, [edge.short_channel_id for edge in route]
+
+        route, path = find_route()
+        self.assertEqual([channel(3), channel(2)], path)
+        self.assertEqual([channel(3), channel(2)], find_route()[1])
+        stats = self.path_finder.get_route_cache_stats()
+        self.assertEqual((1, 1, 1), (stats['entries'], stats['hits'], stats['misses']))
+        # a failure only invalidates the paths through the failing channel,
+        # the next path is found with Yen's algorithm
+        self.path_finder.update_liquidity_hints(route, amount_to_send, failing_channel=channel(2))
+        self.assertEqual([channel(6), channel(5)], find_route()[1])
+        self.assertEqual([channel(6), channel(5)], find_route()[1])
+        self.path_finder.add_edge_to_blacklist(channel(5))
+        path = find_route()[1]
+        self.assertNotIn(channel(2), path)
+        self.assertNotIn(channel(5), path)
+        self.assertEqual(channel(7), path[-1])
+        stats = self.path_finder.get_route_cache_stats()
+        self.assertEqual((1, 2, 3), (stats['entries'], stats['hits'], stats['misses']))
+        # cached paths are not used after the graph changed
+        self.path_finder.clear_blacklist()
+        self.path_finder.liquidity_hints.reset_liquidity_hints()
+        self.cdb.add_channel_update({'short_channel_id': channel(2), 'message_flags': b'\x00', 'channel_flags': b'\x00', 'cltv_expiry_delta': 10, 'htlc_minimum_msat': 250, 'fee_base_msat': 100_000, 'fee_proportional_millionths': 150, 'chain_hash': BitcoinTestnet.rev_genesis_bytes(), 'timestamp': 100}, verify=False)
+        self.assertEqual([channel(6), channel(5)], find_route()[1])
+        self.assertEqual(4, self.path_finder.get_route_cache_stats()['misses'])
+
     async def test_find_path_for_payment_with_node_filter(self):
         self.prepare_graph()
         amount_to_send = 100000
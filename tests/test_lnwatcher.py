@@ -0,0 +1,147 @@
+import os
+
+from electrum_cat import bitcoin
+from electrum_cat.address_synchronizer import AddressSynchronizer
+from electrum_cat.lnwatcher import LNWatcher
+from electrum_cat.simple_config import SimpleConfig
+from electrum_cat.transaction import Transaction
+from electrum_cat.wallet_db import WalletDB
+
+from . import ElectrumTestCase
+
+
+def make_tx(prevouts, outputs) -> Transaction:
+    """Returns an unsigned tx spending prevouts ((txid, index) tuples)
+    to outputs ((scriptpubkey, value) tuples).
+    """
+    raw = (2).to_bytes(4, 'little')
+    raw += bitcoin.var_int(len(prevouts))
+    for txid, index in prevouts:
+        raw += bytes.fromhex(txid)[::-1] + index.to_bytes(4, 'little') + b'\x00' + b'\xff' * 4
+    raw += bitcoin.var_int(len(outputs))
+    for scriptpubkey, value in outputs:
+        raw += value.to_bytes(8, 'little') + bitcoin.var_int(len(scriptpubkey)) + scriptpubkey
+    raw += bytes(4)
+    return Transaction(raw.hex())
+
+
+class MockNetwork:
+
+    def __init__(self, config):
+        self.config = config
+        self.height = 1000
+
+    def get_local_height(self):
+        return self.height
+
+
+class MockSynchronizer:
+
+    def __init__(self):
+        self.up_to_date = True
+
+    def add(self, address):
+        pass
+
+    def is_up_to_date(self):
+        return self.up_to_date
+
+
+class MockWatcher(LNWatcher):
+    """Records the channels that were checked, instead of sweeping them."""
+
+    def __init__(self, adb, network):
+        LNWatcher.__init__(self, adb, network)
+        # the tests call the event handlers themselves
+        self.unregister_callbacks()
+        self.checked = []
+        self.keep_watching = True
+        self.fail = False
+
+    async def sweep_commitment_transaction(self, funding_outpoint, closing_tx):
+        return self.keep_watching
+
+    async def update_channel_state(self, *, funding_outpoint, **kwargs):
+        self.checked.append(funding_outpoint)
+        if self.fail:
+            raise Exception('update_channel_state failed')
+
+
+class TestLNWatcher(ElectrumTestCase):
+
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        config = SimpleConfig({'electrum_path': self.electrum_path})
+        self.network = MockNetwork(config)
+        self.adb = AddressSynchronizer(WalletDB('', storage=None, upgrade=True), config)
+        self.adb.network = self.network
+        self.adb.synchronizer = MockSynchronizer()
+        self.adb.verifier = MockSynchronizer()
+        self.watcher = MockWatcher(self.adb, self.network)
+        self.outpoints = []
+        for i in range(2):
+            script = os.urandom(33)
+            address = bitcoin.redeem_script_to_address('p2wsh', script)
+            funding_tx = make_tx([(os.urandom(32).hex(), 0)], [(bitcoin.address_to_script(address), 100_000)])
+            outpoint = funding_tx.txid() + ':0'
+            self.watcher.add_channel(outpoint, address)
+            self.adb.add_transaction(funding_tx)
+            self.outpoints.append(outpoint)
+
+    async def add_tx(self, tx):
+        self.adb.add_transaction(tx)
+        await self.watcher.on_event_adb_added_tx(self.adb, tx.txid(), tx)
+
+    async def new_block(self):
+        self.network.height += 1
+        await self.watcher.on_event_blockchain_updated()
+
+    async def test_only_touched_channels_are_checked(self):
+        await self.watcher.trigger_callbacks()
+        self.assertEqual(sorted(self.outpoints), sorted(self.watcher.checked))
+        # open channels are not checked on new blocks
+        self.watcher.checked.clear()
+        await self.new_block()
+        self.assertEqual([], self.watcher.checked)
+        # closing the first channel
+        txid, index = self.outpoints[0].split(':')
+        closing_tx = make_tx([(txid, int(index))], [(bytes.fromhex('0014') + os.urandom(20), 99_000)])
+        await self.add_tx(closing_tx)
+        self.assertEqual([self.outpoints[0]], self.watcher.checked)
+        # closed channels are checked on every block, until they are swept
+        self.watcher.checked.clear()
+        await self.new_block()
+        self.assertEqual([self.outpoints[0]], self.watcher.checked)
+        self.watcher.keep_watching = False
+        await self.new_block()
+        self.watcher.checked.clear()
+        await self.new_block()
+        self.assertEqual([], self.watcher.checked)
+        self.assertEqual(1, len(self.watcher.callbacks))
+
+    async def test_checks_wait_until_up_to_date(self):
+        self.adb.synchronizer.up_to_date = False
+        await self.watcher.trigger_callbacks()
+        self.assertEqual([], self.watcher.checked)
+        self.adb.synchronizer.up_to_date = True
+        await self.watcher.on_event_adb_set_up_to_date(self.adb)
+        self.assertEqual(sorted(self.outpoints), sorted(self.watcher.checked))
+
+    async def test_failed_check_is_run_again(self):
+        await self.watcher.trigger_callbacks()
+        txid, index = self.outpoints[0].split(':')
+        closing_tx = make_tx([(txid, int(index))], [(bytes.fromhex('0014') + os.urandom(20), 99_000)])
+        self.watcher.fail = True
+        self.watcher.checked.clear()
+        with self.assertRaises(Exception):
+            await self.add_tx(closing_tx)
+        self.assertEqual([self.outpoints[0]], self.watcher.checked)
+        # the closed channel is still checked on the next blocks
+        self.watcher.checked.clear()
+        with self.assertRaises(Exception):
+            await self.new_block()
+        self.assertEqual([self.outpoints[0]], self.watcher.checked)
+        self.watcher.fail = False
+        self.watcher.checked.clear()
+        await self.new_block()
+        self.assertEqual([self.outpoints[0]], self.watcher.checked)
@@ -1,11 +1,13 @@
 import asyncio
 import tempfile
+import threading
 import unittest
 
 from electrum_cat import constants
 from electrum_cat.simple_config import SimpleConfig
 from electrum_cat import blockchain
 from electrum_cat.interface import Interface, ServerAddr
+from electrum_cat.network import HeaderSyncScheduler
 from electrum_cat.crypto import sha256
 from electrum_cat.util import OldTaskGroup
 from electrum_cat import util
@@ -127,6 +129,106 @@ class TestNetwork(ElectrumTestCase):
         self.assertEqual(self.interface.q.qsize(), 0)
 
 
+def make_chunk(index: int, branch: str = 'main', num_headers: int = 3) -> str:
+    """Returns the hex of num_headers linked headers, that are different for each branch."""
+    raw = b''
+    prev_hash = bytes(32)
+    for i in range(num_headers):
+        header = ((1).to_bytes(4, 'little') + prev_hash + sha256(f'{branch}{index}{i}'.encode())
+                  + bytes(4) + (0x1d00ffff).to_bytes(4, 'little') + bytes(4))
+        prev_hash = bytes.fromhex(blockchain.hash_raw_header(header))[::-1]
+        raw += header
+    return raw.hex()
+
+
+class MockChunkServer:
+
+    def __init__(self, name: str, tip: int, *, delays: dict = None, bad_indexes=(), branch: str = 'main'):
+        self.server = ServerAddr.from_str(f'{name}:50000:t')
+        self.tip = tip
+        self.delays = delays or {}  # chunk index -> seconds
+        self.bad_indexes = bad_indexes
+        self.branch = branch
+        self.requested = []
+
+    def diagnostic_name(self):
+        return str(self.server)
+
+    def is_connected_and_ready(self):
+        return True
+
+    async def _fetch_chunk(self, height, tip=None):
+        index = height // 2016
+        self.requested.append(index)
+        await asyncio.sleep(self.delays.get(index, 0))
+        data = 'bad' if index in self.bad_indexes else make_chunk(index, self.branch)
+        return 2016, data, None
+
+
+class MockSchedulerNetwork:
+
+    def __init__(self, ifaces):
+        self.interfaces = {iface.server: iface for iface in ifaces}
+        self.interfaces_lock = threading.Lock()
+        self.taskgroup = OldTaskGroup()
+        self.disconnected = []
+
+    async def connection_down(self, iface):
+        self.disconnected.append(iface)
+
+
+class TestHeaderSyncScheduler(ElectrumTestCase):
+    TESTNET = True  # the headers of make_chunk have no PoW
+
+    async def test_chunks_are_spread_and_returned_in_order(self):
+        main = MockChunkServer('main', 10 * 2016)
+        other1 = MockChunkServer('other1', 10 * 2016, delays={1: 0.05})
+        other2 = MockChunkServer('other2', 3 * 2016)  # too low for most chunks
+        network = MockSchedulerNetwork([main, other1, other2])
+        scheduler = HeaderSyncScheduler(network, main, 10 * 2016)
+        try:
+            for index in range(5):
+                (count, data, _), source = await scheduler.get_chunk(index * 2016)
+                self.assertEqual(make_chunk(index), data)
+        finally:
+            await scheduler.close()
+        self.assertTrue(other1.requested)
+        self.assertTrue(all(index * 2016 + 2015 <= other2.tip for index in other2.requested))
+        self.assertEqual(set(range(5)), set(main.requested + other1.requested + other2.requested) & set(range(5)))
+
+    async def _check_rejected_chunk(self, other: MockChunkServer, *, disconnected: bool):
+        main = MockChunkServer('main', 10 * 2016)
+        network = MockSchedulerNetwork([main, other])
+        scheduler = HeaderSyncScheduler(network, main, 10 * 2016)
+        try:
+            for index in range(3):
+                chunk, source = await scheduler.get_chunk(index * 2016)
+                if source == other:
+                    break
+            self.assertEqual(other, source)
+            await scheduler.on_chunk_rejected(index * 2016, source, chunk)
+            (_, data, _), source = await scheduler.get_chunk(index * 2016)
+            self.assertEqual((main, make_chunk(index)), (source, data))
+            await asyncio.sleep(0)
+            self.assertEqual([other] if disconnected else [], network.disconnected)
+            # no more requests to the other server
+            num_requests = len(other.requested)
+            for index in range(index + 1, 6):
+                (_, data, _), source = await scheduler.get_chunk(index * 2016)
+                self.assertEqual((main, make_chunk(index)), (source, data))
+            self.assertEqual(num_requests, len(other.requested))
+        finally:
+            await scheduler.close()
+
+    async def test_invalid_chunk_gets_server_disconnected(self):
+        liar = MockChunkServer('liar', 10 * 2016, bad_indexes=range(10))
+        await self._check_rejected_chunk(liar, disconnected=True)
+
+    async def test_chunk_from_other_branch_does_not_get_server_disconnected(self):
+        other = MockChunkServer('other', 10 * 2016, branch='other')
+        await self._check_rejected_chunk(other, disconnected=False)
+
+
 if __name__ == "__main__":
     constants.BitcoinRegtest.set_as_network()
     unittest.main()
@@ -0,0 +1,124 @@
+import asyncio
+
+from electrum_cat import util
+from electrum_cat.address_synchronizer import AddressSynchronizer
+from electrum_cat.simple_config import SimpleConfig
+from electrum_cat.synchronizer import Synchronizer, TX_RESPONSE_SIZE
+from electrum_cat.wallet_db import WalletDB
+
+from . import ElectrumTestCase
+
+
+class MockNetwork:
+
+    def __init__(self, config):
+        self.config = config
+        self.asyncio_loop = util.get_asyncio_loop()
+        self.interface = None
+
+
+class MockVerifier:
+
+    def is_up_to_date(self):
+        return True
+
+
+class TestSynchronizer(ElectrumTestCase):
+
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        config = SimpleConfig({'electrum_path': self.electrum_path})
+        self.adb = AddressSynchronizer(WalletDB('', storage=None, upgrade=True), config)
+        self.adb.network = MockNetwork(config)
+        self.adb.verifier = MockVerifier()
+        self.adb.synchronizer = Synchronizer(self.adb)
+        self.up_to_date_event = asyncio.Event()
+        self.adb.up_to_date_changed = self.on_up_to_date_changed
+
+    async def asyncTearDown(self):
+        await self.adb.synchronizer.stop()
+        await super().asyncTearDown()
+
+    def on_up_to_date_changed(self):
+        if self.adb.is_up_to_date():
+            self.up_to_date_event.set()
+
+    async def test_wallet_without_addresses_becomes_up_to_date(self):
+        self.assertEqual([], self.adb.get_addresses())
+        task = asyncio.create_task(self.adb.synchronizer.main())
+        try:
+            await asyncio.wait_for(self.up_to_date_event.wait(), timeout=1)
+        finally:
+            task.cancel()
+        self.assertTrue(self.adb.is_up_to_date())
+
+    async def test_requests_are_batched_while_a_batch_is_in_flight(self):
+        batches = []
+        batch_done = asyncio.Event()
+
+        async def send_batch(items):
+            batches.append(list(items))
+            await batch_done.wait()
+            batch_done.clear()
+
+        async def wait_for_batches(num_batches):
+            while len(batches) < num_batches:
+                await asyncio.sleep(0)
+
+        self.adb.synchronizer.batch_size = 2
+        queue = asyncio.Queue()
+        task = asyncio.create_task(self.adb.synchronizer._send_in_batches(queue, send_batch))
+        try:
+            queue.put_nowait(0)
+            await asyncio.wait_for(wait_for_batches(1), timeout=1)
+            for item in range(1, 4):
+                queue.put_nowait(item)
+            await asyncio.sleep(0.01)
+            self.assertEqual([[0]], batches)
+            batch_done.set()
+            await asyncio.wait_for(wait_for_batches(2), timeout=1)
+            batch_done.set()
+            await asyncio.wait_for(wait_for_batches(3), timeout=1)
+        finally:
+            task.cancel()
+        self.assertEqual([[0], [1, 2], [3]], batches)
+
+    async def test_batches_are_capped_by_response_size(self):
+        batches = []
+
+        async def send_batch(items):
+            batches.append(list(items))
+
+        self.adb.synchronizer.max_batch_response_size = 10
+        queue = asyncio.Queue()
+        for size in (4, 4, 4, 20, 1):
+            queue.put_nowait(size)
+        task = asyncio.create_task(self.adb.synchronizer._send_in_batches(queue, send_batch, lambda size: size))
+        try:
+            while sum(map(len, batches)) < 5:
+                await asyncio.sleep(0)
+        finally:
+            task.cancel()
+        # an item larger than the max is sent on its own
+        self.assertEqual([[4, 4], [4], [20], [1]], batches)
+
+    async def test_tx_batches_are_capped_by_response_size(self):
+        synchronizer = self.adb.synchronizer
+        batches = []
+
+        async def get_transactions(items):
+            batches.append(list(items))
+
+        send_in_batches = [synchronizer._send_in_batches(queue, get_transactions, response_size)
+                           for queue, _, response_size in synchronizer._get_batched_requests()
+                           if queue is synchronizer._tx_queue]
+        for i in range(100):
+            synchronizer._tx_queue.put_nowait((f'{i:064x}', None))
+        task = asyncio.create_task(send_in_batches[0])
+        try:
+            while sum(map(len, batches)) < 100:
+                await asyncio.sleep(0)
+        finally:
+            task.cancel()
+        max_txs = synchronizer.max_batch_response_size // TX_RESPONSE_SIZE
+        self.assertEqual([max_txs, max_txs], list(map(len, batches)))
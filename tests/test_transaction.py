@@ -111,6 +111,22 @@ class TestTransaction(ElectrumTestCase):
         tx.update_signatures(signed_blob_signatures)
         self.assertEqual(tx.serialize(), signed_blob)
 
+    def test_partial_txin_psbt_fields_are_allocated_lazily(self):
+        prevout = TxOutpoint(txid=bytes(range(32)), out_idx=1)
+        txin1 = PartialTxInput(prevout=prevout)
+        txin2 = PartialTxInput(prevout=prevout)
+        self.assertEqual({}, vars(txin1))
+        self.assertIsNone(txin1.redeem_script)
+        txin1.sigs_ecdsa[b'pubkey'] = b'sig'
+        txin1.redeem_script = b'script'
+        self.assertEqual({b'pubkey': b'sig'}, txin1.sigs_ecdsa)
+        self.assertEqual({}, txin2.sigs_ecdsa)
+        self.assertIsNone(txin2.redeem_script)
+        self.assertEqual({'sigs_ecdsa', 'redeem_script'}, set(vars(txin1)))
+        # the network fields are slots
+        self.assertFalse(hasattr(TxOutput(scriptpubkey=b'', value=0), '__dict__'))
+        self.assertFalse(hasattr(tx_from_any(signed_blob).inputs()[0], '__dict__'))
+
     def test_tx_setting_locktime_invalidates_ser_cache(self):
         tx = tx_from_any("cHNidP8BAJICAAAAAdAEtnw/IOVkr4oexG2xYnm+Vevsn3J7nbZsGpiBWS8MAQAAAAD9////A2Q5AwAAAAAAF6kUF6jKG6BuNVhq1RilflIDCitepw6H/NEEAAAAAAAXqRQx9SsFxDAaaOWbLB2ely1ZoZ61DYeIbQoAAAAAABYAFItCjFDsC28Z1R3tFaoi//pcInvnI3AZAAABAR+weRIAAAAAABYAFEK0I6qyqoA/lXCEgysQNZvqokaQIgYC9tgRn6/8hlDLEvEg3lKD1HmNim0gGRYwt4x3aJURIq4MqAq7DwEAAAAUAAAAAAAAIgICXYdVjyDIufLQ3yeDA4M8016luFER2SWaGPk6UF8CbuQMqAq7DwEAAAAXAAAAAA==")
         self.assertEqual("2774c819a05e44861a0555401d2741e6c03079cc4d892c69b910c0f52f407859", tx.txid())
@@ -0,0 +1,67 @@
+import os
+
+from electrum_cat.transaction import Transaction
+from electrum_cat.tx_cache import RawTxCache
+
+from . import ElectrumTestCase
+
+
+RAW_TX_1 = '01000000012a5c9a94fcde98f5581cd00162c60a13936ceb75389ea65bf38633b424eb4031000000006c493046022100a82bbc57a0136751e5433f41cf000b3f1a99c6744775e76ec764fb78c54ee100022100f9e80b7de89de861dc6fb0c1429d5da72c2b6b2ee2406bc9bfb1beedd729d985012102e61d176da16edd1d258a200ad9759ef63adf8e14cd97f53227bae35cdb84d2f6ffffffff0140420f00000000001976a914230ac37834073a42146f11ef8414ae929feaafc388ac00000000'
+RAW_TX_2 = '020000000001012005273af813ba23b0c205e4b145e525c280dd876e061f35bff7db9b2e0043640100000000fdffffff02d885010000000000160014e73f444b8767c84afb46ef4125d8b81d2542a53d00e1f5050000000017a914052ed032f5c74a636ed5059611bb90012d40316c870247304402200c628917673d75f05db893cc377b0a69127f75e10949b35da52aa1b77a14c350022055187adf9a668fdf45fc09002726ba7160e713ed79dddcd20171308273f1a2f1012103cb3e00561c3439ccbacc033a72e0513bcfabff8826de0bc651d661991ade6171049e1600'
+
+
+class TestRawTxCache(ElectrumTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.path = os.path.join(self.electrum_path, 'tx_cache')
+        self.txid_1 = Transaction(RAW_TX_1).txid()
+        self.txid_2 = Transaction(RAW_TX_2).txid()
+
+    def test_get_put(self):
+        cache = RawTxCache(self.path, max_disk_size=10_000)
+        self.assertIsNone(cache.get(self.txid_1))
+        cache.put(self.txid_1, RAW_TX_1)
+        self.assertEqual(RAW_TX_1, cache.get(self.txid_1))
+        with self.assertRaises(ValueError):
+            cache.put(self.txid_2, RAW_TX_1)
+        # persisted on disk
+        cache = RawTxCache(self.path, max_disk_size=10_000)
+        self.assertIn(self.txid_1, cache)
+        self.assertEqual(RAW_TX_1, cache.get(self.txid_1))
+        self.assertNotIn(self.txid_2, cache)
+
+    def test_corrupted_file_is_not_returned(self):
+        cache = RawTxCache(self.path, max_disk_size=10_000)
+        cache.put(self.txid_1, RAW_TX_1)
+        filename = os.path.join(self.path, self.txid_1[:2], self.txid_1)
+        with open(filename, 'wb') as f:
+            f.write(bytes.fromhex(RAW_TX_2))
+        cache = RawTxCache(self.path, max_disk_size=10_000)
+        self.assertIsNone(cache.get(self.txid_1))
+        self.assertNotIn(self.txid_1, cache)
+        self.assertFalse(os.path.exists(filename))
+
+    def test_least_recently_used_are_evicted_from_disk(self):
+        size_1, size_2 = len(RAW_TX_1) // 2, len(RAW_TX_2) // 2
+        cache = RawTxCache(self.path, max_disk_size=size_1 + size_2 - 1, max_mem_items=1)
+        cache.put(self.txid_1, RAW_TX_1)
+        cache.put(self.txid_2, RAW_TX_2)
+        self.assertNotIn(self.txid_1, cache)
+        self.assertIn(self.txid_2, cache)
+        # after a restart, the order of use is given by the mtime of the files
+        cache = RawTxCache(self.path, max_disk_size=size_1 + size_2, max_mem_items=1)
+        cache.put(self.txid_1, RAW_TX_1)
+        for txid, mtime in ((self.txid_1, 2_000_000_000), (self.txid_2, 1_000_000_000)):
+            os.utime(os.path.join(self.path, txid[:2], txid), (mtime, mtime))
+        cache = RawTxCache(self.path, max_disk_size=size_1)
+        self.assertIn(self.txid_1, cache)
+        self.assertNotIn(self.txid_2, cache)
+
+    def test_not_persisted(self):
+        cache = RawTxCache(self.path, max_disk_size=10_000)
+        cache.put(self.txid_1, RAW_TX_1, persist=False)
+        self.assertEqual(RAW_TX_1, cache.get(self.txid_1))
+        self.assertFalse(os.path.exists(os.path.join(self.path, self.txid_1[:2], self.txid_1)))
+        cache = RawTxCache(self.path, max_disk_size=10_000)
+        self.assertNotIn(self.txid_1, cache)
@@ -1,4 +1,5 @@
 import shutil
+import sqlite3
 import tempfile
 import sys
 import os
@@ -8,7 +9,7 @@ import time
 from io import StringIO
 import asyncio
 
-from electrum_cat.storage import WalletStorage
+from electrum_cat.storage import WalletStorage, StorageEncryptionVersion
 from electrum_cat.wallet_db import FINAL_SEED_VERSION
 from electrum_cat.wallet import (Abstract_Wallet, Standard_Wallet, create_new_wallet,
                              restore_wallet_from_text, Imported_Wallet, Wallet)
@@ -17,7 +18,7 @@ from electrum_cat.util import TxMinedInfo, InvalidPassword
 from electrum_cat.bitcoin import COIN
 from electrum_cat.wallet_db import WalletDB, JsonDB
 from electrum_cat.simple_config import SimpleConfig
-from electrum_cat import util
+from electrum_cat import util, bitcoin
 from electrum_cat.daemon import Daemon
 from electrum_cat.invoices import PR_UNPAID, PR_PAID, PR_UNCONFIRMED
 from electrum_cat.transaction import tx_from_any
@@ -26,6 +27,10 @@ from electrum_cat.address_synchronizer import TX_HEIGHT_UNCONFIRMED
 from . import ElectrumTestCase
 
 
+RAW_TX_1 = '01000000012a5c9a94fcde98f5581cd00162c60a13936ceb75389ea65bf38633b424eb4031000000006c493046022100a82bbc57a0136751e5433f41cf000b3f1a99c6744775e76ec764fb78c54ee100022100f9e80b7de89de861dc6fb0c1429d5da72c2b6b2ee2406bc9bfb1beedd729d985012102e61d176da16edd1d258a200ad9759ef63adf8e14cd97f53227bae35cdb84d2f6ffffffff0140420f00000000001976a914230ac37834073a42146f11ef8414ae929feaafc388ac00000000'
+RAW_TX_2 = '020000000001012005273af813ba23b0c205e4b145e525c280dd876e061f35bff7db9b2e0043640100000000fdffffff02d885010000000000160014e73f444b8767c84afb46ef4125d8b81d2542a53d00e1f5050000000017a914052ed032f5c74a636ed5059611bb90012d40316c870247304402200c628917673d75f05db893cc377b0a69127f75e10949b35da52aa1b77a14c350022055187adf9a668fdf45fc09002726ba7160e713ed79dddcd20171308273f1a2f1012103cb3e00561c3439ccbacc033a72e0513bcfabff8826de0bc651d661991ade6171049e1600'
+
+
 class FakeSynchronizer(object):
 
     def __init__(self, db):
@@ -88,6 +93,113 @@ class TestWalletStorage(WalletTestCase):
         for key, value in some_dict.items():
             self.assertEqual(d[key], value)
 
+    def test_append_to_encrypted_file(self):
+        storage = WalletStorage(self.wallet_path)
+        storage.set_password('secret', enc_version=StorageEncryptionVersion.USER_PASSWORD)
+        db = JsonDB('', storage=storage)
+        db.put('a', 1)
+        db.write()
+        self.assertFalse(storage.has_appended_data())
+        db.put('b', 2)
+        db.write()
+        self.assertTrue(storage.has_appended_data())
+        # changes were appended as a separate record
+        with open(self.wallet_path, "r") as f:
+            self.assertEqual(2, len(f.read().split('\n')))
+
+        storage = WalletStorage(self.wallet_path)
+        self.assertTrue(storage.is_encrypted_with_user_pw())
+        with self.assertRaises(InvalidPassword):
+            storage.decrypt('wrong')
+        storage.decrypt('secret')
+        db = JsonDB(storage.read(), storage=storage)
+        self.assertEqual(1, db.get('a'))
+        self.assertEqual(2, db.get('b'))
+
+        # a record that was not completely written is dropped
+        db.put('c', 3)
+        db.write()
+        with open(self.wallet_path, "rb+") as f:
+            f.truncate(f.seek(0, os.SEEK_END) - 10)
+        storage = WalletStorage(self.wallet_path)
+        storage.decrypt('secret')
+        self.assertFalse(storage.can_append())
+        db = JsonDB(storage.read(), storage=storage)
+        self.assertEqual(2, db.get('b'))
+        self.assertIsNone(db.get('c'))
+
+    def test_sqlite_storage(self):
+        tx_1, tx_2 = tx_from_any(RAW_TX_1), tx_from_any(RAW_TX_2)
+        txid_1, txid_2 = tx_1.txid(), tx_2.txid()
+        storage = WalletStorage(self.wallet_path)
+        db = WalletDB('', storage=storage, upgrade=True)
+        db.put('a', 1)
+        db.add_transaction(txid_1, tx_1)
+        db.add_txo_addr(txid_1, 'addr', 0, 1000, False)
+        db.write()
+        db.convert_storage_to_sqlite()
+        self.assertTrue(storage.is_sqlite())
+
+        # items of large dicts are decoded when accessed
+        storage = WalletStorage(self.wallet_path)
+        self.assertTrue(storage.is_sqlite())
+        self.assertFalse(storage.is_encrypted())
+        db = WalletDB(storage.read(), storage=storage)
+        self.assertEqual(1, db.get('a'))
+        self.assertEqual(RAW_TX_1, db.get_transaction(txid_1).serialize())
+        self.assertEqual({0: (1000, False)}, db.get_txo_addr(txid_1, 'addr'))
+        # changed rows are written
+        db.put('a', 2)
+        db.add_transaction(txid_2, tx_2)
+        db.add_txo_addr(txid_2, 'addr', 1, 2000, False)
+        db.remove_txo(txid_1)
+        db.remove_transaction(txid_1)
+        db.write()
+
+        storage = WalletStorage(self.wallet_path)
+        db = WalletDB(storage.read(), storage=storage)
+        # copy and setdefault load the values
+        self.assertEqual(bytes.fromhex(RAW_TX_2), db.data['transactions'].setdefault(txid_2).raw)
+        self.assertEqual({'addr': {'1': [2000, False]}}, db.data['txo'].copy()[txid_2])
+        self.assertEqual(2, db.get('a'))
+        self.assertEqual({txid_2}, set(db.list_transactions()))
+        self.assertEqual(RAW_TX_2, db.get_transaction(txid_2).serialize())
+        self.assertEqual({1: (2000, False)}, db.get_txo_addr(txid_2, 'addr'))
+
+        storage.close()
+        with self.assertRaises(sqlite3.ProgrammingError):
+            storage.sqlite.get('', 'a')
+        storage = WalletStorage(self.wallet_path)
+        db = WalletDB(storage.read(), storage=storage)
+
+        # encrypted wallets are stored as json
+        storage.set_password('secret', enc_version=StorageEncryptionVersion.USER_PASSWORD)
+        db.set_modified(True)
+        db.write()
+        self.assertFalse(storage.is_sqlite())
+        storage = WalletStorage(self.wallet_path)
+        self.assertTrue(storage.is_encrypted_with_user_pw())
+        storage.decrypt('secret')
+        db = WalletDB(storage.read(), storage=storage)
+        self.assertEqual(2, db.get('a'))
+        self.assertEqual(RAW_TX_2, db.get_transaction(txid_2).serialize())
+
+    def test_transactions_are_kept_serialized(self):
+        tx = tx_from_any(RAW_TX_2)
+        txid = tx.txid()
+        db = WalletDB('', storage=None, upgrade=True)
+        db.add_transaction(txid, tx)
+        self.assertTrue(db.has_transaction(txid))
+        self.assertEqual([(o.scriptpubkey, o.value) for o in tx.outputs()], list(db.get_tx_outputs(txid)))
+        # deserialized again once evicted from the cache
+        db._tx_cache.clear()
+        tx2 = db.get_transaction(txid)
+        self.assertEqual(RAW_TX_2, tx2.serialize())
+        self.assertIs(tx2, db.get_transaction(txid))
+        self.assertEqual(RAW_TX_2, db.remove_transaction(txid).serialize())
+        self.assertFalse(db.has_transaction(txid))
+        self.assertIsNone(db.get_transaction(txid))
+
     async def test_storage_imported_add_privkeys_persistence_test(self):
         text = ' '.join([
             'p2wpkh:L4jkdiXszG26SUYvwwJhzGwg37H2nLhrbip7u6crmgNeJysv5FHL',
@@ -266,6 +378,34 @@ class TestCreateRestoreWallet(WalletTestCase):
         self.assertEqual(text, wallet.keystore.get_seed(None))
         self.assertEqual('bc1q3g5tmkmlvxryhh843v4dz026avatc0zzr6h3af', wallet.get_receiving_addresses()[0])
 
+    async def test_address_table(self):
+        text = 'zpub6nydoME6CFdJtMpzHW5BNoPz6i6XbeT9qfz72wsRqGdgGEYeivso6xjfw8cGcCyHwF7BNW4LDuHF35XrZsovBLWMF4qXSjmhTXYiHbWqGLt'
+        d = restore_wallet_from_text(text, path=self.wallet_path, gap_limit=2, config=self.config)
+        wallet = d['wallet']  # type: Standard_Wallet
+        addrs = wallet.get_addresses()
+        for addr in addrs:
+            scripthash = bitcoin.address_to_scripthash(addr)
+            self.assertEqual(scripthash, wallet.db.get_address_scripthash(addr))
+            self.assertEqual([scripthash], wallet.db.get_scripthashes_for_scripts([bitcoin.address_to_script(addr)]))
+        # loaded addresses are hashed when first used
+        wallet.save_db()
+        db = WalletDB(WalletStorage(self.wallet_path).read(), storage=None, upgrade=True)
+        db.load_addresses('standard')
+        scripthash = bitcoin.address_to_scripthash(addrs[0])
+        self.assertNotIn(addrs[0], db._address_scripts)
+        self.assertEqual(scripthash, db.get_address_scripthash(addrs[0]))
+        self.assertIn(addrs[0], db._address_scripts)
+
+    async def test_change_gap_limit(self):
+        text = 'zpub6nydoME6CFdJtMpzHW5BNoPz6i6XbeT9qfz72wsRqGdgGEYeivso6xjfw8cGcCyHwF7BNW4LDuHF35XrZsovBLWMF4qXSjmhTXYiHbWqGLt'
+        d = restore_wallet_from_text(text, path=self.wallet_path, gap_limit=5, config=self.config)
+        wallet = d['wallet']  # type: Standard_Wallet
+        self.assertEqual(5, len(wallet.get_receiving_addresses()))
+        self.assertTrue(wallet.change_gap_limit(30))
+        addrs = wallet.get_receiving_addresses()
+        self.assertEqual([wallet.derive_address(0, i) for i in range(30)], addrs)
+        self.assertEqual((0, 29), wallet.get_address_index(addrs[29]))
+
     async def test_restore_wallet_from_text_xpub(self):
         text = 'zpub6nydoME6CFdJtMpzHW5BNoPz6i6XbeT9qfz72wsRqGdgGEYeivso6xjfw8cGcCyHwF7BNW4LDuHF35XrZsovBLWMF4qXSjmhTXYiHbWqGLt'
         d = restore_wallet_from_text(text, path=self.wallet_path, gap_limit=1, config=self.config)
@@ -4182,6 +4182,121 @@ class TestWalletHistory_DoubleSpend(ElectrumTestCase):
         w.adb.add_transaction(txC)
         self.assertEqual(999890, sum(w.get_balance()))
 
+    @mock.patch.object(wallet.Abstract_Wallet, 'save_db')
+    async def test_add_transactions_batch(self, mock_save_db):
+        w = restore_wallet_from_text("small rapid pattern language comic denial donate extend tide fever burden barrel",
+                                     path='if_this_exists_mocking_failed_648151893',
+                                     gap_limit=5,
+                                     config=self.config)['wallet']  # type: Abstract_Wallet
+        txid_A = "a3849040f82705151ba12a4389310b58a17b78025d81116a3338595bdefa1625"
+        txid_C = "2c9aa33d9c8ec649f9bfb84af027a5414b760be5231fe9eca4a95b9eb3f8a017"
+        txA, txC = Transaction(self.transactions[txid_A]), Transaction(self.transactions[txid_C])
+        # the child comes first: txs are sorted before being added
+        with mock.patch.object(util, 'trigger_callback') as trigger_callback:
+            self.assertEqual({txid_A, txid_C}, w.adb.add_transactions([txC, txA]))
+        trigger_callback.assert_called_once_with('adb_added_txs', w.adb, [(txid_A, txA), (txid_C, txC)])
+        # only the txs that were not stored yet are reported
+        txid_B = "0e2182ead6660790290371516cb0b80afa8baebd30dad42b5e58a24ceea17f1c"
+        w.adb.remove_transaction(txid_C)
+        txB = Transaction(self.transactions[txid_B])
+        with mock.patch.object(util, 'trigger_callback') as trigger_callback:
+            self.assertEqual({txid_B}, w.adb.add_transactions([txA, txB]))
+        trigger_callback.assert_called_once_with('adb_added_txs', w.adb, [(txid_B, txB)])
+        with mock.patch.object(util, 'trigger_callback') as trigger_callback:
+            self.assertEqual(set(), w.adb.add_transactions([txA, txB]))
+        trigger_callback.assert_not_called()
+        w.adb.remove_transaction(txid_B)
+        w.adb.add_transaction(txC)
+        self.assertEqual(999890, sum(w.get_balance()))
+        self.assertEqual({txid_A, txid_C}, {item.txid for item in w.adb.get_history(w.get_addresses())})
+
+    @mock.patch.object(wallet.Abstract_Wallet, 'save_db')
+    async def test_utxo_index_is_kept_in_sync_with_history(self, mock_save_db):
+        w = restore_wallet_from_text("small rapid pattern language comic denial donate extend tide fever burden barrel",
+                                     path='if_this_exists_mocking_failed_648151893',
+                                     gap_limit=5,
+                                     config=self.config)['wallet']  # type: Abstract_Wallet
+        adb = w.adb
+
+        def check_index():
+            for addr in w.get_addresses():
+                received, sent = adb.get_addr_io(addr)
+                outputs = adb.get_addr_outputs(addr)
+                self.assertEqual(set(received), {prevout.to_str() for prevout in outputs})
+                self.assertEqual({k for k in received if k not in sent},
+                                 {prevout.to_str() for prevout in adb.get_addr_utxo(addr)})
+            # rebuilding the index from the db gives the same result
+            index = adb._coins, adb._spent_coins, {k: v for k, v in adb._utxos_by_addr.items() if v}
+            adb.load_utxo_index()
+            self.assertEqual(index, (adb._coins, adb._spent_coins, {k: v for k, v in adb._utxos_by_addr.items() if v}))
+
+        txB = Transaction(self.transactions["0e2182ead6660790290371516cb0b80afa8baebd30dad42b5e58a24ceea17f1c"])
+        adb.add_transaction(txB)  # child first
+        txA = Transaction(self.transactions["a3849040f82705151ba12a4389310b58a17b78025d81116a3338595bdefa1625"])
+        adb.add_transaction(txA)
+        check_index()
+        self.assertEqual(1, len(w.get_utxos()))
+        adb.remove_transaction(txB.txid())
+        check_index()
+        self.assertEqual(1, len(w.get_utxos()))
+        txC = Transaction(self.transactions["2c9aa33d9c8ec649f9bfb84af027a5414b760be5231fe9eca4a95b9eb3f8a017"])
+        adb.add_transaction(txC)
+        check_index()
+        self.assertEqual(999890, sum(w.get_balance()))
+
+    @mock.patch.object(wallet.Abstract_Wallet, 'save_db')
+    async def test_history_index_is_kept_in_sync(self, mock_save_db):
+        self.config.WALLET_HISTORY_SANITY_CHECK = True
+        w = restore_wallet_from_text("small rapid pattern language comic denial donate extend tide fever burden barrel",
+                                     path='if_this_exists_mocking_failed_648151893',
+                                     gap_limit=5,
+                                     config=self.config)['wallet']  # type: Abstract_Wallet
+        adb = w.adb
+        txid_A = "a3849040f82705151ba12a4389310b58a17b78025d81116a3338595bdefa1625"
+        txid_B = "0e2182ead6660790290371516cb0b80afa8baebd30dad42b5e58a24ceea17f1c"
+        txid_C = "2c9aa33d9c8ec649f9bfb84af027a5414b760be5231fe9eca4a95b9eb3f8a017"
+        adb.add_transaction(Transaction(self.transactions[txid_B]))
+        self.assertEqual([txid_B], [item.txid for item in adb.get_history(w.get_addresses())])
+        adb.add_transaction(Transaction(self.transactions[txid_A]))
+        # both local
+        hist = adb.get_history(w.get_addresses())
+        self.assertEqual({txid_A, txid_B}, {item.txid for item in hist})
+        # A gets mined
+        adb.add_verified_tx(txid_A, TxMinedInfo(height=1000, timestamp=1_600_000_000, txpos=1, header_hash='00' * 32))
+        hist = adb.get_history(w.get_addresses())
+        self.assertEqual([txid_A, txid_B], [item.txid for item in hist])
+        self.assertEqual([1000000, 1000000 + hist[1].delta], [item.balance for item in hist])
+        self.assertEqual(0, w.balance_at_timestamp(w.get_addresses(), 1_500_000_000))
+        self.assertEqual(1000000, w.balance_at_timestamp(w.get_addresses(), 1_600_000_000))
+        # B gets replaced by C
+        adb.remove_transaction(txid_B)
+        adb.add_transaction(Transaction(self.transactions[txid_C]))
+        hist = adb.get_history(w.get_addresses())
+        self.assertEqual([txid_A, txid_C], [item.txid for item in hist])
+        self.assertEqual(999890, hist[-1].balance)
+        # pages
+        domain = w.get_addresses()
+        self.assertEqual([txid_A], [item.txid for item in adb.get_history(domain, limit=1)])
+        page = adb.get_history(domain, after_txid=txid_A, limit=1)
+        self.assertEqual([txid_C], [item.txid for item in page])
+        self.assertEqual(999890, page[0].balance)
+        self.assertEqual([], adb.get_history(domain, after_txid=txid_C, limit=1))
+        self.assertEqual([txid_A, txid_C], [item.txid for item in adb.get_history(domain, from_height=1000)])
+        self.assertEqual([txid_C], [item.txid for item in adb.get_history(domain, from_height=1001)])
+        self.assertEqual([txid_A], [item.txid for item in adb.get_history(domain, to_height=1001)])
+        self.assertEqual([], adb.get_history(domain, to_height=1000))
+        with self.assertRaises(KeyError):
+            adb.get_history(domain, after_txid=txid_B)
+        self.assertEqual([txid_C], list(w.get_onchain_history(after_txid=txid_A, limit=10)))
+        # C is mined in a block with an earlier timestamp: pages have the same monotonic timestamps
+        adb.add_verified_tx(txid_C, TxMinedInfo(height=1001, timestamp=1_599_999_000, txpos=1, header_hash='00' * 32))
+        full = w.get_onchain_history()
+        self.assertEqual(1_600_000_000, full[txid_C].monotonic_timestamp)
+        self.assertEqual(full[txid_C], w.get_onchain_history(after_txid=txid_A, limit=10)[txid_C])
+        # a subset of the domain is indexed separately
+        hist = adb.get_history(w.get_addresses()[:1])
+        self.assertEqual(sum(item.delta for item in hist), hist[-1].balance if hist else 0)
+
 
 class TestWalletHistory_HelperFns(ElectrumTestCase):
     TESTNET = True